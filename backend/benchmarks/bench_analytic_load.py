@@ -0,0 +1,95 @@
+"""Measure the load of a large csv file into its own analytic table.
+
+A synthetic sales csv is written to a temporary directory, then loaded with Analytic.load_csv. The report gives
+the load time per million rows, the peak RSS of the process, the inferred column types and the indexed columns.
+The file is generated row by row, so the peak RSS is the one of the load.
+
+Usage:
+    uv run python benchmarks/bench_analytic_load.py --rows 10000000
+"""
+import argparse
+import csv
+import json
+import tempfile
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+import numpy as np
+from bench_retrieval import peak_rss_bytes
+
+from wrangler.repository.analytic import Analytic
+
+COUNTRIES = ["Belgium", "France", "Germany", "Italy", "Netherlands", "Spain", "UK", "Malta"]
+SEGMENTS = ["Low", "Medium", "High"]
+CHANNELS = ["web", "mobile", "retail", "partner"]
+
+
+def write_csv(path: Path, rows: int, seed: int) -> None:
+    rng = np.random.default_rng(seed)
+    start = date(2015, 1, 1)
+    with path.open("w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["Order ID", "Customer", "Country", "Segment", "Channel", "Amount", "Quantity", "Order Date"])
+        # generated by blocks of vectors, the rows are formatted as they are written
+        for offset in range(0, rows, 100_000):
+            size = min(100_000, rows - offset)
+            customers = rng.integers(0, 1_000_000, size)
+            countries = rng.integers(0, len(COUNTRIES), size)
+            segments = rng.integers(0, len(SEGMENTS), size)
+            channels = rng.integers(0, len(CHANNELS), size)
+            amounts = np.round(rng.lognormal(3, 1, size), 2)
+            quantities = rng.integers(1, 20, size)
+            days = rng.integers(0, 3650, size)
+            writer.writerows(
+                (
+                    offset + index,
+                    f"customer-{customers[index]}",
+                    COUNTRIES[countries[index]],
+                    SEGMENTS[segments[index]],
+                    CHANNELS[channels[index]],
+                    amounts[index],
+                    quantities[index],
+                    (start + timedelta(days=int(days[index]))).strftime("%d/%m/%Y"),
+                )
+                for index in range(size)
+            )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        csv_path = Path(directory) / "sales.csv"
+        write_csv(csv_path, args.rows, args.seed)
+        rss_before = peak_rss_bytes()
+
+        analytic = Analytic(Path(directory) / "analytic.sqlite")
+        start = time.perf_counter()
+        analytic.load_csv(csv_path)
+        seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        analytic.load_csv(csv_path)
+        unchanged_seconds = time.perf_counter() - start
+
+        schema = analytic.get_table_schema("sales")
+        report = {
+            "rows": analytic.execute_query("SELECT COUNT(*) FROM sales")[0][0],
+            "csv_bytes": csv_path.stat().st_size,
+            "seconds": seconds,
+            "seconds_per_million_rows": seconds / args.rows * 1_000_000,
+            "unchanged_reload_seconds": unchanged_seconds,
+            "peak_rss_bytes": peak_rss_bytes(),
+            "generator_peak_rss_bytes": rss_before,
+            "columns": {column["column_name"]: column["data_type"] for column in schema["columns"]},
+            "indexed_columns": schema["indexed_columns"],
+        }
+        analytic.close()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
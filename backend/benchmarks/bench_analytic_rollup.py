@@ -0,0 +1,130 @@
+"""Compare the latency of dashboard aggregates over products answered by a full scan and by the rollup.
+
+A synthetic products csv is loaded with Analytic.load_csv, which maintains the rollup through its triggers,
+then each query runs repeatedly with and without the rollup rewrite. The report gives the p50 and p95 latencies
+of both and checks that they return the same rows, the command fails when they do not.
+
+Usage:
+    uv run python benchmarks/bench_analytic_rollup.py --products 1000000 --repeat 200
+"""
+import argparse
+import csv
+import json
+import math
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+import numpy as np
+
+from wrangler.repository.analytic import Analytic
+from wrangler.repository.rollup import ProductRollup
+
+COUNTRIES = ["Belgium", "France", "Germany", "Italy", "Netherlands", "Spain", "UK", "Malta"]
+SEGMENTS = ["Low", "Medium", "High"]
+QUERIES = {
+    "turnover_by_segment": "SELECT segment, SUM(turnover) AS total_turnover FROM products WHERE country = 'Belgium' GROUP BY segment",
+    "count_by_country": "SELECT country, COUNT(*) AS products FROM products GROUP BY country ORDER BY products DESC",
+    "average_by_year": (
+        "SELECT STRFTIME('%Y', launch_date) AS year, AVG(turnover) AS average_turnover FROM products "
+        "WHERE launch_date >= '2015-01-01' GROUP BY year ORDER BY year"
+    ),
+    "total_in_2020": (
+        "SELECT SUM(turnover) AS total_turnover FROM products "
+        "WHERE launch_date >= '2020-01-01' AND launch_date < '2021-01-01' AND segment = 'High'"
+    ),
+    # the year compared to numbers, where the rollup has to follow the comparison rules of the STRFTIME expression
+    "year_equals_number": (
+        "SELECT country, SUM(turnover) AS total_turnover FROM products "
+        "WHERE STRFTIME('%Y', launch_date) = 2020 GROUP BY country ORDER BY country"
+    ),
+    "year_having_number": (
+        "SELECT STRFTIME('%Y', launch_date) AS year, COUNT(*) AS products FROM products "
+        "GROUP BY year HAVING year > 2020 ORDER BY year"
+    ),
+    "year_as_integer": (
+        "SELECT CAST(STRFTIME('%Y', launch_date) AS INTEGER) AS year, SUM(turnover) AS total_turnover FROM products "
+        "WHERE CAST(STRFTIME('%Y', launch_date) AS INTEGER) >= 2020 GROUP BY year ORDER BY year"
+    ),
+}
+
+
+def write_products(path: Path, products: int, seed: int) -> None:
+    rng = np.random.default_rng(seed)
+    start = date(2000, 1, 1)
+    with path.open("w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["id", "name", "description", "turnover", "launch_date", "country", "segment"])
+        for offset in range(0, products, 100_000):
+            size = min(100_000, products - offset)
+            countries = rng.integers(0, len(COUNTRIES), size)
+            segments = rng.integers(0, len(SEGMENTS), size)
+            turnovers = np.round(rng.random(size), 4)
+            days = rng.integers(0, 9000, size)
+            writer.writerows(
+                (
+                    offset + index,
+                    f"Game {offset + index}",
+                    "Synthetic product",
+                    turnovers[index],
+                    (start + timedelta(days=int(days[index]))).isoformat(),
+                    COUNTRIES[countries[index]],
+                    SEGMENTS[segments[index]],
+                )
+                for index in range(size)
+            )
+
+
+def latencies(analytic: Analytic, query: str, repeat: int, rollups: bool) -> tuple[list, dict]:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = analytic.execute_query(query, rollups=rollups)
+        timings.append(time.perf_counter() - start)
+    p50, p95 = np.percentile(timings, [50, 95]) * 1000
+    return rows, {"p50_ms": p50, "p95_ms": p95}
+
+
+def same_rows(left: list, right: list) -> bool:
+    return len(left) == len(right) and all(
+        all(a == b or (isinstance(a, float) and math.isclose(a, b, rel_tol=1e-9)) for a, b in zip(x, y))
+        for x, y in zip(left, right)
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        csv_path = Path(directory) / "products.csv"
+        write_products(csv_path, args.products, args.seed)
+        analytic = Analytic(Path(directory) / "analytic.sqlite")
+        start = time.perf_counter()
+        analytic.load_csv(csv_path)
+        report = {"load_seconds": time.perf_counter() - start, "queries": {}}
+        report["rollup_rows"] = analytic.execute_query(f"SELECT COUNT(*) FROM {ProductRollup.table}")[0][0]
+
+        for name, query in QUERIES.items():
+            # the full scans are slow, they are repeated less
+            scan_rows, scan = latencies(analytic, query, max(1, args.repeat // 20), rollups=False)
+            rollup_rows, rollup = latencies(analytic, query, args.repeat, rollups=True)
+            report["queries"][name] = {
+                "rewritten": ProductRollup.rewrite(query) is not None,
+                "same_rows": same_rows(scan_rows, rollup_rows),
+                "scan": scan,
+                "rollup": rollup,
+            }
+        analytic.close()
+    print(json.dumps(report, indent=2))
+    if not all(result["same_rows"] for result in report["queries"].values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Measure recall@k and throughput of the ivf index against exact search, for a range of nprobe values.
+
+Usage:
+    uv run python benchmarks/bench_ann_recall.py --vectors 100000 --dim 256 --nprobe 1 2 4 8 16 32
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from wrangler.index.exact import ExactIndex
+from wrangler.index.ivf import IVFIndex
+
+
+def make_vectors(rng: np.random.Generator, count: int, dim: int, clusters: int) -> np.ndarray:
+    """gaussian blobs, closer to real embeddings than uniform noise"""
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    vectors = centers[rng.integers(clusters, size=count)] + 0.5 * rng.normal(size=(count, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def recall(expected: list[list[tuple[int, float]]], found: list[list[tuple[int, float]]]) -> float:
+    hits = sum(len({i for i, _ in e} & {i for i, _ in f}) for e, f in zip(expected, found))
+    return hits / sum(len(e) for e in expected)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--vectors", type=int, default=100_000)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--clusters", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nlist", type=int, default=0)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    vectors = make_vectors(rng, args.vectors + args.queries, args.dim, args.clusters)
+    vectors, queries = vectors[:args.vectors], vectors[args.vectors:]
+    ids = np.arange(1, args.vectors + 1, dtype=np.int64)
+
+    exact = ExactIndex(args.dim)
+    exact.add(ids, vectors)
+    start = time.perf_counter()
+    expected = [exact.search(query, args.k) for query in queries]
+    report = {"exact": {"queries_per_second": len(queries) / (time.perf_counter() - start), "recall": 1.0}}
+
+    ivf = IVFIndex(args.dim, nlist=args.nlist, min_train_size=0)
+    start = time.perf_counter()
+    ivf._training_paused = True
+    ivf.add(ids, vectors)
+    ivf.train()
+    report["ivf_train_seconds"] = time.perf_counter() - start
+    report["ivf_lists"] = len(ivf._centroids)
+
+    for nprobe in args.nprobe:
+        ivf.nprobe = nprobe
+        start = time.perf_counter()
+        found = [ivf.search(query, args.k) for query in queries]
+        report[f"ivf_nprobe_{nprobe}"] = {
+            "queries_per_second": len(queries) / (time.perf_counter() - start),
+            f"recall@{args.k}": recall(expected, found),
+        }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
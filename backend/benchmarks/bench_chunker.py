@@ -0,0 +1,46 @@
+"""Measure chunking throughput, one text at a time and batched over several encoding threads.
+
+Usage:
+    uv run python benchmarks/bench_chunker.py --documents 500 --threads 1 2 4 8
+"""
+import argparse
+import json
+import time
+
+from bench_retrieval import Corpus
+
+from wrangler.repository.chunk import Chunker
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--documents", type=int, default=500)
+    parser.add_argument("--words-per-document", type=int, default=2_400)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    texts = list(Corpus(args.seed).documents(args.documents, args.words_per_document))
+    megabytes = sum(len(text.encode("utf-8")) for text in texts) / 1e6
+    # build the token size table outside of the timings
+    Chunker().split(texts[0])
+
+    report = {}
+    start = time.perf_counter()
+    chunks = sum(len(Chunker().split(text)) for text in texts)
+    seconds = time.perf_counter() - start
+    report["split"] = {"documents_per_second": len(texts) / seconds, "megabytes_per_second": megabytes / seconds}
+    for threads in args.threads:
+        start = time.perf_counter()
+        Chunker(threads=threads).split_many(texts)
+        seconds = time.perf_counter() - start
+        report[f"split_many_{threads}_threads"] = {
+            "documents_per_second": len(texts) / seconds,
+            "megabytes_per_second": megabytes / seconds,
+        }
+    report["chunks"] = chunks
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""Measure recall@k, search throughput and store size of reduced embedding dimensions.
+
+A store is filled with full dimension vectors, then migrated by truncation to each dimension like
+`python -m wrangler.repository.migration --truncate` does. The recall is measured against an exact search
+over the full dimension vectors. The vectors are synthetic gaussian blobs, which are not front-loaded like
+text-embedding-3 ones, so the recall of real embeddings shortened by the model is expected to be higher.
+
+Usage:
+    uv run python benchmarks/bench_embedding_dims.py --chunks 20000 --dimensions 1536 1024 512 256
+"""
+import argparse
+import asyncio
+import json
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from bench_ann_recall import make_vectors
+
+from wrangler.embedding.base import BaseEmbedder
+from wrangler.model.chunk import Chunk
+from wrangler.model.document import Document
+from wrangler.repository.chunk import ChunkRepository
+from wrangler.repository.document import DocumentRepository
+from wrangler.repository.migration import migrate_vector_dim
+from wrangler.repository.store import Store
+
+
+class TableEmbedder(BaseEmbedder):
+    """vectors looked up by text, shortened and normalized to the embedder dimension"""
+
+    def __init__(self, vectors: dict[str, np.ndarray], vector_dim: int):
+        super().__init__("table", vector_dim)
+        self.vectors = vectors
+
+    async def embed(self, text: str) -> list[float]:
+        vector = self.vectors[text][:self._vector_dim]
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    async def embed_batch(self, texts: list[str]) -> list[list[float]]:
+        return [await self.embed(text) for text in texts]
+
+
+async def fill(db_path: Path, embedder: TableEmbedder, texts: list[str]) -> None:
+    store = Store(db_path, engine="vec0", vector_dim=embedder.get_vector_dim())
+    chunk_repository = ChunkRepository(store, embedder)
+    document = await DocumentRepository(store, chunk_repository).create(Document(uri="bench://corpus", content=""))
+    for start in range(0, len(texts), 1000):
+        batch = texts[start:start + 1000]
+        await chunk_repository.create_many(
+            [Chunk(document_id=document.id, content=text, metadata={}) for text in batch],
+            await embedder.embed_batch(batch),
+        )
+    store.close()
+
+
+async def run(db_path: Path, embedder: TableEmbedder, queries: list[str], expected: list[set[str]], limit: int) -> dict:
+    store = Store(db_path, engine="vec0", vector_dim=embedder.get_vector_dim())
+    chunk_repository = ChunkRepository(store, embedder)
+    # warm the query embedding cache, only the searches are timed
+    await chunk_repository.search_chunks_many(queries, limit)
+
+    start = time.perf_counter()
+    found = [await chunk_repository.search_chunks(query, limit) for query in queries]
+    results = {"search_chunks_queries_per_second": len(queries) / (time.perf_counter() - start)}
+    hits = sum(len(truth & {chunk.content for chunk, _ in result}) for truth, result in zip(expected, found))
+    results[f"recall@{limit}"] = hits / sum(len(truth) for truth in expected)
+    store.close()
+    results["database_bytes"] = sum(path.stat().st_size for path in db_path.parent.glob(f"{db_path.name}*"))
+    return results
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=20_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--clusters", type=int, default=200)
+    parser.add_argument("--dimensions", type=int, nargs="+", default=[1536, 1024, 512, 256])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    full_dim = max(args.dimensions)
+    vectors = make_vectors(np.random.default_rng(args.seed), args.chunks + args.queries, full_dim, args.clusters)
+    texts = [f"chunk {index}" for index in range(args.chunks)]
+    queries = [f"query {index}" for index in range(args.queries)]
+    table = dict(zip(texts + queries, vectors))
+
+    # the exact neighbours with the full dimension vectors
+    scores = vectors[args.chunks:] @ vectors[:args.chunks].T
+    nearest = np.argpartition(-scores, args.limit - 1, axis=1)[:, :args.limit]
+    expected = [{texts[index] for index in row} for row in nearest.tolist()]
+
+    report = {}
+    with tempfile.TemporaryDirectory() as directory:
+        source = Path(directory) / "full" / "rag.sqlite"
+        source.parent.mkdir()
+        await fill(source, TableEmbedder(table, full_dim), texts)
+        for vector_dim in sorted(args.dimensions, reverse=True):
+            db_path = Path(directory) / str(vector_dim) / "rag.sqlite"
+            shutil.copytree(source.parent, db_path.parent)
+            start = time.perf_counter()
+            if vector_dim != full_dim:
+                await migrate_vector_dim(db_path, vector_dim)
+            migrate_seconds = time.perf_counter() - start
+            report[vector_dim] = await run(db_path, TableEmbedder(table, vector_dim), queries, expected, args.limit)
+            report[vector_dim]["migrate_seconds"] = migrate_seconds
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,227 @@
+"""Benchmark the ingest and search hot paths on synthetic corpora of increasing size.
+
+Each corpus size runs in its own process against a temporary store, embedded with the local embedder so the
+numbers do not depend on the API. For create_chunks_from_document, search_chunks, search_chunks_fts and
+search_chunks_hybrid the report gives the throughput and the p50/p95/p99 latencies, and for each size the peak
+RSS of the process and the size of the store on disk. The query embeddings are warmed before the searches are
+timed, like repeated queries are in production.
+
+The report is written as JSON. Given a previous report as baseline, the throughputs and p95 latencies that got
+worse than the tolerance are listed and the command fails, so regressions can be caught across commits.
+
+Usage:
+    uv run python benchmarks/bench_retrieval.py --chunks 1000 10000 100000 --output report.json
+    uv run python benchmarks/bench_retrieval.py --chunks 1000 10000 100000 --baseline report.json
+"""
+import argparse
+import asyncio
+import json
+import math
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Awaitable, Callable, Iterator
+
+import numpy as np
+
+from wrangler.embedding.local import LocalEmbedder
+from wrangler.model.document import Document
+from wrangler.repository.chunk import ChunkRepository, chunker
+from wrangler.repository.document import DocumentRepository
+from wrangler.repository.profile import ConnectionProfile
+from wrangler.repository.store import Store
+from wrangler.settings import get_settings
+
+OPERATIONS = ["create_chunks_from_document", "search_chunks", "search_chunks_fts", "search_chunks_hybrid"]
+SYLLABLES = ["ka", "lo", "mi", "ne", "ru", "sa", "ti", "vo", "zen", "bar", "dor", "fel", "gri", "hum", "jas", "kor"]
+
+
+class Corpus:
+    """zipf distributed pseudo words, so that a few words are frequent and most are rare, like in real text"""
+
+    def __init__(self, seed: int, vocabulary: int = 20_000, exponent: float = 1.1):
+        self.rng = np.random.default_rng(seed)
+        words = set()
+        while len(words) < vocabulary:
+            words.add("".join(self.rng.choice(SYLLABLES, size=self.rng.integers(2, 5))))
+        self.words = np.array(sorted(words))
+        self.rng.shuffle(self.words)
+        weights = 1.0 / np.arange(1, vocabulary + 1) ** exponent
+        self.weights = weights / weights.sum()
+
+    def text(self, words: int) -> str:
+        return " ".join(self.words[self.rng.choice(len(self.words), size=words, p=self.weights)])
+
+    def documents(self, count: int, words: int) -> Iterator[str]:
+        """generated one at a time, so the corpus itself does not weigh on the peak RSS"""
+        for _ in range(count):
+            yield "\n\n".join(self.text(120) for _ in range(max(1, words // 120)))
+
+    def queries(self, count: int) -> list[str]:
+        # words of the middle of the distribution, neither stop words nor absent from the corpus
+        ranks = self.rng.integers(20, min(2000, len(self.words)), size=(count, 3))
+        return [" ".join(self.words[row]) for row in ranks]
+
+
+async def measure(fn: Callable[..., Awaitable], calls: list[tuple], concurrency: int) -> tuple[list[float], float]:
+    """latency of each call of fn and total seconds, with at most concurrency calls in flight"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def timed(args: tuple) -> None:
+        async with semaphore:
+            start = time.perf_counter()
+            await fn(*args)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(timed(args) for args in calls))
+    return latencies, time.perf_counter() - start
+
+
+def summarize(latencies: list[float], seconds: float) -> dict:
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    return {
+        "calls": len(latencies),
+        "seconds": seconds,
+        "per_second": len(latencies) / seconds,
+        "p50_ms": p50,
+        "p95_ms": p95,
+        "p99_ms": p99,
+    }
+
+
+def peak_rss_bytes() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kibibytes on linux, bytes on macos
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+async def run(options: dict, chunks: int) -> dict:
+    corpus = Corpus(options["seed"])
+    words = options["words_per_document"]
+    # calibrate the number of documents on the chunker, so the store ends up with about the requested chunks
+    chunks_per_document = len(await chunker.chunk(next(Corpus(options["seed"]).documents(1, words))))
+    documents = math.ceil(chunks / chunks_per_document)
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = Path(directory) / "rag.sqlite"
+        embedder = LocalEmbedder(options["vector_dim"])
+        store = Store(db_path, engine=options["engine"], storage=options["storage"], vector_dim=options["vector_dim"])
+        chunk_repository = ChunkRepository(store, embedder)
+        document_repository = DocumentRepository(store, chunk_repository)
+
+        async def ingest(index: int, content: str) -> None:
+            document = await document_repository.create(Document(uri=f"bench://{index}", content=""))
+            await chunk_repository.create_chunks_from_document(document.id, content)
+
+        # documents are generated in batches, the creation of their (empty) rows is part of the timing
+        results = {"documents": documents}
+        latencies, seconds = [], 0.0
+        generated = corpus.documents(documents, words)
+        for start in range(0, documents, 1000):
+            batch = [(index, next(generated)) for index in range(start, min(start + 1000, documents))]
+            batch_latencies, batch_seconds = await measure(ingest, batch, 1)
+            latencies += batch_latencies
+            seconds += batch_seconds
+        results["create_chunks_from_document"] = summarize(latencies, seconds)
+        results["chunks"] = await store.read(lambda db: db.execute("SELECT COUNT(*) FROM chunks").fetchone()[0])
+        results["create_chunks_from_document"]["chunks_per_second"] = results["chunks"] / seconds
+        results["ingest_peak_rss_bytes"] = peak_rss_bytes()
+
+        queries = corpus.queries(options["queries"])
+        await chunk_repository.search_chunks_many(queries, options["limit"])
+        for name in OPERATIONS[1:]:
+            search = getattr(chunk_repository, name)
+            results[name] = summarize(*await measure(search, [(query, options["limit"]) for query in queries], options["concurrency"]))
+
+        store.close()
+        results["peak_rss_bytes"] = peak_rss_bytes()
+        results["disk_bytes"] = sum(path.stat().st_size for path in Path(directory).glob("rag.sqlite*"))
+    return results
+
+
+def run_in_process(options: dict, chunks: int) -> dict:
+    return asyncio.run(run(options, chunks))
+
+
+def metadata(options: dict) -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": sys.version.split()[0],
+        "sqlite": sqlite3.sqlite_version,
+        "options": options,
+        "settings": get_settings().model_dump(),
+        "profile": ConnectionProfile.from_env().model_dump(),
+    }
+
+
+def regressions(report: dict, baseline: dict, tolerance: float) -> list[str]:
+    """operations whose throughput dropped or whose p95 latency grew by more than the tolerance"""
+    found = []
+    for size, results in report["runs"].items():
+        for name in OPERATIONS:
+            before = baseline.get("runs", {}).get(size, {}).get(name)
+            if before is None:
+                continue
+            after = results[name]
+            if after["per_second"] < before["per_second"] * (1 - tolerance):
+                found.append(f"{name} at {size} chunks: {before['per_second']:.1f} -> {after['per_second']:.1f} per second")
+            if after["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+                found.append(f"{name} at {size} chunks: p95 {before['p95_ms']:.2f} -> {after['p95_ms']:.2f} ms")
+    return found
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunks", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--words-per-document", type=int, default=600)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--limit", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--engine", default=get_settings().vector_engine)
+    parser.add_argument("--storage", default=get_settings().vector_storage)
+    parser.add_argument("--vector-dim", type=int, default=get_settings().embedding_dimensions)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path)
+    parser.add_argument("--baseline", type=Path)
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    options = {
+        key: value for key, value in vars(args).items()
+        if key not in {"chunks", "output", "baseline", "tolerance"}
+    }
+    report = {"metadata": metadata(options), "runs": {}}
+    for chunks in args.chunks:
+        # a fresh process per size, so the peak RSS is the one of that size
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+            report["runs"][str(chunks)] = executor.submit(run_in_process, options, chunks).result()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        args.output.write_text(output)
+    else:
+        print(output)
+
+    if args.baseline:
+        found = regressions(report, json.loads(args.baseline.read_text()), args.tolerance)
+        for regression in found:
+            print(f"regression: {regression}", file=sys.stderr)
+        if found:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
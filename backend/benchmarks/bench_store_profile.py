@@ -0,0 +1,84 @@
+"""Compare ingest and search throughput of the tuned sqlite profile against sqlite defaults.
+
+Usage:
+    uv run python benchmarks/bench_store_profile.py --documents 200 --queries 200
+"""
+import argparse
+import asyncio
+import json
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from wrangler.embedding import get_embedder
+from wrangler.embedding.local import LocalEmbedder
+from wrangler.model.document import Document
+from wrangler.repository.chunk import ChunkRepository
+from wrangler.repository.document import DocumentRepository
+from wrangler.repository.profile import ConnectionProfile
+from wrangler.repository.store import Store
+
+WORDS = [
+    "slot", "reel", "payout", "stake", "bonus", "roulette", "wheel", "blackjack", "deck", "poker",
+    "tournament", "jackpot", "scatter", "wild", "spin", "table", "limit", "banker", "player", "edge",
+]
+
+
+def make_document(rng: random.Random, paragraphs: int) -> str:
+    return "\n\n".join(
+        f"# {rng.choice(WORDS).title()} {index}\n" + " ".join(rng.choice(WORDS) for _ in range(120))
+        for index in range(paragraphs)
+    )
+
+
+async def run(profile: ConnectionProfile, documents: list[str], queries: list[str]) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        store = Store(Path(directory) / "rag.sqlite", profile)
+        chunk_repository = ChunkRepository(store, LocalEmbedder(get_embedder().get_vector_dim()))
+        document_repository = DocumentRepository(store, chunk_repository)
+
+        # embed ahead of time, only the writes are timed
+        for content in documents:
+            await chunk_repository.prepare_chunks(content)
+
+        start = time.perf_counter()
+        for index, content in enumerate(documents):
+            await document_repository.create(Document(uri=f"bench://{index}", content=content))
+        ingest_seconds = time.perf_counter() - start
+
+        results = {"ingest_documents_per_second": len(documents) / ingest_seconds}
+        for name, search in [
+            ("search_chunks", chunk_repository.search_chunks),
+            ("search_chunks_fts", chunk_repository.search_chunks_fts),
+            ("search_chunks_hybrid", chunk_repository.search_chunks_hybrid),
+        ]:
+            start = time.perf_counter()
+            await asyncio.gather(*(search(query, 5) for query in queries))
+            results[f"{name}_queries_per_second"] = len(queries) / (time.perf_counter() - start)
+
+        store.close()
+        return results
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--documents", type=int, default=100)
+    parser.add_argument("--paragraphs", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    documents = [make_document(rng, args.paragraphs) for _ in range(args.documents)]
+    queries = [" ".join(rng.choice(WORDS) for _ in range(3)) for _ in range(args.queries)]
+
+    report = {
+        "sqlite_defaults": await run(ConnectionProfile.sqlite_defaults(), documents, queries),
+        "tuned": await run(ConnectionProfile(), documents, queries),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
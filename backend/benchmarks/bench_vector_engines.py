@@ -0,0 +1,88 @@
+"""Compare vector search throughput and store size of the vector engines and storages.
+
+Usage:
+    uv run python benchmarks/bench_vector_engines.py --chunks 20000 --queries 200 --storages float32 int8 binary
+"""
+import argparse
+import asyncio
+import json
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from bench_store_profile import WORDS
+
+from wrangler.embedding import get_embedder
+from wrangler.embedding.local import LocalEmbedder
+from wrangler.model.chunk import Chunk
+from wrangler.model.document import Document
+from wrangler.repository.chunk import ChunkRepository
+from wrangler.repository.document import DocumentRepository
+from wrangler.repository.store import Store
+
+
+async def fill(db_path: Path, storage: str, embedder: LocalEmbedder, chunks: int, rng: random.Random) -> None:
+    store = Store(db_path, engine="vec0", storage=storage)
+    chunk_repository = ChunkRepository(store, embedder)
+    document = await DocumentRepository(store, chunk_repository).create(Document(uri="bench://corpus", content=""))
+    for start in range(0, chunks, 1000):
+        texts = [" ".join(rng.choice(WORDS) for _ in range(40)) + f" {index}" for index in range(start, min(start + 1000, chunks))]
+        await chunk_repository.create_many(
+            [Chunk(document_id=document.id, content=text, metadata={"order": index}) for index, text in enumerate(texts, start)],
+            await embedder.embed_batch(texts),
+        )
+    store.close()
+
+
+async def run(db_path: Path, storage: str, engine: str, embedder: LocalEmbedder, queries: list[str], limit: int) -> dict:
+    start = time.perf_counter()
+    store = Store(db_path, engine=engine, storage=storage)
+    results = {"open_seconds": time.perf_counter() - start}
+    chunk_repository = ChunkRepository(store, embedder)
+    # warm the query embedding cache, only the searches are timed
+    await chunk_repository.search_chunks_many(queries, limit)
+
+    start = time.perf_counter()
+    for query in queries:
+        await chunk_repository.search_chunks(query, limit)
+    results["search_chunks_queries_per_second"] = len(queries) / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(chunk_repository.search_chunks_hybrid(query, limit) for query in queries))
+    results["search_chunks_hybrid_queries_per_second"] = len(queries) / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await chunk_repository.search_chunks_many(queries, limit)
+    results["search_chunks_many_queries_per_second"] = len(queries) / (time.perf_counter() - start)
+
+    store.close()
+    return results
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=20_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--engines", nargs="+", default=["vec0", "exact", "ivf"])
+    parser.add_argument("--storages", nargs="+", default=["float32"])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    embedder = LocalEmbedder(get_embedder().get_vector_dim())
+    queries = [" ".join(rng.choice(WORDS) for _ in range(3)) + f" {index}" for index in range(args.queries)]
+
+    report = {}
+    for storage in args.storages:
+        with tempfile.TemporaryDirectory() as directory:
+            db_path = Path(directory) / "rag.sqlite"
+            await fill(db_path, storage, embedder, args.chunks, random.Random(args.seed))
+            report[storage] = {engine: await run(db_path, storage, engine, embedder, queries, args.limit) for engine in args.engines}
+            report[storage]["database_bytes"] = sum(path.stat().st_size for path in Path(directory).glob("rag.sqlite*"))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
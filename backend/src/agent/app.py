@@ -1,9 +1,23 @@
 
 import pathlib
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Response, Request
 from fastapi.staticfiles import StaticFiles
+from wrangler.openai_client import close_openai_clients
+from wrangler.resources import close_resources, get_resources
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open the shared stores on startup, release them and the pooled OpenAI HTTP connections on shutdown."""
+    get_resources()
+    yield
+    await close_resources()
+    await close_openai_clients()
+
+
 # Define the FastAPI app
-app = FastAPI() 
+app = FastAPI(lifespan=lifespan)
 from src.wrangler.ingest import router as ingest_router
 
 
@@ -13,7 +13,7 @@ from agent.state import (
 from agent.configuration import Configuration
 from agent.router import RouteQuery, question_router
 from wrangler.queryTranslation import translate_query
-from wrangler.ragUtil import RAGUtils
+from wrangler.resources import get_resources
 from wrangler.qa_agent import OpenAIQuestionAnswerAgent
 
 load_dotenv()
@@ -49,13 +49,14 @@ async def format_answer(state: OverallState, config: RunnableConfig) -> OverallS
     
     persona = state["persona"]
     model = state["reasoning_model"]
+    resources = get_resources(config)
     
     if state["tool"] == "rag":
-        qa_agent = OpenAIQuestionAnswerAgent(RAGUtils(), model=model)
+        qa_agent = OpenAIQuestionAnswerAgent(resources.rag, model=model)
         res = await qa_agent.answer(state["messages"][0].content, persona=persona)
         return {"messages": [AIMessage(content=res, tool=state["tool"])]}
     else:
-        res = translate_query(state["messages"][0].content, model=model)
+        res = await translate_query(state["messages"][0].content, model=model, analytic=resources.analytic)
         return {"messages": [AIMessage(content=json.dumps(res), tool=state["tool"])]}
 
 
@@ -1,5 +1,20 @@
+from functools import lru_cache
+
 from wrangler.embedding.base import BaseEmbedder
+from wrangler.settings import get_settings
+from .batching import MicroBatchEmbedder
+from .local import LocalEmbedder
 from .openai import OpenAIEmbedder
 
+
+@lru_cache(maxsize=1)
 def get_embedder() -> BaseEmbedder:
-    return OpenAIEmbedder()
\ No newline at end of file
+    """get the embedder of the process, shared so that concurrent embed calls can be batched together"""
+    settings = get_settings()
+    if settings.embedding_provider == "local":
+        # nothing to gain from batching calls that do not go over the network
+        return LocalEmbedder(settings.embedding_dimensions)
+    embedder = OpenAIEmbedder(vector_dim=settings.embedding_dimensions)
+    if settings.embedding_batch_wait_ms > 0:
+        return MicroBatchEmbedder(embedder, settings.embedding_batch_wait_ms / 1000, settings.embedding_batch_max_items)
+    return embedder
@@ -5,13 +5,19 @@ class BaseEmbedder:
     def __init__(self, model_name: str, vector_dim: int):
         self._model_name = model_name
         self._vector_dim = vector_dim
-    
+
     async def embed(self, text: str) -> list[float]:
         raise NotImplementedError("Subclasses must implement this method")
-    
+
+    async def embed_batch(self, texts: list[str]) -> list[list[float]]:
+        """embed many texts at once, the result keeps the order of the input.
+        Subclasses should override this when their backend accepts several inputs per request.
+        """
+        return [await self.embed(text) for text in texts]
+
     def get_model_name(self) -> str:
         return self._model_name
-    
+
     def get_vector_dim(self) -> int:
         return self._vector_dim
-    
\ No newline at end of file
+
@@ -0,0 +1,87 @@
+import asyncio
+import weakref
+
+from .base import BaseEmbedder
+
+
+class MicroBatchEmbedder(BaseEmbedder):
+    """
+    Embedder wrapper collecting the concurrent embed calls into batched requests.
+    A batch is sent max_wait seconds after its first call or as soon as it holds max_items texts,
+    each caller then gets its own embedding back. embed_batch calls go straight to the wrapped embedder.
+    A failed batch is split in halves sent again, down to single texts, so only the callers of a failing text
+    get its error rather than every caller batched with it.
+    """
+    def __init__(self, embedder: BaseEmbedder, max_wait: float = 0.005, max_items: int = 64):
+        super().__init__(embedder.get_model_name(), embedder.get_vector_dim())
+        self.embedder = embedder
+        self.max_wait = max_wait
+        self.max_items = max_items
+        self.requests = 0
+        self.items = 0
+        # futures belong to an event loop, so each loop collects its own batch
+        self._pending: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, list[tuple[str, asyncio.Future]]]" = weakref.WeakKeyDictionary()
+        self._timers: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.TimerHandle]" = weakref.WeakKeyDictionary()
+        self._sending: set[asyncio.Task] = set()
+
+    async def embed(self, text: str) -> list[float]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        pending = self._pending.setdefault(loop, [])
+        pending.append((text, future))
+        if len(pending) >= self.max_items:
+            self._flush(loop)
+        elif len(pending) == 1:
+            self._timers[loop] = loop.call_later(self.max_wait, self._flush, loop)
+        return await future
+
+    async def embed_batch(self, texts: list[str]) -> list[list[float]]:
+        return await self.embedder.embed_batch(texts)
+
+    def _flush(self, loop: asyncio.AbstractEventLoop) -> None:
+        timer = self._timers.pop(loop, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(loop, [])
+        if not batch:
+            return
+        task = loop.create_task(self._send(batch))
+        self._sending.add(task)
+        task.add_done_callback(self._sending.discard)
+
+    async def _send(self, batch: list[tuple[str, asyncio.Future]]) -> None:
+        # identical texts of a batch are embedded once
+        futures: dict[str, list[asyncio.Future]] = {}
+        for text, future in batch:
+            futures.setdefault(text, []).append(future)
+        self.items += len(batch)
+        await self._send_texts(list(futures), futures)
+
+    async def _send_texts(self, texts: list[str], futures: dict[str, list[asyncio.Future]]) -> None:
+        self.requests += 1
+        try:
+            embeddings = await self.embedder.embed_batch(texts)
+        except Exception as e:
+            if len(texts) > 1:
+                middle = len(texts) // 2
+                await asyncio.gather(self._send_texts(texts[:middle], futures), self._send_texts(texts[middle:], futures))
+                return
+            embeddings = None
+            error = e
+        for index, text in enumerate(texts):
+            for future in futures[text]:
+                # the caller may have been cancelled in the meantime
+                if future.done():
+                    continue
+                if embeddings is None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(embeddings[index])
+
+    def stats(self) -> dict:
+        """number of batched requests sent and of embed calls they served"""
+        return {
+            "requests": self.requests,
+            "items": self.items,
+            "items_per_request": self.items / self.requests if self.requests else 0.0,
+        }
@@ -0,0 +1,63 @@
+import asyncio
+
+import numpy as np
+
+from .base import BaseEmbedder
+
+
+class LocalEmbedder(BaseEmbedder):
+    """
+    Embedder computing hashed character n-gram vectors locally, without any network call.
+    Every n-gram of the casefolded utf-8 text is hashed to a signed bucket of the vector, which is then normalized,
+    so texts sharing many n-grams are close. The vectors are deterministic across processes and a batch is embedded
+    with a few NumPy operations, which makes it suited to benchmarks and offline runs rather than to relevance.
+    """
+    def __init__(self, vector_dim: int = 1536, ngrams: tuple[int, ...] = (3, 4, 5)):
+        super().__init__(f"local-ngram-{'-'.join(map(str, ngrams))}", vector_dim)
+        self.ngrams = ngrams
+
+    async def embed(self, text: str) -> list[float]:
+        return (await self.embed_batch([text]))[0]
+
+    async def embed_batch(self, texts: list[str]) -> list[list[float]]:
+        if not texts:
+            return []
+        return (await asyncio.to_thread(self.encode, texts)).tolist()
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        """embed the texts into a float32 matrix, one normalized row per text"""
+        encoded = [text.casefold().encode("utf-8") for text in texts]
+        data = np.frombuffer(b"".join(encoded), dtype=np.uint8).astype(np.uint64)
+        lengths = np.fromiter((len(text) for text in encoded), dtype=np.int64, count=len(encoded))
+        owners = np.repeat(np.arange(len(texts), dtype=np.int64), lengths)
+
+        counts = np.zeros(len(texts) * self._vector_dim, dtype=np.float64)
+        for n in self.ngrams:
+            starts = len(data) - n + 1
+            if starts <= 0:
+                continue
+            # n-grams spanning two texts are dropped
+            valid = owners[:starts] == owners[n - 1:]
+            hashes = self._hash(data, n, starts)[valid]
+            buckets = (hashes % np.uint64(self._vector_dim)).astype(np.int64)
+            signs = np.where(hashes >> np.uint64(63), -1.0, 1.0)
+            counts += np.bincount(owners[:starts][valid] * self._vector_dim + buckets, weights=signs, minlength=len(counts))
+
+        vectors = counts.reshape(len(texts), self._vector_dim).astype(np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, np.float32(1e-12))
+
+    @staticmethod
+    def _hash(data: np.ndarray, n: int, starts: int) -> np.ndarray:
+        """64 bits hash of the n-gram starting at each of the first starts bytes, uint64 arithmetic wraps around"""
+        with np.errstate(over="ignore"):
+            hashes = np.full(starts, 0xCBF29CE484222325 ^ n, dtype=np.uint64)
+            for offset in range(n):
+                hashes = (hashes ^ data[offset:offset + starts]) * np.uint64(0x100000001B3)
+            # finalizer of splitmix64, spreads the fnv hash over every bit
+            hashes ^= hashes >> np.uint64(30)
+            hashes *= np.uint64(0xBF58476D1CE4E5B9)
+            hashes ^= hashes >> np.uint64(27)
+            hashes *= np.uint64(0x94D049BB133111EB)
+            hashes ^= hashes >> np.uint64(31)
+        return hashes
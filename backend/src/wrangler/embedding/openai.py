@@ -1,16 +1,76 @@
-import os
+import asyncio
+from typing import ClassVar
+
+import tiktoken
 from .base import BaseEmbedder
-from openai import AsyncOpenAI
+from ..openai_client import get_async_openai_client
 
 class OpenAIEmbedder(BaseEmbedder):
     _model: str = "text-embedding-3-small"
     _vector_dim: int = 1536
 
+    # models accepting a dimensions parameter, with their native dimension
+    native_dims: ClassVar[dict[str, int]] = {"text-embedding-3-small": 1536, "text-embedding-3-large": 3072}
+
+    # request limits of the embeddings endpoint
+    max_batch_items: ClassVar[int] = 2048
+    max_batch_tokens: ClassVar[int] = 300_000
+    max_input_tokens: ClassVar[int] = 8191
+    max_concurrent_requests: ClassVar[int] = 4
+
+    encoder: ClassVar[tiktoken.Encoding] = tiktoken.get_encoding("cl100k_base")
+
     def __init__(self, model: str = _model, vector_dim: int = _vector_dim):
+        native_dim = self.native_dims.get(model)
+        if native_dim is not None and not 0 < vector_dim <= native_dim:
+            raise ValueError(f"{model} cannot produce {vector_dim}-dimensional embeddings")
         super().__init__(model, vector_dim)
 
+    def _request_options(self) -> dict:
+        # the model shortens (and normalizes) the embeddings itself, the other models only have their native dimension
+        if self._vector_dim == self.native_dims.get(self._model_name, self._vector_dim):
+            return {"model": self._model_name}
+        return {"model": self._model_name, "dimensions": self._vector_dim}
+
     async def embed(self, text: str) -> list[float]:
-        client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-        response = await client.embeddings.create(input=text, model=self._model)
+        client = get_async_openai_client()
+        response = await client.embeddings.create(input=text, **self._request_options())
         return response.data[0].embedding
-    
\ No newline at end of file
+
+    async def embed_batch(self, texts: list[str]) -> list[list[float]]:
+        """embed the texts with as few requests as the endpoint limits allow"""
+        if not texts:
+            return []
+
+        client = get_async_openai_client()
+        semaphore = asyncio.Semaphore(self.max_concurrent_requests)
+
+        async def embed_slice(start: int, end: int) -> list[list[float]]:
+            async with semaphore:
+                response = await client.embeddings.create(input=texts[start:end], **self._request_options())
+            # the endpoint does not guarantee the order of the returned items
+            return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+        results = await asyncio.gather(*(embed_slice(start, end) for start, end in self._batch_bounds(texts)))
+        return [embedding for batch in results for embedding in batch]
+
+    def _batch_bounds(self, texts: list[str]) -> list[tuple[int, int]]:
+        """split the texts into consecutive slices that fit in a single request"""
+        token_counts = [len(tokens) for tokens in self.encoder.encode_ordinary_batch(texts)]
+        for index, count in enumerate(token_counts):
+            if count > self.max_input_tokens:
+                raise ValueError(f"Input {index} has {count} tokens, the model accepts at most {self.max_input_tokens}")
+
+        bounds = []
+        start = 0
+        batch_tokens = 0
+        for index, count in enumerate(token_counts):
+            batch_full = index - start >= self.max_batch_items or batch_tokens + count > self.max_batch_tokens
+            if index > start and batch_full:
+                bounds.append((start, index))
+                start = index
+                batch_tokens = 0
+            batch_tokens += count
+        bounds.append((start, len(texts)))
+        return bounds
+
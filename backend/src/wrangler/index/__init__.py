@@ -0,0 +1,20 @@
+from pathlib import Path
+
+from wrangler.index.base import VectorIndex
+from wrangler.settings import get_settings
+from .exact import ExactIndex
+from .ivf import IVFIndex
+
+
+def create_vector_index(engine: str, vector_dim: int, path: Path | None = None) -> VectorIndex | None:
+    """create the in-process index of a vector engine, None for vec0 which searches chunk_embeddings directly.
+    path is where the index keeps its files: the memory-mapped matrix of exact, the saved index of ivf.
+    """
+    settings = get_settings()
+    if engine == "vec0":
+        return None
+    if engine == "exact":
+        return ExactIndex(vector_dim, path if settings.vector_index_mmap else None)
+    if engine == "ivf":
+        return IVFIndex(vector_dim, path, settings.vector_index_nlist, settings.vector_index_nprobe)
+    raise ValueError(f"Unknown vector engine {engine}")
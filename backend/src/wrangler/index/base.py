@@ -0,0 +1,105 @@
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+
+class VectorIndex(ABC):
+    """
+    In-process index over the chunk embeddings answering nearest neighbour queries with l2 distances, like vec0.
+    Write jobs stage their changes, which are applied once the writer connection commits them (see Store.write),
+    so searches never see rows of a transaction that was rolled back.
+    version is the vector version of the store the index reflects, None when it missed a change and must be reloaded.
+    """
+    def __init__(self, vector_dim: int):
+        self.vector_dim = vector_dim
+        self.version: int | None = None
+        self._staged: list[tuple[str, tuple]] = []
+        self._lock = threading.RLock()
+
+    def load(self, db: sqlite3.Connection, source: str = "chunk_embeddings", batch_size: int = 10_000,
+             version: int | None = None) -> None:
+        """fill the index with every float32 vector of the source table, read at the given vector version"""
+        self.clear()
+        self.version = version
+        cursor = db.execute(f"SELECT chunk_id, embedding FROM {source}")
+        while rows := cursor.fetchmany(batch_size):
+            ids = np.fromiter((chunk_id for chunk_id, _ in rows), dtype=np.int64, count=len(rows))
+            vectors = np.frombuffer(b"".join(embedding for _, embedding in rows), dtype=np.float32)
+            self.add(ids, vectors.reshape(len(rows), self.vector_dim))
+
+    def stage_add(self, ids: list[int], vectors: list[list[float]]) -> None:
+        """add (or replace) vectors once the current transaction is committed"""
+        self._staged.append(("add", (ids, vectors)))
+
+    def stage_remove(self, ids: list[int]) -> None:
+        """remove vectors once the current transaction is committed"""
+        self._staged.append(("remove", (ids,)))
+
+    def stage_clear(self) -> None:
+        """remove every vector once the current transaction is committed"""
+        self._staged.append(("clear", ()))
+
+    def stage_version(self, before: int, after: int) -> None:
+        """move to the after version once the current transaction is committed, if the index was at before"""
+        self._staged.append(("version", (before, after)))
+
+    def commit(self) -> None:
+        """apply the staged changes"""
+        staged, self._staged = self._staged, []
+        for operation, args in staged:
+            if operation == "add":
+                ids, vectors = args
+                if ids:
+                    self.add(np.asarray(ids, dtype=np.int64), self.as_matrix(vectors))
+            elif operation == "remove":
+                if args[0]:
+                    self.remove(np.asarray(args[0], dtype=np.int64))
+            elif operation == "version":
+                # a change of another process committed in between is not in the index
+                before, after = args
+                self.version = after if self.version == before else None
+            else:
+                self.clear()
+
+    def rollback(self) -> None:
+        """drop the staged changes"""
+        self._staged = []
+
+    def as_matrix(self, vectors) -> np.ndarray:
+        """convert vectors to a contiguous float32 matrix of the index dimension"""
+        matrix = np.ascontiguousarray(vectors, dtype=np.float32).reshape(-1, self.vector_dim)
+        return matrix
+
+    def search(self, query, k: int) -> list[tuple[int, float]]:
+        """the k nearest chunk ids of the query with their distance, nearest first"""
+        return self.search_many(self.as_matrix(query), k)[0]
+
+    def close(self) -> None:
+        """release the index, called when the connection pool of the database closes"""
+        pass
+
+    @abstractmethod
+    def search_many(self, queries, k: int) -> list[list[tuple[int, float]]]:
+        """the k nearest chunk ids of each query with their distance, nearest first"""
+        pass
+
+    @abstractmethod
+    def add(self, ids: np.ndarray, vectors: np.ndarray) -> None:
+        """add vectors, replacing the ones of ids already in the index"""
+        pass
+
+    @abstractmethod
+    def remove(self, ids: np.ndarray) -> None:
+        """remove the vectors of the ids, unknown ids are ignored"""
+        pass
+
+    @abstractmethod
+    def clear(self) -> None:
+        """remove every vector"""
+        pass
+
+    @abstractmethod
+    def __len__(self) -> int:
+        pass
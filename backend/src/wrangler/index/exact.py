@@ -0,0 +1,155 @@
+import itertools
+import sqlite3
+from pathlib import Path
+
+import numpy as np
+
+from .base import VectorIndex
+
+
+class ExactIndex(VectorIndex):
+    """
+    Exact nearest neighbour search over a contiguous float32 matrix, one matrix product and an argpartition per batch.
+    The matrix lives in memory, or in a memory-mapped file next to path when one is given.
+    Removed rows are tombstoned, an updated vector is written to a new row and its previous row tombstoned,
+    and the matrix is compacted once the tombstones take a quarter of it.
+    Searches work on an immutable snapshot, so they run concurrently with the writer without locking: the rows of a
+    published snapshot are never written, the ids and norms are copied before tombstoning them.
+    """
+    def __init__(self, vector_dim: int, path: Path | None = None, initial_capacity: int = 1024):
+        super().__init__(vector_dim)
+        self.path = path
+        self._generation = itertools.count()
+        self._matrix = self._allocate(initial_capacity)
+        self._ids = np.full(initial_capacity, -1, dtype=np.int64)
+        self._norms = np.full(initial_capacity, np.inf, dtype=np.float32)
+        self._rows: dict[int, int] = {}
+        self._size = 0
+        self._loading = False
+        self._publish()
+
+    def _allocate(self, capacity: int) -> np.ndarray:
+        if self.path is None:
+            return np.empty((capacity, self.vector_dim), dtype=np.float32)
+        # a new file per allocation, the previous one stays mapped by the searches still using it
+        file = self.path.with_name(f"{self.path.name}.{next(self._generation)}")
+        matrix = np.memmap(file, dtype=np.float32, mode="w+", shape=(capacity, self.vector_dim))
+        file.unlink()
+        return matrix
+
+    def _publish(self) -> None:
+        if not self._loading:
+            self._snapshot = (self._ids[:self._size], self._matrix[:self._size], self._norms[:self._size])
+
+    def load(self, db: sqlite3.Connection, source: str = "chunk_embeddings", batch_size: int = 10_000,
+             version: int | None = None) -> None:
+        # the searches of a reload keep the previous snapshot until every vector is read, clear allocated new arrays
+        with self._lock:
+            self._loading = True
+            try:
+                super().load(db, source, batch_size, version)
+            finally:
+                self._loading = False
+                self._publish()
+
+    def add(self, ids: np.ndarray, vectors: np.ndarray) -> None:
+        with self._lock:
+            self._append(np.asarray(ids, dtype=np.int64), self.as_matrix(vectors))
+            self._compact_if_sparse()
+            self._publish()
+
+    def _append(self, ids: np.ndarray, vectors: np.ndarray) -> None:
+        """write the vectors to new rows past the published ones and tombstone the rows they replace"""
+        # the last vector of an id given twice wins
+        _, last = np.unique(ids[::-1], return_index=True)
+        keep = np.sort(len(ids) - 1 - last)
+        ids, vectors = ids[keep], vectors[keep]
+        self._tombstone([self._rows[chunk_id] for chunk_id in ids.tolist() if chunk_id in self._rows])
+
+        self._reserve(self._size + len(ids))
+        start, end = self._size, self._size + len(ids)
+        self._matrix[start:end] = vectors
+        self._norms[start:end] = np.einsum("ij,ij->i", vectors, vectors)
+        self._ids[start:end] = ids
+        self._rows.update(zip(ids.tolist(), range(start, end)))
+        self._size = end
+
+    def _tombstone(self, rows: list[int]) -> None:
+        if not rows:
+            return
+        if not self._loading:
+            # the snapshot keeps the arrays it was published with
+            self._ids, self._norms = self._ids.copy(), self._norms.copy()
+        # an infinite norm keeps the row out of every result
+        self._norms[rows] = np.inf
+        self._ids[rows] = -1
+
+    def _reserve(self, capacity: int) -> None:
+        if capacity > len(self._ids):
+            self._resize(max(capacity, 2 * len(self._ids)), slice(None))
+
+    def _resize(self, capacity: int, keep: slice | np.ndarray) -> None:
+        """move the kept rows (a slice or a mask over the rows) to new arrays of the given capacity"""
+        kept_ids = self._ids[:self._size][keep]
+        size = len(kept_ids)
+        matrix = self._allocate(capacity)
+        matrix[:size] = self._matrix[:self._size][keep]
+        ids = np.full(capacity, -1, dtype=np.int64)
+        ids[:size] = kept_ids
+        norms = np.full(capacity, np.inf, dtype=np.float32)
+        norms[:size] = self._norms[:self._size][keep]
+        self._matrix, self._ids, self._norms, self._size = matrix, ids, norms, size
+
+    def remove(self, ids: np.ndarray) -> None:
+        with self._lock:
+            rows = [self._rows.pop(chunk_id) for chunk_id in ids.tolist() if chunk_id in self._rows]
+            if not rows:
+                return
+            self._tombstone(rows)
+            self._compact_if_sparse()
+            self._publish()
+
+    def _compact_if_sparse(self) -> None:
+        if self._size - len(self._rows) > max(1024, self._size // 4):
+            self._compact()
+
+    def _compact(self) -> None:
+        live = self._ids[:self._size] >= 0
+        self._resize(max(1024, 2 * int(live.sum())), live)
+        self._rows = dict(zip(self._ids[:self._size].tolist(), range(self._size)))
+        self._publish()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._rows = {}
+            self._size = 0
+            self._compact()
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def search_many(self, queries, k: int) -> list[list[tuple[int, float]]]:
+        queries = self.as_matrix(queries)
+        # subclasses may publish more than the rows in their snapshot
+        ids, matrix, norms = self._snapshot[:3]
+        k = min(k, len(ids))
+        if k <= 0:
+            return [[] for _ in queries]
+
+        # |q - x|^2 = |x|^2 - 2 q.x + |q|^2, the last term does not change the ranking
+        scores = norms[None, :] - 2.0 * (queries @ matrix.T)
+        candidates = np.argpartition(scores, k - 1, axis=1)[:, :k]
+        candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+        order = np.argsort(candidate_scores, axis=1)
+        candidates = np.take_along_axis(candidates, order, axis=1)
+        candidate_scores = np.take_along_axis(candidate_scores, order, axis=1)
+        distances = np.sqrt(np.maximum(candidate_scores + np.einsum("ij,ij->i", queries, queries)[:, None], 0.0))
+
+        return [
+            [
+                (int(chunk_id), float(distance))
+                for chunk_id, distance in zip(ids[rows].tolist(), query_distances.tolist())
+                if chunk_id >= 0 and np.isfinite(distance)
+            ]
+            for rows, query_distances in zip(candidates, distances)
+        ]
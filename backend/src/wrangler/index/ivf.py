@@ -0,0 +1,241 @@
+import logging
+import os
+import sqlite3
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from .exact import ExactIndex
+
+
+class IVFIndex(ExactIndex):
+    """
+    Approximate nearest neighbour search with an inverted file (IVF-flat).
+    Vectors are assigned to the nearest of nlist k-means centroids and a query only scans the vectors of its
+    nprobe nearest centroids, trading recall for speed. Rows are stored and updated like in ExactIndex.
+    The centroids are trained once min_train_size vectors are indexed, and trained again when the index has
+    grown retrain_factor times since, on a background thread so writes go on meanwhile: until the new centroids
+    are swapped in, searches use the previous ones, or scan every vector before the first training.
+    The index is saved to path on close with its vector version and reloaded from it on the next start when the
+    store is still at that version, which avoids reading every embedding and training again. Any write of chunk
+    vectors moves the version, including the updates keeping the chunk ids.
+    """
+    def __init__(self, vector_dim: int, path: Path | None = None, nlist: int = 0, nprobe: int = 8,
+                 min_train_size: int = 4096, retrain_factor: float = 4.0, initial_capacity: int = 1024):
+        self.save_path = path
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size
+        self.retrain_factor = retrain_factor
+        self._centroids: np.ndarray | None = None
+        self._trained_size = 0
+        self._training_paused = False
+        self._training: threading.Thread | None = None
+        self._train_lock = threading.Lock()
+        # count of the compactions moving rows, a training started before one assigns every row again
+        self._compactions = 0
+        self._assign = np.zeros(initial_capacity, dtype=np.int32)
+        self._lists: tuple | None = None
+        super().__init__(vector_dim, None, initial_capacity)
+
+    def _publish(self) -> None:
+        if self._loading:
+            return
+        self._snapshot = (
+            self._ids[:self._size], self._matrix[:self._size], self._norms[:self._size],
+            self._assign[:self._size], self._centroids,
+        )
+
+    def _resize(self, capacity: int, keep: slice | np.ndarray) -> None:
+        assign = self._assign[:self._size][keep]
+        super()._resize(capacity, keep)
+        self._assign = np.zeros(capacity, dtype=np.int32)
+        self._assign[:len(assign)] = assign
+
+    def _compact(self) -> None:
+        self._compactions += 1
+        super()._compact()
+
+    def add(self, ids: np.ndarray, vectors: np.ndarray) -> None:
+        with self._lock:
+            super().add(ids, vectors)
+            if not self._training_paused:
+                self._maybe_train()
+
+    def _append(self, ids: np.ndarray, vectors: np.ndarray) -> None:
+        start = self._size
+        super()._append(ids, vectors)
+        # the new rows are assigned before they are published
+        if self._centroids is not None:
+            self._assign[start:self._size] = self._nearest_centroids(self._centroids, self._matrix[start:self._size])
+
+    def _maybe_train(self) -> None:
+        if self._training is not None and self._training.is_alive():
+            return
+        if (
+            (self._centroids is None and len(self) >= self.min_train_size)
+            or (self._centroids is not None and len(self) >= self.retrain_factor * self._trained_size)
+        ):
+            self._training = threading.Thread(target=self.train, name="ivf-training", daemon=True)
+            self._training.start()
+
+    def train(self, iterations: int = 10, seed: int = 0) -> None:
+        """
+        train the centroids with k-means on a sample of the vectors and reassign every vector.
+        The lock is only held to sample the vectors and to swap the new centroids in, the rows added meanwhile
+        are assigned then.
+        """
+        with self._train_lock:
+            with self._lock:
+                live = np.flatnonzero(self._ids[:self._size] >= 0)
+                if len(live) == 0:
+                    return
+                nlist = min(self.nlist or max(1, int(np.sqrt(len(live)))), len(live))
+                rng = np.random.default_rng(seed)
+                sample = self._matrix[np.sort(rng.choice(live, size=min(len(live), nlist * 64), replace=False))]
+                # the rows below size are never written, they only move to new arrays when compacted
+                matrix, size, compactions = self._matrix, self._size, self._compactions
+            centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+            for _ in range(iterations):
+                assign = self._nearest_centroids(centroids, sample)
+                counts = np.bincount(assign, minlength=nlist)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, assign, sample)
+                filled = counts > 0
+                centroids[filled] = sums[filled] / counts[filled, None]
+                # reseed the empty lists on random vectors of the sample
+                empty = np.flatnonzero(~filled)
+                centroids[empty] = sample[rng.choice(len(sample), size=len(empty), replace=False)]
+
+            assign = np.empty(size, dtype=np.int32)
+            for start in range(0, size, 65536):
+                end = min(start + 65536, size)
+                assign[start:end] = self._nearest_centroids(centroids, matrix[start:end])
+
+            with self._lock:
+                if self._compactions != compactions:
+                    # the rows moved, they are all assigned again
+                    size, assign = 0, assign[:0]
+                # the published assignments stay with the searches using the previous centroids
+                self._assign = self._assign.copy()
+                self._assign[:size] = assign
+                for start in range(size, self._size, 65536):
+                    end = min(start + 65536, self._size)
+                    self._assign[start:end] = self._nearest_centroids(centroids, self._matrix[start:end])
+                self._centroids = centroids
+                self._trained_size = len(live)
+                self._publish()
+            logging.info(f"Trained {nlist} ivf lists over {len(live)} vectors")
+
+    @staticmethod
+    def _nearest_centroids(centroids: np.ndarray, vectors: np.ndarray, nprobe: int = 1) -> np.ndarray:
+        scores = np.einsum("ij,ij->i", centroids, centroids)[None, :] - 2.0 * (vectors @ centroids.T)
+        if nprobe == 1:
+            return np.argmin(scores, axis=1).astype(np.int32)
+        nprobe = min(nprobe, len(centroids))
+        nearest = np.argpartition(scores, nprobe - 1, axis=1)[:, :nprobe]
+        return nearest
+
+    def _inverted_lists(self, snapshot: tuple) -> tuple[np.ndarray, np.ndarray]:
+        # rows sorted by list with the bounds of each list, computed once per snapshot
+        lists = self._lists
+        if lists is None or lists[0] is not snapshot:
+            _, _, _, assign, centroids = snapshot
+            order = np.argsort(assign, kind="stable")
+            bounds = np.searchsorted(assign[order], np.arange(len(centroids) + 1))
+            lists = self._lists = (snapshot, order, bounds)
+        return lists[1], lists[2]
+
+    def search_many(self, queries, k: int) -> list[list[tuple[int, float]]]:
+        snapshot = self._snapshot
+        ids, matrix, norms, _, centroids = snapshot
+        if centroids is None:
+            return super().search_many(queries, k)
+
+        queries = self.as_matrix(queries)
+        order, bounds = self._inverted_lists(snapshot)
+        results = []
+        for query, probes in zip(queries, self._nearest_centroids(centroids, queries, self.nprobe)):
+            rows = np.concatenate([order[bounds[probe]:bounds[probe + 1]] for probe in np.atleast_1d(probes)])
+            top = min(k, len(rows))
+            if top == 0:
+                results.append([])
+                continue
+            scores = norms[rows] - 2.0 * (matrix[rows] @ query)
+            best = np.argpartition(scores, top - 1)[:top]
+            best = best[np.argsort(scores[best])]
+            distances = np.sqrt(np.maximum(scores[best] + query @ query, 0.0))
+            results.append([
+                (int(chunk_id), float(distance))
+                for chunk_id, distance in zip(ids[rows[best]].tolist(), distances.tolist())
+                if chunk_id >= 0 and np.isfinite(distance)
+            ])
+        return results
+
+    def load(self, db: sqlite3.Connection, source: str = "chunk_embeddings", batch_size: int = 10_000,
+             version: int | None = None) -> None:
+        """restore the saved index when it was saved at the given vector version, otherwise rebuild it from the table"""
+        if version is not None and self._restore(version):
+            self.version = version
+            return
+
+        self._training_paused = True
+        try:
+            super().load(db, source, batch_size, version)
+        finally:
+            self._training_paused = False
+        with self._lock:
+            self._maybe_train()
+            self._publish()
+
+    def _restore(self, version: int) -> bool:
+        if self.save_path is None or not self.save_path.exists():
+            return False
+        try:
+            with np.load(self.save_path) as saved:
+                # files of the previous layout have no version, they are rebuilt
+                if saved["vectors"].shape[1] != self.vector_dim or "version" not in saved or int(saved["version"]) != version:
+                    return False
+                with self._lock:
+                    # the searches keep the previous snapshot until the assignments are restored too
+                    self._loading = True
+                    try:
+                        self.clear()
+                        self._centroids = None
+                        self._append(saved["ids"], self.as_matrix(saved["vectors"]))
+                        self._assign[:self._size] = saved["assign"]
+                        self._centroids = saved["centroids"] if len(saved["centroids"]) else None
+                        self._trained_size = int(saved["trained_size"])
+                    finally:
+                        self._loading = False
+                        self._publish()
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning(f"Ignoring the saved vector index {self.save_path}: {e}")
+            return False
+        return True
+
+    def save(self) -> None:
+        """save the index to its path, the file is replaced atomically"""
+        if self.save_path is None:
+            return
+        with self._lock:
+            live = self._ids[:self._size] >= 0
+            temporary = self.save_path.with_name(f"{self.save_path.name}.tmp")
+            with temporary.open("wb") as file:
+                np.savez(
+                    file,
+                    ids=self._ids[:self._size][live],
+                    vectors=self._matrix[:self._size][live],
+                    assign=self._assign[:self._size][live],
+                    centroids=self._centroids if self._centroids is not None else np.empty((0, self.vector_dim), dtype=np.float32),
+                    trained_size=self._trained_size,
+                    # an index that missed a change is saved with a version no store has
+                    version=-1 if self.version is None else self.version,
+                )
+            os.replace(temporary, self.save_path)
+
+    def close(self) -> None:
+        if self._training is not None:
+            self._training.join()
+        self.save()
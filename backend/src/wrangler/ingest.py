@@ -5,7 +5,9 @@ from pathlib import Path
 from typing import Literal, TypedDict
 from fastapi import APIRouter, HTTPException, Request
 import os
-from .ragUtil import RAGUtils
+from wrangler.embedding.batching import MicroBatchEmbedder
+from wrangler.resources import get_resources
+from .pipeline import IngestPipeline
 from fastapi import APIRouter
 from agent.graph import graph
 from langchain_core.messages import HumanMessage
@@ -23,18 +25,33 @@ builder = StateGraph(IngestState)
 @router.get("/ingest")
 async def ingest():
     """ingest the data from the data folder"""
-    rag = RAGUtils()
-    files = rag.get_file_list()
+    resources = get_resources()
+    files = resources.rag.get_file_list()
+    pipeline = IngestPipeline(resources.rag, pool=resources.parse_pool)
     try:
-        for file in files:
-            await rag.check_or_create_document(file)   
-        return {"message": "initialized!"}
+        await pipeline.run(files)
+        return {"message": "initialized!", "metrics": pipeline.get_metrics()}
     except Exception as e:
         return HTTPException(status_code=500, detail=str(e))
     
     
 
 
+@router.get("/metrics")
+async def metrics():
+    """hit rates of the embedding and analytic caches and size of the embedding batches"""
+    resources = get_resources()
+    chunk_repository = resources.rag.chunk_repository
+    metrics = {
+        "embedding_cache": chunk_repository.embedding_cache.stats(),
+        "query_embedding_cache": chunk_repository.query_embedding_cache.stats(),
+        "analytic_cache": resources.analytic.cache.stats(),
+    }
+    if isinstance(chunk_repository.embedder, MicroBatchEmbedder):
+        metrics["embedding_batches"] = chunk_repository.embedder.stats()
+    return metrics
+
+
 @router.post("/ingest/query")
 async def ingest_query(query: str, model: Literal["gpt-4o-mini", "gpt-4o", "gpt-3.5-turbo"], persona: Literal["product_owner", "marketing"]):
     """Process the query using the specified model and persona"""
@@ -3,12 +3,12 @@ class Product:
     Product class to represent a product
     name: str
     description: str
-    turnover: str
-    launch_date: str
+    turnover: float
+    launch_date: str, ISO 8601 (YYYY-MM-DD)
     country: str
     segment: str
     """
-    def __init__(self, name: str, description: str, turnover: str, launch_date: str, country: str, segment: str):
+    def __init__(self, name: str, description: str, turnover: float, launch_date: str, country: str, segment: str):
         self.name = name
         self.description = description
         self.turnover = turnover
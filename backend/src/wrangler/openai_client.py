@@ -0,0 +1,72 @@
+import asyncio
+import os
+import threading
+import weakref
+
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient
+
+from wrangler.settings import get_settings
+
+# One pooled HTTP client per event loop (async) and one for the whole process (sync).
+# Every OpenAI / langchain client built here shares these pools, so keep-alive
+# connections and TLS sessions are reused across calls instead of being rebuilt.
+_lock = threading.Lock()
+_async_http_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+_http_client: httpx.Client | None = None
+
+
+def _limits() -> httpx.Limits:
+    settings = get_settings()
+    return httpx.Limits(
+        max_connections=settings.openai_max_connections,
+        max_keepalive_connections=settings.openai_max_keepalive_connections,
+        keepalive_expiry=settings.openai_keepalive_expiry,
+    )
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """get the pooled async HTTP client of the running event loop"""
+    loop = asyncio.get_running_loop()
+    with _lock:
+        client = _async_http_clients.get(loop)
+        if client is None or client.is_closed:
+            client = DefaultAsyncHttpxClient(limits=_limits(), timeout=get_settings().openai_timeout)
+            _async_http_clients[loop] = client
+        return client
+
+
+def get_http_client() -> httpx.Client:
+    """get the pooled sync HTTP client of the process"""
+    global _http_client
+    with _lock:
+        if _http_client is None or _http_client.is_closed:
+            _http_client = DefaultHttpxClient(limits=_limits(), timeout=get_settings().openai_timeout)
+        return _http_client
+
+
+def get_async_openai_client() -> AsyncOpenAI:
+    """get an AsyncOpenAI client backed by the shared connection pool"""
+    return AsyncOpenAI(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        http_client=get_async_http_client(),
+        timeout=get_settings().openai_timeout,
+    )
+
+
+async def close_openai_clients() -> None:
+    """close every pooled HTTP client, meant to be called on application shutdown"""
+    global _http_client
+    with _lock:
+        async_clients = list(_async_http_clients.items())
+        _async_http_clients.clear()
+        http_client, _http_client = _http_client, None
+
+    current_loop = asyncio.get_running_loop()
+    for loop, client in async_clients:
+        if loop is current_loop:
+            await client.aclose()
+        elif not loop.is_closed():
+            asyncio.run_coroutine_threadsafe(client.aclose(), loop)
+    if http_client is not None:
+        http_client.close()
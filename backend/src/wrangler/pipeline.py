@@ -0,0 +1,180 @@
+import asyncio
+import contextlib
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from markitdown import MarkItDown
+
+from wrangler.model.document import Document
+from wrangler.ragUtil import RAGUtils
+from wrangler.repository.chunk import chunker
+from wrangler.settings import get_settings
+
+
+def convert_file(file_path: Path) -> str:
+    """parse a file with MarkItDown, runs in a worker process of the parse stage"""
+    return MarkItDown().convert(file_path).text_content
+
+
+def create_parse_pool(workers: int | None = None) -> ProcessPoolExecutor:
+    """process pool of the parse stage, its worker processes are started on first use and then kept"""
+    # spawn instead of fork, the server process runs threads
+    return ProcessPoolExecutor(
+        max_workers=workers or get_settings().ingest_parse_workers, mp_context=multiprocessing.get_context("spawn")
+    )
+
+
+@dataclass
+class IngestItem:
+    """a file travelling through the pipeline"""
+    file_path: Path
+    md5_hash: str = ""
+    exist_document: Document | None = None
+    content: str = ""
+    # large files are not parsed ahead, the write stage streams them into the store
+    streamed: bool = False
+    # the stored document is up to date, the write stage only checks that its analytic table is loaded
+    unchanged: bool = False
+    chunk_texts: list[str] = field(default_factory=list)
+    embeddings: list[list[float]] = field(default_factory=list)
+    computed_embeddings: dict[str, list[float]] = field(default_factory=dict)
+
+
+@dataclass
+class StageMetrics:
+    """counters of a pipeline stage, queue depths are measured on the stage input queue"""
+    processed: int = 0
+    skipped: int = 0
+    failed: int = 0
+    queue_depth: int = 0
+    max_queue_depth: int = 0
+
+
+class IngestPipeline:
+    """
+    Staged ingestion pipeline with bounded concurrency:
+
+    parse (md5 + MarkItDown in a process pool) -> embed (chunking and batched embedding requests,
+    several files in parallel) -> write (a single writer task doing every database write).
+
+    Stages are connected by bounded queues, so a slow stage applies backpressure to the ones before it.
+    Files large enough to be streamed skip parsing and embedding, the write stage ingests them incrementally.
+    The parse stage runs in the given process pool, shared by the runs, or else in a pool of the run.
+    """
+    stages = ("parse", "embed", "write")
+
+    def __init__(self, rag: RAGUtils, parse_workers: int | None = None, embed_workers: int | None = None,
+                 queue_size: int | None = None, pool: ProcessPoolExecutor | None = None):
+        settings = get_settings()
+        self.rag = rag
+        self.pool = pool
+        self.parse_workers = parse_workers or settings.ingest_parse_workers
+        self.embed_workers = embed_workers or settings.ingest_embed_workers
+        self.queue_size = queue_size or settings.ingest_queue_size
+        self.metrics = {stage: StageMetrics() for stage in self.stages}
+        self.errors: dict[Path, Exception] = {}
+
+    async def run(self, files: list[Path]) -> list[Document]:
+        """ingest the files, raise once every file went through if some of them failed"""
+        queues = {stage: asyncio.Queue(maxsize=self.queue_size) for stage in self.stages}
+        documents: list[Document] = []
+
+        with contextlib.nullcontext(self.pool) if self.pool is not None else create_parse_pool(self.parse_workers) as pool:
+            workers = [
+                *(asyncio.create_task(self._worker("parse", queues["parse"], self._parse, queues["embed"], pool))
+                  for _ in range(self.parse_workers)),
+                *(asyncio.create_task(self._worker("embed", queues["embed"], self._embed, queues["write"]))
+                  for _ in range(self.embed_workers)),
+                asyncio.create_task(self._worker("write", queues["write"], self._write, None, documents)),
+            ]
+            try:
+                for file_path in files:
+                    await self._put(queues["parse"], "parse", IngestItem(file_path=file_path))
+                for stage in self.stages:
+                    await queues[stage].join()
+            finally:
+                for worker in workers:
+                    worker.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+
+        logging.info(f"Ingest pipeline metrics: {self.get_metrics()}")
+        if self.errors:
+            raise Exception("; ".join(f"{path}: {error}" for path, error in self.errors.items()))
+        return documents
+
+    def get_metrics(self) -> dict:
+        """per stage counters and queue depths"""
+        return {stage: vars(metrics).copy() for stage, metrics in self.metrics.items()}
+
+    async def _put(self, queue: asyncio.Queue, stage: str, item: IngestItem) -> None:
+        await queue.put(item)
+        metrics = self.metrics[stage]
+        metrics.queue_depth = queue.qsize()
+        metrics.max_queue_depth = max(metrics.max_queue_depth, metrics.queue_depth)
+
+    async def _worker(self, stage: str, queue: asyncio.Queue, handler, next_queue: asyncio.Queue | None, *args) -> None:
+        metrics = self.metrics[stage]
+        while True:
+            item = await queue.get()
+            metrics.queue_depth = queue.qsize()
+            try:
+                if await handler(item, *args):
+                    metrics.processed += 1
+                    if next_queue is not None:
+                        await self._put(next_queue, self.stages[self.stages.index(stage) + 1], item)
+                else:
+                    metrics.skipped += 1
+            except Exception as e:
+                logging.exception(f"Failed to ingest {item.file_path} at the {stage} stage")
+                metrics.failed += 1
+                self.errors[item.file_path] = e
+            finally:
+                queue.task_done()
+
+    async def _parse(self, item: IngestItem, pool: ProcessPoolExecutor) -> bool:
+        """hash the file and parse it unless the stored document is up to date"""
+        item.md5_hash = await asyncio.to_thread(self.rag.file_md5, item.file_path)
+        item.exist_document = await self.rag.get_document_by_uri(item.file_path.absolute().as_uri())
+        if item.exist_document and item.exist_document.metadata.get("md5") == item.md5_hash:
+            # the csv may not have been loaded yet, when the file was ingested before it or the load failed
+            item.unchanged = self.rag.analytic_file(item.file_path)
+            return item.unchanged
+        if self.rag.streamable(item.file_path):
+            item.streamed = True
+            return True
+
+        try:
+            item.content = await asyncio.get_running_loop().run_in_executor(pool, convert_file, item.file_path)
+        except Exception as e:
+            raise ValueError(f"Failed to parse file {item.file_path}: {e}")
+        return True
+
+    async def _embed(self, item: IngestItem) -> bool:
+        """chunk the content and embed the chunks missing from the embedding cache, the cache is only read here"""
+        if item.streamed or item.unchanged:
+            return True
+        chunk_repository = self.rag.chunk_repository
+        item.chunk_texts = await chunker.chunk(item.content)
+        item.embeddings, item.computed_embeddings = await chunk_repository.embedding_cache.fetch(
+            chunk_repository.embedder, item.chunk_texts
+        )
+        return True
+
+    async def _write(self, item: IngestItem, documents: list[Document]) -> bool:
+        """store the new embeddings and the document, the only stage writing to the database"""
+        if item.unchanged:
+            await self.rag.sync_analytic(item.file_path, item.md5_hash)
+            return False
+        if item.streamed:
+            documents.append(await self.rag.stream_document(item.file_path, item.md5_hash, item.exist_document))
+            return True
+        chunk_repository = self.rag.chunk_repository
+        await chunk_repository.embedding_cache.record(chunk_repository.embedder, item.chunk_texts, item.computed_embeddings)
+        documents.append(await self.rag.save_document(
+            item.file_path, item.content, item.md5_hash, item.exist_document,
+            chunk_texts=item.chunk_texts, embeddings=item.embeddings
+        ))
+        return True
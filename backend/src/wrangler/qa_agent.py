@@ -1,9 +1,9 @@
-from openai import AsyncOpenAI
 from openai.types.chat import (
     ChatCompletionMessageParam,
     ChatCompletionSystemMessageParam,
     ChatCompletionUserMessageParam,
 )
+from wrangler.openai_client import get_async_openai_client
 from wrangler.ragUtil import RAGUtils
 
 
@@ -14,7 +14,7 @@ class OpenAIQuestionAnswerAgent:
 
     async def answer(self, question: str, persona: str = "user") -> str:
         """Answer a question using the client's data"""
-        openai_client = AsyncOpenAI()
+        openai_client = get_async_openai_client()
         
         context_chunks = []
         
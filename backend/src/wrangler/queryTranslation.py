@@ -1,6 +1,8 @@
 from pydantic import BaseModel, Field
 from wrangler.repository.analytic import Analytic
 from langchain_openai import ChatOpenAI
+from wrangler.openai_client import get_async_http_client, get_http_client
+from wrangler.resources import get_resources
 import logging
 
 system_prompt = """
@@ -8,7 +10,7 @@ You are a SQL (SQLite) tool. Your job is to help the user write rewrite a user q
 You should not add special character that will break the query. The resulting query should be executable over the sqlite database.
 You should also return the column names that are used in the answer.
 
-Since the you are an sqlite tool, you should consider that the date column in the tables are stored as TEXT.
+Since the you are an sqlite tool, you should consider that the date columns (type DATE) in the tables are stored as ISO 8601 TEXT, 'YYYY-MM-DD'.
 
 1. **Input Processing**:
 - The user will provide a natural language query and the database schema, including table name, column names, and their data types (e.g., INTEGER, TEXT, REAL).
@@ -17,18 +19,20 @@ Since the you are an sqlite tool, you should consider that the date column in th
 
 2. **Schema Awareness**:
 - Use the provided schema to ensure column names and types are correct.
-- If the schema indicates a date-related column (e.g., named "date", "launch_date") stored as TEXT, assume dates might be in non-standard formats like DD/MM/YYYY or MM/DD/YYYY unless specified otherwise.
-- For date columns stored as TEXT, convert non-standard formats (e.g., DD/MM/YYYY) to YYYY-MM-DD within the query using string manipulation 
-(e.g., SUBSTR) for compatibility with SQLite date functions like DATE() or STRFTIME().
+- Numeric columns (REAL, INTEGER) are stored as numbers: aggregate and compare them directly, never CAST them.
+- The schema lists the indexed columns. Keep these columns bare in the WHERE clause (no function or expression applied to them),
+so that SQLite can use their index instead of scanning every row.
 
 3. **Date Handling**:
-- If the query involves date comparisons (e.g., "after 2020", "last 20 years"), check the schema for the date column’s storage type:
- - For TEXT columns with dates in DD/MM/YYYY, transform them to YYYY-MM-DD using:
-    ```sql
-    SUBSTR(column, 7, 4) || '-' || SUBSTR(column, 4, 2) || '-' || SUBSTR(column, 1, 2)
+- Date columns already hold 'YYYY-MM-DD' text, which sorts and compares like a date: compare the column itself to a date value.
+ - "after 2020": `launch_date >= '2021-01-01'`
+ - "in 2023": `launch_date >= '2023-01-01' AND launch_date < '2024-01-01'`
+ - "in the last 20 years": `launch_date >= DATE('now', '-20 years')`
+- Do not rebuild or reformat the date column (no SUBSTR, STRFTIME or DATE applied to the column in the WHERE clause),
+only apply functions to the column in the SELECT or GROUP BY clauses when the answer needs a part of the date (e.g. STRFTIME('%Y', launch_date) for a year).
 
 ### Example Usage
-For the query that caused the issue:
+For example:
 
 **Input**: "Show the total turnover for products in Belgium launched in the last 20 years, grouped by segment."
 
@@ -37,12 +41,12 @@ For the query that caused the issue:
 SELECT segment, SUM(turnover) AS total_turnover
 FROM products
 WHERE country = 'Belgium'
-AND STRFTIME('%Y-%m-%d', SUBSTR(launch_date, 7, 4) || '-' || SUBSTR(launch_date, 4, 2) || '-' || SUBSTR(launch_date, 1, 2)) >= DATE('now', '-20 years')
+AND launch_date >= DATE('now', '-20 years')
 GROUP BY segment;
 ```column_names
 ['segment', 'total_turnover']
 
-The table schema is as follows:
+The database has one table per csv file, use the tables the question is about. The table schemas are as follows:
 
 {table_schema}
 
@@ -58,26 +62,45 @@ class QueryTranslation(BaseModel):
     column_names: list[str] = Field(description="The column names that are used in the answer")
 
 
-def translate_query(query: str, model:str = "gpt-3") -> str:
+async def translate_query(query: str, model:str = "gpt-3", analytic: Analytic | None = None) -> str:
     """
-    Translate the query to a sql query
+    Translate the query to a sql query, over the shared analytic database unless one is given.
+    The generated sql and its results are cached, a repeated question calls neither the model nor the database
+    until the analytic tables are reloaded.
     """
     try:
-        analytic = Analytic()
-        table_schema = analytic.get_table_schema()
-        prompt = system_prompt.format(table_schema=table_schema, query=query)
-        llm = ChatOpenAI(model=model, temperature=0)
-        llm_with_structured_output = llm.with_structured_output(QueryTranslation).invoke(prompt)
-        
-        query = llm_with_structured_output.query
-        logging.info(query)
-        
-        result = analytic.execute_query(query)
-        
+        if analytic is None:
+            analytic = get_resources().analytic
+        # read before the model is called, results of a reload happening meanwhile are cached under the old version
+        data_version = await analytic.adata_version()
+        table_schema = await analytic.aget_table_schemas()
+
+        translation = analytic.cache.get_translation(query, table_schema, model)
+        if translation is None:
+            prompt = system_prompt.format(table_schema=table_schema, query=query)
+            llm = ChatOpenAI(model=model, temperature=0, http_client=get_http_client(), http_async_client=get_async_http_client())
+            llm_with_structured_output = await llm.with_structured_output(QueryTranslation).ainvoke(prompt)
+            translation = {
+                "query": llm_with_structured_output.query,
+                "column_names": llm_with_structured_output.column_names or [],
+            }
+            generated = True
+        else:
+            generated = False
+        logging.info(translation["query"])
+
+        result = analytic.cache.get_results(translation["query"], data_version)
+        if result is None:
+            result = await analytic.aexecute_query(translation["query"])
+            analytic.cache.put_results(translation["query"], data_version, result)
+        # only queries that ran are kept
+        if generated:
+            analytic.cache.put_translation(query, table_schema, model, translation)
+
         logging.info(result)
         
         
-        return {"query": query, "results": result, "column_names": llm_with_structured_output.column_names or []}
+        return {"query": translation["query"], "results": result, "column_names": translation["column_names"]}
     except Exception as e:
         raise Exception(f"Error translating query: {e}")
     
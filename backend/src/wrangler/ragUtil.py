@@ -1,7 +1,9 @@
+import csv
 import hashlib
 import mimetypes
+import re
 from pathlib import Path
-from typing import ClassVar
+from typing import ClassVar, Iterator
 import os
 import asyncio
 from markitdown import MarkItDown
@@ -13,6 +15,7 @@ from wrangler.repository.analytic import Analytic
 from wrangler.repository.chunk import ChunkRepository
 from wrangler.repository.document import DocumentRepository
 from wrangler.repository.store import Store
+from wrangler.settings import get_settings
 
 default_file_directory = Path("src/data")
 default_store_directory = Path("src/store/rag.sqlite")
@@ -22,6 +25,9 @@ class RAGUtils:
     FileReader class to read the file and parse it
     """
     extensions: ClassVar[list[str]] = [".csv", ".md"]
+    # formats whose text can be produced incrementally, large files of these formats are ingested as a stream
+    stream_extensions: ClassVar[set[str]] = {".csv", ".md", ".markdown", ".txt"}
+    _table_pipe: ClassVar[re.Pattern] = re.compile(r"(?<!\\)(\\*)\|")
     
     def __init__(self, store_directory: Path = default_store_directory, 
                 file_directory: Path = default_file_directory):
@@ -29,8 +35,8 @@ class RAGUtils:
             store_directory.parent.mkdir(parents=True, exist_ok=True)
         self.store = Store(store_directory)
         self.analytic = Analytic()
-        self.document_repository = DocumentRepository(self.store)
         self.chunk_repository = ChunkRepository(self.store)
+        self.document_repository = DocumentRepository(self.store, self.chunk_repository)
         self.file_directory = file_directory
         
     @staticmethod
@@ -51,21 +57,95 @@ class RAGUtils:
                 files_list.append(Path(file_path))
         return files_list
     
-    async def check_or_create_document(self, file_path: Path) -> str:
+    @staticmethod
+    def file_md5(file_path: Path) -> str:
+        """
+        Compute the md5 of the file content, read block by block
+        """
+        with file_path.open("rb") as file:
+            return hashlib.file_digest(file, "md5").hexdigest()
+
+    def streamable(self, file_path: Path) -> bool:
+        """
+        Whether the file is large enough to be ingested as a stream and in a format allowing it
+        """
+        return (
+            file_path.suffix.lower() in self.stream_extensions
+            and file_path.stat().st_size >= get_settings().ingest_stream_threshold_bytes
+        )
+
+    @classmethod
+    def iter_file_text(cls, file_path: Path, block_size: int = 1 << 20) -> Iterator[str]:
+        """
+        The parsed text of a file in blocks of about block_size characters.
+        Csv, markdown and text files are read incrementally (as utf-8), other formats are parsed at once by MarkItDown.
+        """
+        suffix = file_path.suffix.lower()
+        if suffix not in cls.stream_extensions:
+            yield MarkItDown().convert(file_path).text_content
+            return
+
+        with file_path.open("r", encoding="utf-8-sig", errors="replace", newline="") as file:
+            if suffix != ".csv":
+                while block := file.read(block_size):
+                    yield block
+                return
+
+            # the markdown table of the MarkItDown csv converter, row by row, rows are padded to the header width
+            rows = (row for row in csv.reader(file) if row)
+            header = next(rows, None)
+            if header is None:
+                return
+            lines = [cls._table_row(header), cls._table_row(["---"] * len(header))]
+            size = 0
+            for row in rows:
+                row.extend([""] * (len(header) - len(row)))
+                lines.append(cls._table_row(row))
+                size += len(lines[-1]) + 1
+                if size >= block_size:
+                    yield "\n".join(lines)
+                    # the next block starts with the line break ending this one
+                    lines, size = [""], 0
+            if lines != [""]:
+                yield "\n".join(lines)
+
+    @classmethod
+    def _table_row(cls, cells: list[str]) -> str:
+        # pipes are escaped and line breaks collapsed, so a cell stays in its column and its row
+        cells = [
+            cls._table_pipe.sub(lambda match: match.group(1) * 2 + "\\|", cell).replace("\r\n", " ").replace("\n", " ").replace("\r", " ")
+            for cell in cells
+        ]
+        return "| " + " | ".join(cells) + " |"
+
+    async def check_or_create_document(self, file_path: Path) -> Document:
         """
         Check if the document already exists in the database and create it if it doesn't
         """
         uri = file_path.absolute().as_uri()
         
-        file_bytes = file_path.read_bytes()
-        
-        md5_hash =  hashlib.md5(file_bytes).hexdigest()
+        md5_hash = self.file_md5(file_path)
         
         exist_document = await self.get_document_by_uri(uri)
         if exist_document and exist_document.metadata.get("md5") == md5_hash:
+            # the csv may not have been loaded yet, when the file was ingested before it or the load failed
+            await self.sync_analytic(file_path, md5_hash)
             return exist_document
+
+        if self.streamable(file_path):
+            return await self.stream_document(file_path, md5_hash, exist_document)
         
         content = await self.parse_file(file_path)
+        return await self.save_document(file_path, content, md5_hash, exist_document)
+
+    async def save_document(self, file_path: Path, content: str, md5_hash: str,
+                            exist_document: Document | None = None,
+                            chunk_texts: list[str] | None = None,
+                            embeddings: list[list[float]] | None = None) -> Document:
+        """
+        Create or update the document of a parsed file, chunk_texts can be given when the content is already chunked
+        and embeddings when they are already embedded
+        """
         content_type, _ = mimetypes.guess_type(str(file_path))
         
         if not content_type:
@@ -75,12 +155,64 @@ class RAGUtils:
         if exist_document is not None:
             exist_document.content = content
             exist_document.metadata = metadata
-            return await self.document_repository.update(exist_document)
-        
-        await self.document_repository.create(Document(uri=uri, content=content, metadata=metadata or {}))
-        if file_path.suffix.lower() == ".csv":
-            self.analytic.create_product(file_path)
+            document = await self.document_repository.update(exist_document, chunk_texts=chunk_texts, embeddings=embeddings)
+        else:
+            document = await self.document_repository.create(
+                Document(uri=file_path.absolute().as_uri(), content=content, metadata=metadata or {}),
+                chunk_texts=chunk_texts,
+                embeddings=embeddings
+            )
+        await self.sync_analytic(file_path, md5_hash)
+        return document
+
+    @staticmethod
+    def analytic_file(file_path: Path) -> bool:
+        """
+        Whether the file is loaded in the analytic database as well
+        """
+        return file_path.suffix.lower() == ".csv"
+
+    async def sync_analytic(self, file_path: Path, md5_hash: str) -> bool:
+        """
+        Reload a csv file in the analytic database when its md5 is not the one loaded
+        """
+        if not self.analytic_file(file_path):
+            return False
+        return await self.analytic.aload_csv(file_path, md5_hash)
     
+    async def stream_document(self, file_path: Path, md5_hash: str, exist_document: Document | None = None) -> Document:
+        """
+        Create or update the document of a large file without loading it: its text is read, chunked, embedded
+        and written incrementally, and the document row keeps no content, only its chunks do.
+        The chunks of the previous version are replaced once the new ones are written, and the md5 is recorded last,
+        so an interrupted ingestion is started over on the next run.
+        """
+        settings = get_settings()
+        content_type, _ = mimetypes.guess_type(str(file_path))
+        metadata = {"contentType": content_type or "text/plain", "streamed": True}
+
+        document = exist_document
+        if document is None:
+            document = await self.document_repository.create(
+                Document(uri=file_path.absolute().as_uri(), content="", metadata=metadata)
+            )
+        previous_chunk_id = await self.chunk_repository.last_id(document.id)
+
+        await self.chunk_repository.stream_chunks_from_document(
+            document.id,
+            self.iter_file_text(file_path, settings.ingest_stream_window),
+            settings.ingest_stream_batch_size,
+            settings.ingest_stream_window,
+        )
+        if previous_chunk_id:
+            await self.chunk_repository.delete_by_document_id(document.id, until_id=previous_chunk_id)
+
+        document.content = ""
+        document.metadata = {**metadata, "md5": md5_hash}
+        await self.document_repository.update_row(document)
+        await self.sync_analytic(file_path, md5_hash)
+        return document
+
     async def ask(self, query: str) -> str:
         """
         Ask the RAGUtils to answer the query
@@ -104,4 +236,5 @@ class RAGUtils:
     
     async def close(self):
         self.store.close()
+        self.analytic.close()
 
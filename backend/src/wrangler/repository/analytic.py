@@ -1,9 +1,21 @@
+import hashlib
+import itertools
+import logging
 import os
+import re
+from datetime import datetime
+from functools import partial
 from pathlib import Path
 import sqlite3
 import csv
+from typing import ClassVar, Iterator
 
 from wrangler.model.product import Product
+from wrangler.repository.analytic_cache import AnalyticCache
+from wrangler.repository.pool import ConnectionPool
+from wrangler.repository.profile import ConnectionProfile
+from wrangler.repository.rollup import ProductRollup
+from wrangler.settings import get_settings
 
 
 default_analytic_directory = Path("src/store/analytic.sqlite")
@@ -12,61 +24,458 @@ class Analytic:
     """
     Analytic class to manage the database connection and create the database tables
     """
-    def __init__(self, db_path: Path = default_analytic_directory):
+    # rows of a csv file inserted per executemany call
+    batch_size: ClassVar[int] = 10_000
+    # rows read to infer the column types of a csv table
+    sample_size: ClassVar[int] = 1_000
+    # columns of a csv table with at most this many distinct values (and at most one per ten rows) are indexed
+    index_max_distinct: ClassVar[int] = 1_000
+    # tables of the database that are not csv tables, nor described to translate_query
+    internal_tables: ClassVar[set[str]] = {"product_sources", "csv_tables", ProductRollup.table}
+    product_columns: ClassVar[set[str]] = {"name", "description", "turnover", "launch_date", "country", "segment"}
+    _integer: ClassVar[re.Pattern] = re.compile(r"[+-]?(0|[1-9][0-9]*)")
+    _real: ClassVar[re.Pattern] = re.compile(r"[+-]?(0|[1-9][0-9]*)?(\.[0-9]+)?([eE][+-]?[0-9]+)?")
+    # the only date layouts of a DATE column, the ones converted to ISO 8601 while loading, see _load_table
+    _date: ClassVar[re.Pattern] = re.compile(r"[0-9]{2}/[0-9]{2}/[0-9]{4}|[0-9]{4}-[0-9]{2}-[0-9]{2}")
+
+    def __init__(self, db_path: Path = default_analytic_directory, profile: ConnectionProfile | None = None):
         self.db_path = db_path
-        self._connection = self.create_db()
+        self.profile = profile or ConnectionProfile.from_env()
+        settings = get_settings()
+        # every Analytic of the process opening this database shares the same pool
+        self._pool = ConnectionPool.acquire(
+            db_path,
+            self.create_db,
+            partial(self.connect, read_only=True),
+            self.profile.close,
+            settings.sqlite_readers,
+            settings.sqlite_health_check_interval,
+            self.profile,
+        )
+        self._connection = self._pool.writer_connection
+        # the generated queries and their results, shared like the pool, see translate_query
+        self.cache: AnalyticCache = self._pool.shared(
+            "analytic_cache",
+            lambda: AnalyticCache(settings.analytic_cache_max_entries, settings.analytic_cache_ttl, settings.analytic_cache_max_rows),
+        )
+
+    def connect(self, read_only: bool = False) -> sqlite3.Connection:
+        """
+        Open a connection to the database
+        """
+        return self.profile.connect(self.db_path, read_only)
 
     def create_db(self) -> sqlite3.Connection:
         """
         Create the database tables
         """
-        db = sqlite3.connect(self.db_path)
+        db = self.connect()
+
+        columns = {column[1]: column[2] for column in db.execute("PRAGMA table_info(products)")}
+        if columns.get("turnover") == "TEXT":
+            self._migrate_products(db)
+        elif columns and "source" not in columns:
+            db.execute("ALTER TABLE products ADD COLUMN source TEXT")
 
         # if not exists we create the table documents
-        db.execute("""CREATE TABLE IF NOT EXISTS products (
+        self._create_products_table(db, "products")
+        db.execute("CREATE INDEX IF NOT EXISTS idx_products_country ON products(country)")
+        db.execute("CREATE INDEX IF NOT EXISTS idx_products_segment ON products(segment)")
+        db.execute("CREATE INDEX IF NOT EXISTS idx_products_launch_date ON products(launch_date)")
+        db.execute("CREATE INDEX IF NOT EXISTS idx_products_source ON products(source)")
+        ProductRollup.create(db)
+
+        # csv files loaded into products, with the md5 of the loaded version
+        db.execute("""CREATE TABLE IF NOT EXISTS product_sources (
+                uri TEXT PRIMARY KEY,
+                md5 TEXT NOT NULL,
+                loaded_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        # csv files loaded as their own table, with the md5 of the loaded version
+        db.execute("""CREATE TABLE IF NOT EXISTS csv_tables (
+                uri TEXT PRIMARY KEY,
+                table_name TEXT NOT NULL UNIQUE,
+                md5 TEXT NOT NULL,
+                loaded_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        db.commit()
+        return db
+
+    @staticmethod
+    def _create_products_table(db: sqlite3.Connection, name: str) -> None:
+        # turnover is a number and launch_date an ISO 8601 date, so they compare and aggregate without conversions
+        db.execute(f"""CREATE TABLE IF NOT EXISTS {name} (
                 id INTEGER PRIMARY KEY, 
                 name TEXT NOT NULL,
                 description TEXT NOT NULL,
-                turnover TEXT NOT NULL,
-                launch_date DATE NOT NULL,
+                turnover REAL NOT NULL,
+                launch_date DATE NOT NULL CHECK(launch_date GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]'),
                 country TEXT NOT NULL,
-                segment TEXT CHECK(segment IN ('Low', 'Medium', 'High')) NOT NULL
+                segment TEXT CHECK(segment IN ('Low', 'Medium', 'High')) NOT NULL,
+                source TEXT
             )
         """)
-        db.commit()
-        return db
+
+    @classmethod
+    def _migrate_products(cls, db: sqlite3.Connection) -> None:
+        """
+        Rebuild a products table of the previous layout, with turnover as text and launch_date as DD/MM/YYYY text
+        """
+        db.execute("BEGIN")
+        try:
+            cls._create_products_table(db, "products_typed")
+            db.execute("""
+                INSERT INTO products_typed (id, name, description, turnover, launch_date, country, segment)
+                SELECT id, name, description, CAST(turnover AS REAL),
+                    CASE WHEN launch_date LIKE '__/__/____'
+                        THEN SUBSTR(launch_date, 7, 4) || '-' || SUBSTR(launch_date, 4, 2) || '-' || SUBSTR(launch_date, 1, 2)
+                        ELSE launch_date
+                    END,
+                    country, segment
+                FROM products
+            """)
+            db.execute("DROP TABLE products")
+            db.execute("ALTER TABLE products_typed RENAME TO products")
+            # rebuilt from the typed table by create_db
+            db.execute(f"DROP TABLE IF EXISTS {ProductRollup.table}")
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
     
-    def create_product(self, file_path: Path) -> None:
-        """
-        add data from csv file to the product table
-        """
-        with file_path.open('r', encoding='utf-8') as csvfile:
-            csv_reader = csv.DictReader(csvfile)
-            cursor = self._connection.cursor()
-            for row in csv_reader:
-                product = Product(
-                    name=row['name'],
-                    description=row['description'],
-                    turnover=row['turnover'],
-                    launch_date=row['launch_date'],
-                    country=row['country'],
-                    segment=row['segment']
-                )
-                cursor.execute(
-                    "INSERT INTO products (name, description, turnover, launch_date, country, segment) VALUES (?, ?, ?, ?, ?, ?)",
-                    (product.name, product.description, product.turnover, product.launch_date, product.country, product.segment)
+    def create_product(self, file_path: Path, md5_hash: str | None = None) -> bool:
+        """
+        load the products of a csv file, replacing the ones of its previous version.
+        Nothing is done when the md5 of the file is the one already loaded, returns whether the file was loaded
+        """
+        return self._reloaded(self._pool.write_blocking(self._create_product, file_path, md5_hash))
+
+    async def acreate_product(self, file_path: Path, md5_hash: str | None = None) -> bool:
+        """
+        load the products of a csv file like create_product, on the writer connection
+        """
+        return self._reloaded(await self._pool.write(self._create_product, file_path, md5_hash))
+
+    @classmethod
+    def _create_product(cls, db: sqlite3.Connection, file_path: Path, md5_hash: str | None) -> bool:
+        source = file_path.absolute().as_uri()
+        md5_hash = md5_hash or cls._file_md5(file_path)
+        loaded = db.execute("SELECT md5 FROM product_sources WHERE uri = ?", (source,)).fetchone()
+        if loaded is not None and loaded[0] == md5_hash:
+            return False
+
+        cursor = db.cursor()
+        try:
+            # the file is staged in a temporary table first, the products table is only locked for the swap
+            cursor.execute("DROP TABLE IF EXISTS temp.products_staging")
+            cursor.execute("""CREATE TEMP TABLE products_staging (
+                    name TEXT, description TEXT, turnover REAL, launch_date TEXT, country TEXT, segment TEXT
                 )
-            self._connection.commit()
+            """)
+            with file_path.open('r', encoding='utf-8') as csvfile:
+                rows = cls._product_rows(csv.DictReader(csvfile))
+                # the file is read as it is inserted, batch by batch
+                while batch := list(itertools.islice(rows, cls.batch_size)):
+                    cursor.executemany(
+                        "INSERT INTO temp.products_staging (name, description, turnover, launch_date, country, segment) VALUES (?, ?, ?, ?, ?, ?)",
+                        batch
+                    )
+
+            # rows without a source were loaded before sources were recorded, they are duplicates of a csv file
+            cursor.execute("DELETE FROM products WHERE source = ? OR source IS NULL", (source,))
+            cursor.execute(
+                """
+                INSERT INTO products (name, description, turnover, launch_date, country, segment, source)
+                SELECT name, description, turnover, launch_date, country, segment, ? FROM temp.products_staging""",
+                (source,)
+            )
+            cursor.execute(
+                """
+                INSERT INTO product_sources (uri, md5, loaded_at) VALUES (?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(uri) DO UPDATE SET md5 = excluded.md5, loaded_at = excluded.loaded_at""",
+                (source, md5_hash)
+            )
+            cursor.execute("DROP TABLE temp.products_staging")
+        except Exception:
+            db.rollback()
+            raise
+        db.commit()
+        return True
+
+    @classmethod
+    def _product_rows(cls, csv_reader: csv.DictReader) -> Iterator[tuple]:
+        for row in csv_reader:
+            product = Product(
+                name=row['name'],
+                description=row['description'],
+                turnover=float(row['turnover']),
+                launch_date=cls.iso_date(row['launch_date']),
+                country=row['country'],
+                segment=row['segment']
+            )
+            yield (product.name, product.description, product.turnover, product.launch_date, product.country, product.segment)
+
+    def load_csv(self, file_path: Path, md5_hash: str | None = None) -> bool:
+        """
+        load a csv file into the analytic database, unless the md5 of the file is the one already loaded.
+        Files with the columns of the products are loaded into the products table, see create_product,
+        any other file into its own table named after the file, see _load_table. Returns whether the file was loaded
+        """
+        return self._reloaded(self._pool.write_blocking(self._load_csv, file_path, md5_hash))
+
+    async def aload_csv(self, file_path: Path, md5_hash: str | None = None) -> bool:
+        """
+        load a csv file like load_csv, on the writer connection
+        """
+        return self._reloaded(await self._pool.write(self._load_csv, file_path, md5_hash))
+
+    def _reloaded(self, loaded: bool) -> bool:
+        # the cached queries and results may be the ones of the previous data
+        if loaded:
+            self.cache.invalidate()
+        return loaded
+
+    def data_version(self) -> str:
+        """
+        Version of the data of the analytic tables, it changes whenever a csv file with a new content is loaded
+        """
+        return self._pool.read_blocking(self._data_version)
+
+    async def adata_version(self) -> str:
+        """
+        Version of the data of the analytic tables, on a read-only connection
+        """
+        return await self._pool.read(self._data_version)
+
+    @staticmethod
+    def _data_version(db: sqlite3.Connection) -> str:
+        # the md5 of every loaded file, recorded in the transaction swapping their rows
+        sources = db.execute(
+            "SELECT uri, md5 FROM product_sources UNION ALL SELECT uri, md5 FROM csv_tables ORDER BY 1"
+        ).fetchall()
+        return AnalyticCache.fingerprint(sources)
+
+    @classmethod
+    def _load_csv(cls, db: sqlite3.Connection, file_path: Path, md5_hash: str | None) -> bool:
+        with file_path.open("r", encoding="utf-8-sig", newline="") as csvfile:
+            header = next(csv.reader(csvfile), [])
+        if cls.product_columns <= {column.strip() for column in header}:
+            return cls._create_product(db, file_path, md5_hash)
+        return cls._load_table(db, file_path, md5_hash)
+
+    @classmethod
+    def _load_table(cls, db: sqlite3.Connection, file_path: Path, md5_hash: str | None) -> bool:
+        """
+        Load a csv file into its own table, replacing the table of its previous version.
+        The column types are inferred from the first rows, the rows are streamed to the database by batches
+        and converted by SQLite, and the low cardinality columns are indexed once the table is filled.
+        The table is filled aside, a batch per transaction so the WAL stays small, then swapped with the previous one
+        and indexed in a single transaction: readers see either version, never a partial one.
+        """
+        source = file_path.absolute().as_uri()
+        md5_hash = md5_hash or cls._file_md5(file_path)
+        loaded = db.execute("SELECT table_name, md5 FROM csv_tables WHERE uri = ?", (source,)).fetchone()
+        if loaded is not None and loaded[1] == md5_hash:
+            return False
+        table_name = loaded[0] if loaded is not None else cls._table_name(db, file_path)
+
+        with file_path.open("r", encoding="utf-8-sig", newline="") as csvfile:
+            reader = csv.reader(csvfile)
+            header = next(reader, None)
+            if header is None:
+                raise ValueError(f"Csv file {file_path} has no header")
+            columns = cls._column_names(header)
+            types = cls._infer_types(itertools.islice(reader, cls.sample_size), len(columns))
+
+        loading = f"{table_name}__loading"
+        # DATE columns only hold ISO 8601 dates, a cell past the sample in another layout fails the load
+        definitions = ", ".join(
+            f'"{column}" DATE CHECK("{column}" GLOB \'[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]\')'
+            if data_type == "DATE" else f'"{column}" {data_type}'
+            for column, data_type in zip(columns, types)
+        )
+        # empty cells are NULL, DD/MM/YYYY dates are stored as ISO 8601, numbers are converted by the column affinity
+        values = ", ".join(
+            f"CASE WHEN ?{index} GLOB '[0-9][0-9]/[0-9][0-9]/[0-9][0-9][0-9][0-9]' "
+            f"THEN SUBSTR(?{index}, 7, 4) || '-' || SUBSTR(?{index}, 4, 2) || '-' || SUBSTR(?{index}, 1, 2) "
+            f"ELSE NULLIF(?{index}, '') END"
+            if data_type == "DATE" else f"NULLIF(?{index}, '')"
+            for index, data_type in enumerate(types, start=1)
+        )
+        cursor = db.cursor()
+        try:
+            # a table left by an interrupted load is dropped
+            cursor.execute(f'DROP TABLE IF EXISTS "{loading}"')
+            cursor.execute(f'CREATE TABLE "{loading}" ({definitions})')
+            db.commit()
+            with file_path.open("r", encoding="utf-8-sig", newline="") as csvfile:
+                reader = csv.reader(csvfile)
+                next(reader)
+                rows = cls._table_rows(reader, len(columns))
+                while batch := list(itertools.islice(rows, cls.batch_size)):
+                    cursor.executemany(f'INSERT INTO "{loading}" VALUES ({values})', batch)
+                    db.commit()
+
+            cursor.execute("BEGIN")
+            cursor.execute(f'DROP TABLE IF EXISTS "{table_name}"')
+            cursor.execute(f'ALTER TABLE "{loading}" RENAME TO "{table_name}"')
+            for column in cls._low_cardinality_columns(db, table_name, columns):
+                cursor.execute(f'CREATE INDEX "idx_{table_name}_{column}" ON "{table_name}"("{column}")')
+            cursor.execute(
+                """
+                INSERT INTO csv_tables (uri, table_name, md5, loaded_at) VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(uri) DO UPDATE SET md5 = excluded.md5, loaded_at = excluded.loaded_at""",
+                (source, table_name, md5_hash)
+            )
+        except Exception:
+            db.rollback()
+            db.execute(f'DROP TABLE IF EXISTS "{loading}"')
+            db.commit()
+            raise
+        db.commit()
+        return True
+
+    @classmethod
+    def _table_name(cls, db: sqlite3.Connection, file_path: Path) -> str:
+        """a free table name made of the file name"""
+        name = re.sub(r"\W+", "_", file_path.stem.lower(), flags=re.ASCII).strip("_") or "csv"
+        if name[0].isdigit() or name.startswith("sqlite") or name in cls.internal_tables | {"products"}:
+            name = f"csv_{name}"
+        tables = {row[0] for row in db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        candidate, suffix = name, 1
+        while candidate in tables:
+            suffix += 1
+            candidate = f"{name}_{suffix}"
+        return candidate
+
+    @staticmethod
+    def _column_names(header: list[str]) -> list[str]:
+        """identifiers of the header cells, unique and made of word characters"""
+        columns = []
+        for index, cell in enumerate(header, start=1):
+            name = re.sub(r"\W+", "_", cell.strip().lower(), flags=re.ASCII).strip("_") or f"column_{index}"
+            candidate, suffix = name, 1
+            while candidate in columns:
+                suffix += 1
+                candidate = f"{name}_{suffix}"
+            columns.append(candidate)
+        return columns
+
+    @classmethod
+    def _infer_types(cls, rows: Iterator[list[str]], width: int) -> list[str]:
+        """the narrowest of INTEGER, REAL, DATE and TEXT holding every non empty value of each column"""
+        candidates = [{"INTEGER", "REAL", "DATE"} for _ in range(width)]
+        seen = [False] * width
+        for row in rows:
+            for index, value in enumerate(row[:width]):
+                value = value.strip()
+                if not value:
+                    continue
+                seen[index] = True
+                column = candidates[index]
+                if "INTEGER" in column and not cls._integer.fullmatch(value):
+                    column.discard("INTEGER")
+                if "REAL" in column and not (cls._real.fullmatch(value) and any(c.isdigit() for c in value)):
+                    column.discard("REAL")
+                # the layout is checked on the raw cell, as it is converted while loading
+                if "DATE" in column and not cls._date.fullmatch(row[index]):
+                    column.discard("DATE")
+                if "DATE" in column:
+                    try:
+                        cls.iso_date(value)
+                    except ValueError:
+                        column.discard("DATE")
+        return [
+            next((data_type for data_type in ("INTEGER", "REAL", "DATE") if data_type in column), "TEXT") if any_value else "TEXT"
+            for column, any_value in zip(candidates, seen)
+        ]
+
+    @staticmethod
+    def _table_rows(reader: Iterator[list[str]], width: int) -> Iterator[list[str]]:
+        # blank lines are skipped, short rows are padded and long ones cut to the header width
+        for row in reader:
+            if len(row) != width:
+                if not row:
+                    continue
+                row = (row + [""] * width)[:width]
+            yield row
+
+    @classmethod
+    def _low_cardinality_columns(cls, db: sqlite3.Connection, table_name: str, columns: list[str]) -> list[str]:
+        rows = db.execute(f'SELECT COUNT(*) FROM "{table_name}"').fetchone()[0]
+        limit = min(cls.index_max_distinct, rows // 10)
+        indexed = []
+        for column in columns:
+            # the distinct values are counted up to the limit, high cardinality columns are not scanned to the end
+            distinct = db.execute(
+                f'SELECT COUNT(*) FROM (SELECT DISTINCT "{column}" FROM "{table_name}" LIMIT ?)', (limit + 1,)
+            ).fetchone()[0]
+            if 1 < distinct <= limit:
+                indexed.append(column)
+        return indexed
+
+    @staticmethod
+    def _file_md5(file_path: Path) -> str:
+        with file_path.open("rb") as file:
+            return hashlib.file_digest(file, "md5").hexdigest()
+
+    @staticmethod
+    def iso_date(value: str) -> str:
+        """
+        Convert a DD/MM/YYYY date of the csv files to ISO 8601, ISO dates are kept as they are
+        """
+        for date_format in ("%d/%m/%Y", "%Y-%m-%d"):
+            try:
+                return datetime.strptime(value.strip(), date_format).date().isoformat()
+            except ValueError:
+                continue
+        raise ValueError(f"Unsupported date {value!r}, expected DD/MM/YYYY or YYYY-MM-DD")
     
-    def get_table_schema(self) -> dict:
+    def get_table_schema(self, table_name: str = "products") -> dict:
         """
         Get the table schema
         """
-        cursor = self._connection.cursor()
-        cursor.execute("PRAGMA table_info(products)")
+        return self._pool.read_blocking(self._get_table_schema, table_name)
+
+    async def aget_table_schema(self, table_name: str = "products") -> dict:
+        """
+        Get the table schema, on a read-only connection
+        """
+        return await self._pool.read(self._get_table_schema, table_name)
+
+    def get_table_schemas(self) -> list[dict]:
+        """
+        Get the schema of every table: the products and the csv tables
+        """
+        return self._pool.read_blocking(self._get_table_schemas)
+
+    async def aget_table_schemas(self) -> list[dict]:
+        """
+        Get the schema of every table, on a read-only connection
+        """
+        return await self._pool.read(self._get_table_schemas)
+
+    @classmethod
+    def _get_table_schemas(cls, db: sqlite3.Connection) -> list[dict]:
+        tables = db.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite%' AND name NOT LIKE '%\\_\\_loading' ESCAPE '\\' ORDER BY name"
+        ).fetchall()
+        return [cls._get_table_schema(db, table[0]) for table in tables if table[0] not in cls.internal_tables]
+
+    @staticmethod
+    def _get_table_schema(db: sqlite3.Connection, table_name: str) -> dict:
+        cursor = db.cursor()
+        cursor.execute(f'PRAGMA table_info("{table_name}")')
         columns = cursor.fetchall()
+        indexed_columns = [
+            db.execute(f'PRAGMA index_info("{index[1]}")').fetchone()[2]
+            for index in db.execute(f'PRAGMA index_list("{table_name}")').fetchall()
+        ]
         return {
-            "table_name": "products",
+            "table_name": table_name,
+            "indexed_columns": indexed_columns,
             "columns": [
                 {
                     "column_name": column[1],
@@ -78,21 +487,39 @@ class Analytic:
             ]
         }
     
-    def execute_query(self, query: str) -> list:
+    def execute_query(self, query: str, rollups: bool = True) -> list:
         """
-        Execute a query over the sqlite database
+        Execute a query over the sqlite database, aggregates of the products are read from their rollup when possible
         """
-        cursor = self._connection.cursor()
+        return self._pool.read_blocking(self._execute_query, self._rewrite(query) if rollups else query)
+
+    async def aexecute_query(self, query: str, rollups: bool = True) -> list:
+        """
+        Execute a query over the sqlite database, on a read-only connection
+        """
+        return await self._pool.read(self._execute_query, self._rewrite(query) if rollups else query)
+
+    @staticmethod
+    def _rewrite(query: str) -> str:
+        rewritten = ProductRollup.rewrite(query)
+        if rewritten is None:
+            return query
+        logging.debug(f"Query answered from {ProductRollup.table}: {rewritten}")
+        return rewritten
+
+    @staticmethod
+    def _execute_query(db: sqlite3.Connection, query: str) -> list:
+        cursor = db.cursor()
         cursor.execute(query)
         return cursor.fetchall()
         
     
     def close(self) -> None:
         """
-        Close the database connection
+        Release the connection pool, closed once no other Analytic uses it
         """
         if self._connection is not None:
-            self._connection.close()
+            self._pool.release()
             self._connection = None
 
 
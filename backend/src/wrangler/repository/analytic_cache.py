@@ -0,0 +1,69 @@
+import hashlib
+import json
+import re
+from typing import Any, ClassVar
+
+from ..cache import TTLCache
+from .query_embedding_cache import QueryEmbeddingCache
+
+
+class AnalyticCache:
+    """
+    Cache of the analytic questions, in two levels.
+    The first maps the normalized question, the fingerprint of the table schemas and the model to the generated SQL,
+    so a repeated question does not call the model. The second maps the SQL and the data version of the database
+    to the result rows, so a repeated query does not scan the tables. A reload of the analytic tables changes the
+    data version and clears both levels. The results of queries reading the current date or time are not cached,
+    they change at date boundaries while the data version does not.
+    """
+    # 'now', CURRENT_DATE, CURRENT_TIME, CURRENT_TIMESTAMP and the date functions without a time value, which default to now
+    _time_relative: ClassVar[re.Pattern] = re.compile(
+        r"""["']now["']|\bcurrent_(?:date|time|timestamp)\b"""
+        r"|\b(?:date|time|datetime|julianday|unixepoch)\s*\(\s*\)|\bstrftime\s*\(\s*'[^']*'\s*\)",
+        re.IGNORECASE,
+    )
+
+    def __init__(self, max_entries: int = 1_000, ttl: float | None = 3600.0, max_rows: int = 10_000):
+        self.max_rows = max_rows
+        self.translations: TTLCache[tuple[str, str, str], dict] = TTLCache(max_entries, ttl)
+        self.results: TTLCache[tuple[str, str], list] = TTLCache(max_entries, ttl)
+
+    @staticmethod
+    def fingerprint(value: Any) -> str:
+        """md5 of the json of the value, stable across processes"""
+        return hashlib.md5(json.dumps(value, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def translation_key(self, question: str, table_schemas: list[dict], model: str) -> tuple[str, str, str]:
+        return QueryEmbeddingCache.normalize(question), self.fingerprint(table_schemas), model
+
+    def get_translation(self, question: str, table_schemas: list[dict], model: str) -> dict | None:
+        """the SQL query and column names generated for the question, None when it is not cached"""
+        return self.translations.get(self.translation_key(question, table_schemas, model))
+
+    def put_translation(self, question: str, table_schemas: list[dict], model: str, translation: dict) -> None:
+        self.translations.put(self.translation_key(question, table_schemas, model), translation)
+
+    @classmethod
+    def time_relative(cls, query: str) -> bool:
+        """whether the query reads the current date or time, so its results are not cached"""
+        return cls._time_relative.search(query) is not None
+
+    def get_results(self, query: str, data_version: str) -> list | None:
+        """the rows of the query for this version of the data, None when they are not cached"""
+        if self.time_relative(query):
+            return None
+        return self.results.get((query.strip(), data_version))
+
+    def put_results(self, query: str, data_version: str, rows: list) -> None:
+        # large results would evict many small ones, they are run again instead
+        if len(rows) <= self.max_rows and not self.time_relative(query):
+            self.results.put((query.strip(), data_version), rows)
+
+    def invalidate(self) -> None:
+        """drop every entry of both levels"""
+        self.translations.invalidate()
+        self.results.invalidate()
+
+    def stats(self) -> dict:
+        """hit counters of both levels"""
+        return {"translations": self.translations.stats(), "results": self.results.stats()}
@@ -1,176 +1,325 @@
+import asyncio
+import hashlib
+import itertools
 import json
+import logging
+import os
 import re
-from typing import ClassVar
+import sqlite3
+import threading
+from collections import defaultdict, deque
+from dataclasses import dataclass, field
+from typing import ClassVar, Iterable, Iterator
 
+import numpy as np
 import tiktoken
 from .base import BaseRepository
 from ..repository.store import Store
 from ..model.chunk import Chunk
 from ..embedding import get_embedder
+from ..embedding.base import BaseEmbedder
+from ..repository.embedding_cache import EmbeddingCache
+from ..repository.query_embedding_cache import QueryEmbeddingCache
+from ..settings import get_settings
+
+@dataclass(frozen=True)
+class ChunkSpan:
+    """a chunk of a text: text[start:end], made of the tokens token_start to token_end of the text"""
+    start: int
+    end: int
+    token_start: int
+    token_end: int
+
 
 class Chunker:
-    """Chunker class to chunk the document into smaller chunks"""
+    """
+    Chunker class to chunk the document into windows of chunk_size tokens overlapping by chunk_overlap tokens.
+    A text is encoded once and every chunk is sliced from it at the character offsets of its tokens, nothing is decoded.
+    split and split_many are synchronous, split_many encoding the texts on several threads;
+    chunk and chunk_many run them in a worker thread so they do not block the event loop.
+    """
     
     encoder: ClassVar[tiktoken.Encoding] = tiktoken.get_encoding("cl100k_base")
+    # number of bytes of each token of the encoder, built on first use
+    _token_sizes: ClassVar[np.ndarray | None] = None
+    _token_sizes_lock: ClassVar[threading.Lock] = threading.Lock()
     
-    def __init__(self, chunk_size: int = 256, chunk_overlap: int = 32):
+    def __init__(self, chunk_size: int = 256, chunk_overlap: int = 32, threads: int | None = None):
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
+        self.threads = threads or os.cpu_count() or 1
         
     async def chunk(self, text: str) -> list[str]:
         """Chunk the text into smaller chunks"""
+        return await asyncio.to_thread(self.split, text)
+
+    async def chunk_many(self, texts: list[str]) -> list[list[str]]:
+        """Chunk many texts, their encoding is spread over several threads"""
+        return await asyncio.to_thread(self.split_many, texts)
+
+    def split(self, text: str) -> list[str]:
+        """the chunks of the text"""
+        return [text[span.start:span.end] for span in self.spans(text)]
+
+    def split_many(self, texts: list[str]) -> list[list[str]]:
+        """the chunks of each text"""
+        token_lists = self.encoder.encode_ordinary_batch(texts, num_threads=self.threads)
+        return [
+            [text[span.start:span.end] for span in self.spans(text, tokens)]
+            for text, tokens in zip(texts, token_lists)
+        ]
+
+    def stream(self, pieces: Iterable[str], window: int = 1 << 20) -> Iterator[str]:
+        """the chunks of a text given as consecutive pieces, tokenizing about window characters at a time.
+        Once the buffered text reaches the window, every complete chunk is yielded and the buffer restarts at the
+        first token of the last chunk, where the next window of the whole text starts too.
+        """
+        buffer = ""
+        for piece in pieces:
+            buffer += piece
+            if len(buffer) < window:
+                continue
+            spans = self.spans(buffer)
+            for span in spans[:-1]:
+                yield buffer[span.start:span.end]
+            buffer = buffer[spans[-1].start:]
+        yield from self.split(buffer)
+
+    def spans(self, text: str, tokens: list[int] | None = None) -> list[ChunkSpan]:
+        """the character and token offsets of the chunks of the text, tokens can be given when already encoded"""
         if not text:
             return []
-        if len(text) <= self.chunk_size:
-            return [text]
-        
-        tokens = self.encoder.encode(text, disallowed_special=())
-        if self.chunk_size > len(tokens):
-            return [text]
-        
-        chunks = []
-        i = 0
-        
-        while i < len(tokens):
-            start_idx = i
-            end_idx = min(i + self.chunk_size, len(tokens))
-            chunk_tokens = tokens[start_idx:end_idx]
-            chunk_text = self.encoder.decode(chunk_tokens)
-            chunks.append(chunk_text)
-            if end_idx >= len(tokens):
+        if tokens is None:
+            tokens = self.encoder.encode_ordinary(text)
+        if len(tokens) <= self.chunk_size:
+            return [ChunkSpan(0, len(text), 0, len(tokens))]
+
+        offsets = self._char_offsets(text, tokens)
+        spans = []
+        step = self.chunk_size - self.chunk_overlap
+        for token_start in range(0, len(tokens), step):
+            token_end = min(token_start + self.chunk_size, len(tokens))
+            spans.append(ChunkSpan(int(offsets[token_start]), int(offsets[token_end]), token_start, token_end))
+            if token_end >= len(tokens):
                 break
-            i += self.chunk_size - self.chunk_overlap
-        return chunks
+        return spans
+
+    @classmethod
+    def _char_offsets(cls, text: str, tokens: list[int]) -> np.ndarray:
+        """character offset of the start of each token, followed by the length of the text"""
+        byte_offsets = np.zeros(len(tokens) + 1, dtype=np.int64)
+        np.cumsum(cls._token_size_table()[np.asarray(tokens, dtype=np.int64)], out=byte_offsets[1:])
+        if text.isascii():
+            return byte_offsets
+        data = np.frombuffer(text.encode("utf-8"), dtype=np.uint8)
+        # character of each byte, a token ending inside a multi-byte character is cut before that character
+        char_of_byte = np.cumsum((data & 0xC0) != 0x80) - 1
+        return np.append(char_of_byte, len(text))[byte_offsets]
+
+    @classmethod
+    def _token_size_table(cls) -> np.ndarray:
+        if cls._token_sizes is None:
+            with cls._token_sizes_lock:
+                if cls._token_sizes is None:
+                    sizes = np.zeros(cls.encoder.max_token_value + 1, dtype=np.int64)
+                    for token in range(len(sizes)):
+                        try:
+                            sizes[token] = len(cls.encoder.decode_single_token_bytes(token))
+                        except KeyError:
+                            pass
+                    cls._token_sizes = sizes
+        return cls._token_sizes
     
 chunker = Chunker() 
 
+@dataclass
+class ChunkSync:
+    """changes needed to bring the stored chunks of a document in line with its new content"""
+    document_id: int
+    chunk_count: int
+    stale_ids: list[int] = field(default_factory=list)
+    reordered: list[Chunk] = field(default_factory=list)
+    kept: list[Chunk] = field(default_factory=list)
+    new_chunks: list[Chunk] = field(default_factory=list)
+    new_embeddings: list[list[float]] = field(default_factory=list)
+
+
 class ChunkRepository(BaseRepository[Chunk]):
     """
     Chunk repository class to manage the database connection and create the database tables
     """
-    def __init__(self, store):
+    def __init__(self, store, embedder: BaseEmbedder | None = None):
         super().__init__(store)
-        self.embedder = get_embedder()
+        self.embedder = embedder or get_embedder()
+        if self.embedder.get_vector_dim() != store.vector_dim:
+            raise ValueError(
+                f"The embedder produces {self.embedder.get_vector_dim()}-dimensional vectors, the store holds {store.vector_dim}"
+            )
+        settings = get_settings()
+        self.embedding_cache = EmbeddingCache(store, settings.embedding_cache_max_entries)
+        self.query_embedding_cache = QueryEmbeddingCache(
+            self.embedding_cache if settings.query_embedding_cache_persist else None,
+            settings.query_embedding_cache_max_entries,
+            settings.query_embedding_cache_ttl,
+        )
     
-    async def create(self, item: Chunk, commit: bool = True) -> Chunk:
+    async def create(self, item: Chunk, commit: bool = True, embedding: list[float] | None = None) -> Chunk:
         if self.store._connection is None:
             raise ValueError("Store connection is not open")
-        
-        cursor = self.store._connection.cursor()
-        cursor.execute(
+
+        if embedding is None:
+            embedding = (await self.embedding_cache.embed_batch(self.embedder, [item.content]))[0]
+        await self.create_many([item], [embedding], commit)
+        return item
+
+    async def create_many(self, items: list[Chunk], embeddings: list[list[float]], commit: bool = True) -> list[Chunk]:
+        """bulk insert chunks with their pre-computed embeddings in a single transaction"""
+        if self.store._connection is None:
+            raise ValueError("Store connection is not open")
+        if len(items) != len(embeddings):
+            raise ValueError(f"Got {len(items)} chunks but {len(embeddings)} embeddings")
+        if not items:
+            return []
+
+        def _create_many(db: sqlite3.Connection) -> list[Chunk]:
+            try:
+                self._insert_many(db, items, embeddings)
+            except Exception as e:
+                if commit:
+                    db.rollback()
+                raise e
+            if commit:
+                db.commit()
+            return items
+
+        return await self.store.write(_create_many)
+
+    def _insert_many(self, db: sqlite3.Connection, items: list[Chunk], embeddings: list[list[float]]) -> None:
+        """insert the chunks, their embeddings and their fts rows, without committing"""
+        cursor = db.cursor()
+        if items:
+            # the first insert takes the write lock of the database and its id is the next one of AUTOINCREMENT.
+            # executemany does not report the generated ids, so the following ones are allocated after it,
+            # no other connection (of this process or another) can insert chunks before the transaction ends
+            first = items[0]
+            cursor.execute(
+                "INSERT INTO chunks (document_id, content, metadata) VALUES (?, ?, ?) RETURNING id",
+                (first.document_id, first.content, json.dumps(first.metadata))
+            )
+            first.id = cursor.fetchone()[0]
+            for offset, item in enumerate(items[1:], 1):
+                item.id = first.id + offset
+
+        cursor.executemany(
             """
-            INSERT INTO chunks (document_id, content, metadata)
-            VALUES (?, ?, ?)
+            INSERT INTO chunks (id, document_id, content, metadata)
+            VALUES (?, ?, ?, ?)
             """,
-            (item.document_id, item.content, json.dumps(item.metadata))
+            [(item.id, item.document_id, item.content, json.dumps(item.metadata)) for item in items[1:]]
         )
-        item.id = cursor.lastrowid
-
-        embedding = await self.embedder.embed(item.content)
-        serialized_embedding = Store.serialize_embeddings(embedding)
-        cursor.execute(
-            """
+        serialized_embeddings = [(item.id, Store.serialize_embeddings(embedding, self.store.vector_dim)) for item, embedding in zip(items, embeddings)]
+        cursor.executemany(
+            f"""
             INSERT INTO chunk_embeddings (chunk_id, embedding)
-            VALUES (?, ?)
+            VALUES (?, {self.store.quantize_sql("?")})
             """,
-            (item.id, serialized_embedding)
+            serialized_embeddings
         )
-        
-        cursor.execute(
+        if self.store.quantized:
+            cursor.executemany("INSERT INTO chunk_vectors (chunk_id, embedding) VALUES (?, ?)", serialized_embeddings)
+        cursor.executemany(
             """
             INSERT INTO chunks_fts (rowid, content)
             VALUES (?, ?)
             """,
-            (item.id, item.content)
+            [(item.id, item.content) for item in items]
         )
-        
-        if commit:
-            self.store._connection.commit()
-        return item
-    
+        for index in self.store.vector_indexes:
+            index.stage_add([item.id for item in items], embeddings)
+        self.store.vectors_changed(db)
+
     async def get_by_id(self, id: int) -> Chunk | None:
         if self.store._connection is None:
             raise ValueError("Store connection is not open")
         
-        cursor = self.store._connection.cursor()
-        cursor.execute(
-            """
-            SELECT id, document_id, content, metadata
-            FROM chunks
-            WHERE id = ?
-            """,
-            (id,)
-        )
-        result = cursor.fetchone()
-        if result is None:
-            return None
-        
-        chunk_id, document_id, content, metadata = result
-        return Chunk(
-            id=chunk_id,
-            document_id=document_id,
-            content=content,
-            metadata=json.loads(metadata)
-        )
+        def _get_by_id(db: sqlite3.Connection) -> Chunk | None:
+            cursor = db.cursor()
+            cursor.execute(
+                """
+                SELECT id, document_id, content, metadata
+                FROM chunks
+                WHERE id = ?
+                """,
+                (id,)
+            )
+            result = cursor.fetchone()
+            if result is None:
+                return None
+
+            chunk_id, document_id, content, metadata = result
+            return Chunk(
+                id=chunk_id,
+                document_id=document_id,
+                content=content,
+                metadata=json.loads(metadata)
+            )
+
+        return await self.store.read(_get_by_id)
     
     async def update(self, item: Chunk) -> Chunk:
         if self.store._connection is None:
             raise ValueError("Store connection is not open")
-        
-        cursor = self.store._connection.cursor()
-        cursor.execute(
-            """
-            UPDATE chunks SET document_id = ?, content = ?, metadata = ? WHERE id = ?""",
-            (item.document_id, item.content, json.dumps(item.metadata), item.id)
-        )
-        
+
         #regenerate embedding
-        embedding = await self.embedder.embed(item.content)
-        serialized_embedding = Store.serialize_embeddings(embedding)
-        cursor.execute(
-            """
-            UPDATE chunks_embeddings SET embedding = ? WHERE chunk_id = ?""",
-            (serialized_embedding, item.id)
-        )
-        
-        #update fts
-        cursor.execute(
-            """
-            UPDATE chunks_fts SET content = ? WHERE rowid = ?""",
-            (item.content, item.id)
-        )
+        embedding = (await self.embedding_cache.embed_batch(self.embedder, [item.content]))[0]
+        serialized_embedding = Store.serialize_embeddings(embedding, self.store.vector_dim)
 
-        self.store._connection.commit()
-        return item
+        def _update(db: sqlite3.Connection) -> Chunk:
+            cursor = db.cursor()
+            #remove the old content from fts while it is still in chunks
+            cursor.execute(
+                """
+                INSERT INTO chunks_fts (chunks_fts, rowid, content)
+                SELECT 'delete', id, content FROM chunks WHERE id = ?""",
+                (item.id,)
+            )
+            cursor.execute(
+                """
+                UPDATE chunks SET document_id = ?, content = ?, metadata = ? WHERE id = ?""",
+                (item.document_id, item.content, json.dumps(item.metadata), item.id)
+            )
+            # vec0 rejects quantized vectors in an UPDATE, so the row is replaced
+            cursor.execute("DELETE FROM chunk_embeddings WHERE chunk_id = ?", (item.id,))
+            cursor.execute(
+                f"""
+                INSERT INTO chunk_embeddings (chunk_id, embedding) VALUES (?, {self.store.quantize_sql("?")})""",
+                (item.id, serialized_embedding)
+            )
+            if self.store.quantized:
+                cursor.execute(
+                    "INSERT OR REPLACE INTO chunk_vectors (chunk_id, embedding) VALUES (?, ?)",
+                    (item.id, serialized_embedding)
+                )
+            #update fts
+            cursor.execute(
+                """
+                INSERT INTO chunks_fts (rowid, content)
+                VALUES (?, ?)""",
+                (item.id, item.content)
+            )
+            for index in self.store.vector_indexes:
+                index.stage_add([item.id], [embedding])
+            self.store.vectors_changed(db)
+            db.commit()
+            return item
+
+        return await self.store.write(_update)
     
     async def delete(self, id: int, commit: bool = True) -> bool:
         if self.store._connection is None:
             raise ValueError("Store connection is not open")
-        
-        cursor = self.store._connection.cursor()
 
-        #delete fts first
-        cursor.execute(
-            """
-            DELETE FROM chunks_fts WHERE rowid = ?""",
-            (id,)
-        )
-
-        #delete embedding
-        cursor.execute(
-            """
-            DELETE FROM chunks_embeddings WHERE chunk_id = ?""",
-            (id,)
-        )
-
-        #delete chunk
-        cursor.execute(
-            """
-            DELETE FROM chunks WHERE id = ?""",
-            (id,)
-        )
-        if commit:
-            self.store._connection.commit()
+        await self._delete_where_async("id = ?", (id,), commit)
         return True
     
     async def list_all(self, limit: int | None = None, offset: int | None = None) -> list[Chunk]:
@@ -178,107 +327,298 @@ class ChunkRepository(BaseRepository[Chunk]):
         if self.store._connection is None:
             raise ValueError("Store connection is not open")
         
-        cursor = self.store._connection.cursor()
-        query = """
-            SELECT id, document_id, content, metadata
-            FROM chunks
-            ORDER BY document_id DESC
-        """
-        if limit is not None:
-            query += " LIMIT ?"
-        if offset is not None:
-            query += " OFFSET ?"
-        cursor.execute(query, (limit, offset))
-
-        result = cursor.fetchall()
-        return [Chunk(
-            id=chunk_id,
-            document_id=document_id,
-            content=content,
-            metadata=json.loads(metadata) if metadata else {}
-        ) for chunk_id, document_id, content, metadata in result]
+        def _list_all(db: sqlite3.Connection) -> list[Chunk]:
+            cursor = db.cursor()
+            query = """
+                SELECT id, document_id, content, metadata
+                FROM chunks
+                ORDER BY document_id DESC
+            """
+            # sqlite only accepts OFFSET after a LIMIT, -1 meaning no limit
+            params = []
+            if limit is not None or offset is not None:
+                query += " LIMIT ?"
+                params.append(limit if limit is not None else -1)
+            if offset is not None:
+                query += " OFFSET ?"
+                params.append(offset)
+            cursor.execute(query, params)
+
+            result = cursor.fetchall()
+            return [Chunk(
+                id=chunk_id,
+                document_id=document_id,
+                content=content,
+                metadata=json.loads(metadata) if metadata else {}
+            ) for chunk_id, document_id, content, metadata in result]
+
+        return await self.store.read(_list_all)
+
+    async def prepare_chunks(self, content: str, chunk_texts: list[str] | None = None,
+                             embeddings: list[list[float]] | None = None) -> tuple[list[str], list[list[float]]]:
+        """chunk the content (unless chunk_texts is given) and embed the chunks (unless embeddings of chunk_texts
+        are given), without writing them"""
+        if chunk_texts is None:
+            chunk_texts = await chunker.chunk(content)
+        if embeddings is None:
+            embeddings = await self.embedding_cache.embed_batch(self.embedder, chunk_texts)
+        return chunk_texts, embeddings
     
-    async def create_chunks_from_document(self, document_id: int, content: str, commit: bool = True) -> list[Chunk]:
-        """create chunks and embeddings from a document"""
-        chunk_texts = await chunker.chunk(content)
-        created_chunks = []
+    async def create_chunks_from_document(self, document_id: int, content: str, commit: bool = True,
+                                          chunk_texts: list[str] | None = None) -> list[Chunk]:
+        """create chunks and embeddings from a document, chunk_texts can be given when the content is already chunked"""
+        chunk_texts, embeddings = await self.prepare_chunks(content, chunk_texts)
+        chunks = [
+            Chunk(document_id=document_id, content=chunk_text, metadata={"order": order})
+            for order, chunk_text in enumerate(chunk_texts)
+        ]
+        return await self.create_many(chunks, embeddings, commit)
+
+    async def stream_chunks_from_document(self, document_id: int, pieces: Iterable[str], batch_size: int = 256,
+                                          window: int = 1 << 20) -> int:
+        """create the chunks of a document whose text comes in pieces and return their number.
+        The text is chunked in a worker thread one batch ahead while the current batch is embedded and written,
+        so only a window of the text and two batches of chunks are in memory, whatever the size of the document.
+        """
+        if self.store._connection is None:
+            raise ValueError("Store connection is not open")
 
+        chunk_texts = chunker.stream(pieces, window)
+
+        def take() -> list[str]:
+            return list(itertools.islice(chunk_texts, batch_size))
+
+        created = 0
+        next_batch = asyncio.ensure_future(asyncio.to_thread(take))
+        try:
+            while batch := await next_batch:
+                next_batch = asyncio.ensure_future(asyncio.to_thread(take))
+                embeddings = await self.embedding_cache.embed_batch(self.embedder, batch)
+                chunks = [
+                    Chunk(document_id=document_id, content=chunk_text, metadata={"order": order})
+                    for order, chunk_text in enumerate(batch, created)
+                ]
+                await self.create_many(chunks, embeddings)
+                created += len(batch)
+        finally:
+            # the generator must not run on two threads, wait for the batch being chunked before leaving
+            await asyncio.gather(next_batch, return_exceptions=True)
+        return created
+
+    async def last_id(self, document_id: int) -> int:
+        """id of the newest chunk of a document, 0 when it has none"""
+        if self.store._connection is None:
+            raise ValueError("Store connection is not open")
+
+        def _last_id(db: sqlite3.Connection) -> int:
+            return db.execute("SELECT COALESCE(MAX(id), 0) FROM chunks WHERE document_id = ?", (document_id,)).fetchone()[0]
+
+        return await self.store.read(_last_id)
+
+    async def sync_chunks_from_document(self, document_id: int, content: str, commit: bool = True,
+                                        chunk_texts: list[str] | None = None) -> list[Chunk]:
+        """re-chunk a document and only write the chunks that changed.
+        Stored chunks are matched to the new ones by content hash in order, unchanged chunks are kept
+        (with their order updated if they moved), new ones are inserted and the leftovers are deleted.
+        """
+        if self.store._connection is None:
+            raise ValueError("Store connection is not open")
+
+        sync = await self.plan_sync(document_id, content, chunk_texts)
+
+        def _sync(db: sqlite3.Connection) -> list[Chunk]:
+            try:
+                chunks = self._apply_sync(db, sync)
+            except Exception as e:
+                if commit:
+                    db.rollback()
+                raise e
+            if commit:
+                db.commit()
+            return chunks
+
+        return await self.store.write(_sync)
+
+    async def plan_sync(self, document_id: int, content: str, chunk_texts: list[str] | None = None,
+                        embeddings: list[list[float]] | None = None) -> ChunkSync:
+        """compare the new chunks of a document to the stored ones and embed the new chunks,
+        unless the embeddings of chunk_texts are given"""
+        if chunk_texts is None:
+            chunk_texts = await chunker.chunk(content)
+        existing_chunks: dict[str, deque[Chunk]] = defaultdict(deque)
+        for chunk in await self.get_by_document_id(document_id):
+            existing_chunks[self.content_hash(chunk.content)].append(chunk)
+
+        sync = ChunkSync(document_id=document_id, chunk_count=len(chunk_texts))
         for order, chunk_text in enumerate(chunk_texts):
-            chunk = Chunk(document_id=document_id, content=chunk_text, metadata={"order": order})
-            created_chunk = await self.create(chunk, commit)
-            created_chunks.append(created_chunk)
-        return created_chunks
+            matches = existing_chunks.get(self.content_hash(chunk_text))
+            if matches:
+                chunk = matches.popleft()
+                if chunk.metadata.get("order") != order:
+                    chunk.metadata["order"] = order
+                    sync.reordered.append(chunk)
+                sync.kept.append(chunk)
+            else:
+                sync.new_chunks.append(Chunk(document_id=document_id, content=chunk_text, metadata={"order": order}))
+
+        sync.stale_ids = [chunk.id for matches in existing_chunks.values() for chunk in matches if chunk.id is not None]
+        if embeddings is None:
+            sync.new_embeddings = await self.embedding_cache.embed_batch(self.embedder, [chunk.content for chunk in sync.new_chunks])
+        else:
+            sync.new_embeddings = [embeddings[chunk.metadata["order"]] for chunk in sync.new_chunks]
+        return sync
+
+    def _apply_sync(self, db: sqlite3.Connection, sync: ChunkSync) -> list[Chunk]:
+        """write the changes of a sync plan, without committing"""
+        if sync.stale_ids:
+            self._delete_where(db, "id IN (SELECT value FROM json_each(?))", (json.dumps(sync.stale_ids),))
+        db.executemany(
+            "UPDATE chunks SET metadata = ? WHERE id = ?",
+            [(json.dumps(chunk.metadata), chunk.id) for chunk in sync.reordered]
+        )
+        self._insert_many(db, sync.new_chunks, sync.new_embeddings)
+
+        logging.info(
+            f"Synced chunks of document {sync.document_id}: {len(sync.kept)} kept, "
+            f"{len(sync.reordered)} reordered, {len(sync.new_chunks)} inserted, {len(sync.stale_ids)} deleted"
+        )
+        return sorted(sync.kept + sync.new_chunks, key=lambda chunk: chunk.metadata["order"])
+
+    @staticmethod
+    def content_hash(content: str) -> str:
+        """hash of a chunk content used to detect unchanged chunks"""
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
     
     async def delete_all(self, commit: bool = True) -> bool:
         """delete all chunks"""
         if self.store._connection is None:
             raise ValueError("Store connection is not open")
         
-        cursor = self.store._connection.cursor()
-        cursor.execute("DELETE FROM chunks")
-        cursor.execute("DELETE FROM chunks_embeddings")
-        cursor.execute("DELETE FROM chunks_fts")
-        if commit:
-            self.store._connection.commit()
-        return True
+        def _delete_all(db: sqlite3.Connection) -> bool:
+            cursor = db.cursor()
+            cursor.execute("INSERT INTO chunks_fts (chunks_fts) VALUES ('delete-all')")
+            cursor.execute("DELETE FROM chunks")
+            cursor.execute("DELETE FROM chunk_embeddings")
+            if self.store.quantized:
+                cursor.execute("DELETE FROM chunk_vectors")
+            for index in self.store.vector_indexes:
+                index.stage_clear()
+            self.store.vectors_changed(db)
+            if commit:
+                db.commit()
+            return True
+
+        return await self.store.write(_delete_all)
     
     async def get_by_document_id(self, document_id: int) -> list[Chunk]:
         """get all chunks by document id"""
         if self.store._connection is None:
             raise ValueError("Store connection is not open")
         
-        cursor = self.store._connection.cursor()
-        cursor.execute("""
-            SELECT c.id, c.document_id, c.content, c.metadata, d.uri, d.metadata as document_metadata
-            FROM chunks c
-            JOIN documents d ON c.document_id = d.id
-            WHERE c.document_id = ?
-            ORDER BY JSON_EXTRACT(c.metadata, '$.order')
-            """, (document_id,))
-        result = cursor.fetchall()
-        return [Chunk(
-            id=chunk_id,
-            document_id=document_id,
-            content=content,
-            metadata=json.loads(metadata) if metadata else {},
-            document_uri=document_uri,
-            document_metadata=json.loads(document_metadata) if document_metadata else {}
-        ) for chunk_id, document_id, content, metadata, document_uri, document_metadata in result]
-
-    async def delete_by_document_id(self, document_id: int, commit: bool = True) -> bool:
-        """delete all chunks by document id"""
+        def _get_by_document_id(db: sqlite3.Connection) -> list[Chunk]:
+            cursor = db.cursor()
+            cursor.execute("""
+                SELECT c.id, c.document_id, c.content, c.metadata, d.uri, d.metadata as document_metadata
+                FROM chunks c
+                JOIN documents d ON c.document_id = d.id
+                WHERE c.document_id = ?
+                ORDER BY JSON_EXTRACT(c.metadata, '$.order')
+                """, (document_id,))
+            result = cursor.fetchall()
+            return [Chunk(
+                id=chunk_id,
+                document_id=document_id,
+                content=content,
+                metadata=json.loads(metadata) if metadata else {},
+                document_uri=document_uri,
+                document_metadata=json.loads(document_metadata) if document_metadata else {}
+            ) for chunk_id, document_id, content, metadata, document_uri, document_metadata in result]
+
+        return await self.store.read(_get_by_document_id)
+
+    async def delete_by_document_id(self, document_id: int, commit: bool = True, until_id: int | None = None) -> bool:
+        """delete all chunks by document id, or only the ones up to until_id"""
         if self.store._connection is None:
             raise ValueError("Store connection is not open")
-        
-        chunks = await self.get_by_document_id(document_id)
 
-        delete_any = False
-        for chunk in chunks:
-            if chunk.id is not None:
-                deleted = await self.delete(chunk.id, commit=False)
-                delete_any = deleted or delete_any
-        
-        if commit and delete_any:
-            self.store._connection.commit()
-        return delete_any
-    
+        if until_id is not None:
+            return await self._delete_where_async("document_id = ? AND id <= ?", (document_id, until_id), commit)
+        return await self._delete_where_async("document_id = ?", (document_id,), commit)
+
+    async def delete_many(self, ids: list[int], commit: bool = True) -> bool:
+        """delete the chunks with the given ids"""
+        if self.store._connection is None:
+            raise ValueError("Store connection is not open")
+        if not ids:
+            return False
+
+        return await self._delete_where_async("id IN (SELECT value FROM json_each(?))", (json.dumps(ids),), commit)
+
+    async def _delete_where_async(self, condition: str, params: tuple, commit: bool) -> bool:
+        def _delete(db: sqlite3.Connection) -> bool:
+            delete_any = self._delete_where(db, condition, params)
+            if commit and delete_any:
+                db.commit()
+            return delete_any
+
+        return await self.store.write(_delete)
+
+    def _delete_where(self, db: sqlite3.Connection, condition: str, params: tuple) -> bool:
+        """delete the chunks matching the condition, their embeddings and their fts rows with set based statements"""
+        cursor = db.cursor()
+
+        if self.store.vector_indexes:
+            cursor.execute(f"SELECT id FROM chunks WHERE {condition}", params)
+            chunk_ids = [chunk_id for chunk_id, in cursor.fetchall()]
+            for index in self.store.vector_indexes:
+                index.stage_remove(chunk_ids)
+
+        # chunks_fts is an external content table, its rows must be removed with the
+        # 'delete' command while the chunk content is still there
+        cursor.execute(
+            f"""
+            INSERT INTO chunks_fts (chunks_fts, rowid, content)
+            SELECT 'delete', id, content FROM chunks WHERE {condition}""",
+            params
+        )
+        cursor.execute(
+            f"""
+            DELETE FROM chunk_embeddings WHERE chunk_id IN (SELECT id FROM chunks WHERE {condition})""",
+            params
+        )
+        if self.store.quantized:
+            cursor.execute(
+                f"""
+                DELETE FROM chunk_vectors WHERE chunk_id IN (SELECT id FROM chunks WHERE {condition})""",
+                params
+            )
+        cursor.execute(f"DELETE FROM chunks WHERE {condition}", params)
+        deleted = cursor.rowcount > 0
+        if deleted:
+            self.store.vectors_changed(db)
+        return deleted
+
     async def search_chunks(self, query: str, limit: int = 5) -> list[tuple[Chunk, float]]:
         """search chunks by content and similarity"""
         if self.store._connection is None:
             raise ValueError("Store connection is not open")
         
-        query_embedding = await self.embedder.embed(query)
-        serialized_embedding = Store.serialize_embeddings(query_embedding)
-
-        cursor = self.store._connection.cursor()
-        cursor.execute("""
-            SELECT c.id, c.document_id, c.content, c.metadata, d.uri, d.metadata as document_metadata
-            FROM chunks_embeddings ce
-            JOIN chunks c ON ce.chunk_id = c.id
-            JOIN documents d ON c.document_id = d.id
-            WHERE embedding MATCH ? AND k = ?
-            """, (serialized_embedding, limit))
-        result = cursor.fetchall()
+        query_embedding = await self.query_embedding_cache.embed(self.embedder, query)
+        if self.store.vector_index is not None:
+            return (await self._search_index([query_embedding], limit))[0]
+
+        def _search(db: sqlite3.Connection) -> list[tuple]:
+            cursor = db.cursor()
+            cursor.execute(f"""
+                SELECT c.id, c.document_id, c.content, c.metadata, d.uri, d.metadata as document_metadata, ce.distance
+                FROM ({self._nearest_sql()}) ce
+                JOIN chunks c ON ce.chunk_id = c.id
+                JOIN documents d ON c.document_id = d.id
+                ORDER BY ce.distance
+                """, self._nearest_params(query_embedding, limit))
+            return cursor.fetchall()
+
+        result = await self.store.read(_search)
 
         return [ 
             (
@@ -294,30 +634,98 @@ class ChunkRepository(BaseRepository[Chunk]):
             ) 
             for chunk_id, document_id, content, metadata, document_uri, document_metadata, distance in result
         ]
+
+    def _nearest_sql(self) -> str:
+        """query of the :k_nearest chunk ids nearest to :embedding in the vec0 table, with their l2 distance.
+        Quantized stores fetch :k_candidates rows with the quantized vectors and re-score them with the full precision ones.
+        """
+        if not self.store.quantized:
+            return "SELECT chunk_id, distance FROM chunk_embeddings WHERE embedding MATCH :embedding AND k = :k_nearest"
+        return f"""
+            SELECT candidates.chunk_id, vec_distance_l2(v.embedding, :embedding) AS distance
+            FROM (
+                SELECT chunk_id FROM chunk_embeddings
+                WHERE embedding MATCH {self.store.quantize_sql(":embedding")} AND k = :k_candidates
+            ) candidates
+            JOIN chunk_vectors v ON v.chunk_id = candidates.chunk_id
+            ORDER BY distance
+            LIMIT :k_nearest
+        """
+
+    def _nearest_params(self, query_embedding: list[float], k: int) -> dict:
+        return {
+            "embedding": Store.serialize_embeddings(query_embedding, self.store.vector_dim),
+            "k_nearest": k,
+            "k_candidates": k * get_settings().vector_rescore_factor,
+        }
+
+    async def search_chunks_many(self, queries: list[str], limit: int = 5) -> list[list[tuple[Chunk, float]]]:
+        """search chunks by similarity for many queries at once, answered by a single index lookup when the store has one"""
+        if self.store._connection is None:
+            raise ValueError("Store connection is not open")
+        if self.store.vector_index is None:
+            return list(await asyncio.gather(*(self.search_chunks(query, limit) for query in queries)))
+
+        query_embeddings = await asyncio.gather(*(self.query_embedding_cache.embed(self.embedder, query) for query in queries))
+        return await self._search_index(list(query_embeddings), limit)
+
+    async def _search_index(self, query_embeddings: list[list[float]], limit: int) -> list[list[tuple[Chunk, float]]]:
+        """search the vector index of the store and load the chunks it found"""
+        index = await self.store.sync_vector_index()
+        hits = await asyncio.to_thread(index.search_many, query_embeddings, limit)
+        chunk_ids = list({chunk_id for query_hits in hits for chunk_id, _ in query_hits})
+
+        def _get_chunks(db: sqlite3.Connection) -> list[tuple]:
+            cursor = db.cursor()
+            cursor.execute("""
+                SELECT c.id, c.document_id, c.content, c.metadata, d.uri, d.metadata as document_metadata
+                FROM chunks c
+                JOIN documents d ON c.document_id = d.id
+                WHERE c.id IN (SELECT value FROM json_each(?))
+                """, (json.dumps(chunk_ids),))
+            return cursor.fetchall()
+
+        chunks = {
+            chunk_id: Chunk(
+                id=chunk_id,
+                document_id=document_id,
+                content=content,
+                metadata=json.loads(metadata) if metadata else {},
+                document_uri=document_uri,
+                document_metadata=json.loads(document_metadata) if document_metadata else {}
+            )
+            for chunk_id, document_id, content, metadata, document_uri, document_metadata in await self.store.read(_get_chunks)
+        }
+        return [
+            [(chunks[chunk_id], 1.0 / (1.0 + distance)) for chunk_id, distance in query_hits if chunk_id in chunks]
+            for query_hits in hits
+        ]
     
     async def search_chunks_fts(self, query: str, limit: int = 5) -> list[tuple[Chunk, float]]:
         """search chunks by using full text search"""
         if self.store._connection is None:
             raise ValueError("Store connection is not open")
         
-        cursor = self.store._connection.cursor()
-
         # Remove special characters and split into words
         words = re.findall(r"\b\w+\b", query.lower())
         # Join with OR to find chunks containing any of the keywords
         fts_query = " OR ".join(words) if words else query
 
-        cursor.execute(
-            """
-            SELECT c.id, c.document_id, c.content, c.metadata, d.uri, d.metadata as document_metadata
-            FROM chunks_fts
-            JOIN chunks c ON chunks_fts.rowid = c.id
-            JOIN documents d ON c.document_id = d.id
-            WHERE content MATCH ? 
-            ORDER BY rank
-            LIMIT ?
-            """, (fts_query, limit))
-        result = cursor.fetchall()
+        def _search(db: sqlite3.Connection) -> list[tuple]:
+            cursor = db.cursor()
+            cursor.execute(
+                """
+                SELECT c.id, c.document_id, c.content, c.metadata, d.uri, d.metadata as document_metadata, rank
+                FROM chunks_fts
+                JOIN chunks c ON chunks_fts.rowid = c.id
+                JOIN documents d ON c.document_id = d.id
+                WHERE chunks_fts MATCH ? 
+                ORDER BY rank
+                LIMIT ?
+                """, (fts_query, limit))
+            return cursor.fetchall()
+
+        result = await self.store.read(_search)
 
         return [
             (
@@ -339,72 +747,89 @@ class ChunkRepository(BaseRepository[Chunk]):
         if self.store._connection is None:
             raise ValueError("Store connection is not open")
         
-        cursor = self.store._connection.cursor()
-        
-        query_embedding = await self.embedder.embed(query)
-        serialized_embedding = Store.serialize_embeddings(query_embedding)
+        query_embedding = await self.query_embedding_cache.embed(self.embedder, query)
 
         words = re.findall(r"\b\w+\b", query.lower())
         fts_query = " OR ".join(words) if words else query
 
-        cursor.execute(
+        if self.store.vector_index is None:
+            vector_search = f"""
+                    SELECT
+                        c.id,
+                        c.document_id,
+                        c.content,
+                        c.metadata,
+                        ROW_NUMBER() OVER (ORDER BY ce.distance) as vector_rank
+                    FROM ({self._nearest_sql()}) ce
+                    JOIN chunks c ON c.id = ce.chunk_id
+                    ORDER BY ce.distance
             """
-            WITH vector_search AS (
-                SELECT
-                    c.id,
-                    c.document_id,
-                    c.content,
-                    c.metadata,
-                    ROW_NUMBER() OVER (ORDER BY ce.distance) as vector_rank
-                FROM chunk_embeddings ce
-                JOIN chunks c ON c.id = ce.chunk_id
-                WHERE ce.embedding MATCH :embedding AND k = :k_vector
-                ORDER BY ce.distance
-            ),
-            fts_search AS (
-                SELECT
-                    c.id,
-                    c.document_id,
-                    c.content,
-                    c.metadata,
-                    ROW_NUMBER() OVER (ORDER BY chunks_fts.rank) as fts_rank
-                FROM chunks_fts
-                JOIN chunks c ON c.id = chunks_fts.rowid
-                WHERE chunks_fts MATCH :fts_query
-                ORDER BY chunks_fts.rank
-            ),   
-            all_chunks AS (
-                SELECT id, document_id, content, metadata FROM vector_search
-                UNION
-                SELECT id, document_id, content, metadata FROM fts_search
-            ),
-            rrf_scores AS (
-                SELECT
-                    a.id,
-                    a.document_id,
-                    a.content,
-                    a.metadata,
-                    COALESCE(1.0 / (:k + v.vector_rank), 0) + COALESCE(1.0 / (:k + f.fts_rank), 0) as rrf_score
-                FROM all_chunks a
-                LEFT JOIN vector_search v ON a.id = v.id
-                LEFT JOIN fts_search f ON a.id = f.id
+            vector_params = self._nearest_params(query_embedding, limit * 3)
+        else:
+            # the index already ranked the neighbours, json_each keeps their order in its key
+            vector_search = """
+                    SELECT
+                        c.id,
+                        c.document_id,
+                        c.content,
+                        c.metadata,
+                        v.key + 1 as vector_rank
+                    FROM json_each(:vector_ids) v
+                    JOIN chunks c ON c.id = v.value
+            """
+            index = await self.store.sync_vector_index()
+            hits = await asyncio.to_thread(index.search, query_embedding, limit * 3)
+            vector_params = {"vector_ids": json.dumps([chunk_id for chunk_id, _ in hits])}
+
+        def _search(db: sqlite3.Connection) -> list[tuple]:
+            cursor = db.cursor()
+            cursor.execute(
+                f"""
+                WITH vector_search AS ({vector_search}),
+                fts_search AS (
+                    SELECT
+                        c.id,
+                        c.document_id,
+                        c.content,
+                        c.metadata,
+                        ROW_NUMBER() OVER (ORDER BY chunks_fts.rank) as fts_rank
+                    FROM chunks_fts
+                    JOIN chunks c ON c.id = chunks_fts.rowid
+                    WHERE chunks_fts MATCH :fts_query
+                    ORDER BY chunks_fts.rank
+                ),   
+                all_chunks AS (
+                    SELECT id, document_id, content, metadata FROM vector_search
+                    UNION
+                    SELECT id, document_id, content, metadata FROM fts_search
+                ),
+                rrf_scores AS (
+                    SELECT
+                        a.id,
+                        a.document_id,
+                        a.content,
+                        a.metadata,
+                        COALESCE(1.0 / (:k + v.vector_rank), 0) + COALESCE(1.0 / (:k + f.fts_rank), 0) as rrf_score
+                    FROM all_chunks a
+                    LEFT JOIN vector_search v ON a.id = v.id
+                    LEFT JOIN fts_search f ON a.id = f.id
+                )
+                SELECT r.id, r.document_id, r.content, r.metadata, r.rrf_score, d.uri, d.metadata as document_metadata
+                FROM rrf_scores r
+                JOIN documents d ON r.document_id = d.id
+                ORDER BY r.rrf_score DESC
+                LIMIT :limit
+                """,
+                {
+                    **vector_params,
+                    "fts_query": fts_query,
+                    "k": k,
+                    "limit": limit
+                }
             )
-            SELECT r.id, r.document_id, r.content, r.metadata, r.rrf_score, d.uri, d.metadata as document_metadata
-            FROM rrf_scores r
-            JOIN documents d ON r.document_id = d.id
-            ORDER BY r.rrf_score DESC
-            LIMIT :limit
-            """,
-            {
-                "embedding": serialized_embedding,
-                "k_vector": limit * 3,
-                "fts_query": fts_query,
-                "k": k,
-                "limit": limit
-            }
-        )
+            return cursor.fetchall()
 
-        result = cursor.fetchall()
+        result = await self.store.read(_search)
 
         return [
             (
@@ -1,150 +1,216 @@
+import sqlite3
+
+from ..model.chunk import Chunk
 from ..model.document import Document
 from .base import BaseRepository
 import json
 
 
 class DocumentRepository(BaseRepository[Document]):
-    
-    
+
+
     def __init__(self, store, chunk_repository=None):
         super().__init__(store)
         if chunk_repository is None:
             from ..repository.chunk import ChunkRepository
             chunk_repository = ChunkRepository(store)
         self.chunk_repository = chunk_repository
-    
-    async def create(self, item: Document) -> Document:
-        """create a new document and its chunks and embeddings"""
+
+    async def create(self, item: Document, chunk_texts: list[str] | None = None,
+                     embeddings: list[list[float]] | None = None) -> Document:
+        """create a new document and its chunks and embeddings, the embeddings of chunk_texts can be given"""
         if self.store._connection is None:
             raise ValueError("Store connection is not open")
-        
-        cursor = self.store._connection.cursor()
-        cursor.execute("BEGIN TRANSACTION")
-
-        try:
-            cursor.execute("""
-                        INSERT INTO documents (content, uri, metadata, created_at, updated_at) 
-                        VALUES (?, ?, ?, ?, ?)
-                        """, 
-                        (item.content, 
-                            item.uri, 
-                            json.dumps(item.metadata), 
-                            item.created_at, 
-                            item.updated_at)
-            )
-            document_id = cursor.lastrowid
 
-            assert document_id is not None, "Failed to create document in the database"
-            item.id = document_id
+        # chunk and embed before opening the transaction, so it is written in a single writer call
+        chunk_texts, embeddings = await self.chunk_repository.prepare_chunks(item.content, chunk_texts, embeddings)
 
-            await self.chunk_repository.create_chunks_from_document(document_id, item.content, commit=False)
-            cursor.execute("COMMIT")
-            return item
-        except Exception as e:
-            cursor.execute("ROLLBACK")
-            raise e
+        def _create(db: sqlite3.Connection) -> Document:
+            cursor = db.cursor()
+            cursor.execute("BEGIN TRANSACTION")
+
+            try:
+                cursor.execute("""
+                            INSERT INTO documents (content, uri, metadata, created_at, updated_at)
+                            VALUES (?, ?, ?, ?, ?)
+                            """,
+                            (item.content,
+                                item.uri,
+                                json.dumps(item.metadata),
+                                item.created_at,
+                                item.updated_at)
+                )
+                document_id = cursor.lastrowid
+
+                assert document_id is not None, "Failed to create document in the database"
+                item.id = document_id
+
+                chunks = [
+                    Chunk(document_id=document_id, content=chunk_text, metadata={"order": order})
+                    for order, chunk_text in enumerate(chunk_texts)
+                ]
+                self.chunk_repository._insert_many(db, chunks, embeddings)
+                cursor.execute("COMMIT")
+                return item
+            except Exception as e:
+                cursor.execute("ROLLBACK")
+                raise e
+
+        return await self.store.write(_create)
 
     async def get_by_id(self, id: int) -> Document | None:
         """get a document by its id"""
         if self.store._connection is None:
             raise ValueError("Store connection is not open")
-        
-        cursor = self.store._connection.cursor()
-        cursor.execute("SELECT id, content, uri, metadata, created_at, updated_at FROM documents WHERE id = ?", (id,))
-        result = cursor.fetchone()
-        if result is None:
-            return None
-        document_id, content, uri, metadata, created_at, updated_at = result
-        metadata = json.loads(metadata) if metadata else {}
-        return Document(
-            id=document_id,
-            content=content,
-            uri=uri,
-            metadata=metadata,
-            created_at=created_at,
-            updated_at=updated_at
-        )
-    
+
+        def _get_by_id(db: sqlite3.Connection) -> Document | None:
+            cursor = db.cursor()
+            cursor.execute("SELECT id, content, uri, metadata, created_at, updated_at FROM documents WHERE id = ?", (id,))
+            result = cursor.fetchone()
+            if result is None:
+                return None
+            document_id, content, uri, metadata, created_at, updated_at = result
+            metadata = json.loads(metadata) if metadata else {}
+            return Document(
+                id=document_id,
+                content=content,
+                uri=uri,
+                metadata=metadata,
+                created_at=created_at,
+                updated_at=updated_at
+            )
+
+        return await self.store.read(_get_by_id)
+
     async def get_by_uri(self, uri: str) -> Document | None:
         """get a document by its uri"""
         if self.store._connection is None:
             raise ValueError("Store connection is not open")
-        
-        cursor = self.store._connection.cursor()
-        cursor.execute("SELECT id, content, uri, metadata, created_at, updated_at FROM documents WHERE uri = ?", (uri,))
-        result = cursor.fetchone()
-        if result is None:
-            return None
-        document_id, content, uri, metadata, created_at, updated_at = result
-        metadata = json.loads(metadata) if metadata else {}
-        return Document(
-            id=document_id,
-            content=content,
-            uri=uri,
-            metadata=metadata,
-            created_at=created_at,
-            updated_at=updated_at
-        )
-    
-    async def update(self, item: Document) -> Document:
-        """update a document and its chunks and embeddings"""
+
+        def _get_by_uri(db: sqlite3.Connection) -> Document | None:
+            cursor = db.cursor()
+            cursor.execute("SELECT id, content, uri, metadata, created_at, updated_at FROM documents WHERE uri = ?", (uri,))
+            result = cursor.fetchone()
+            if result is None:
+                return None
+            document_id, content, document_uri, metadata, created_at, updated_at = result
+            metadata = json.loads(metadata) if metadata else {}
+            return Document(
+                id=document_id,
+                content=content,
+                uri=document_uri,
+                metadata=metadata,
+                created_at=created_at,
+                updated_at=updated_at
+            )
+
+        return await self.store.read(_get_by_uri)
+
+    async def update(self, item: Document, incremental: bool = True, chunk_texts: list[str] | None = None,
+                     embeddings: list[list[float]] | None = None) -> Document:
+        """update a document and its chunks and embeddings, the embeddings of chunk_texts can be given.
+        In incremental mode only the chunks whose content changed are rewritten, otherwise every chunk is recreated.
+        """
         if self.store._connection is None:
             raise ValueError("Store connection is not open")
         if item.id is None:
             raise ValueError("Document id is required to update a document")
-        
-        cursor = self.store._connection.cursor()
-        cursor.execute("BEGIN TRANSACTION")
-
-        try:
-            cursor.execute("""
-                        UPDATE documents SET content = ?, uri = ?, metadata = ?, updated_at = ?
-                        WHERE id = ?
-                        """, (item.content, item.uri, json.dumps(item.metadata), item.updated_at, item.id))
-            
-            await self.chunk_repository.delete_by_document_id(item.id, commit=False)
-            await self.chunk_repository.create_chunks_from_document(item.id, item.content, commit=False)
-
-            cursor.execute("COMMIT")
+
+        # chunk and embed before opening the transaction, so it is written in a single writer call
+        if incremental:
+            sync = await self.chunk_repository.plan_sync(item.id, item.content, chunk_texts, embeddings)
+        else:
+            chunk_texts, embeddings = await self.chunk_repository.prepare_chunks(item.content, chunk_texts, embeddings)
+
+        def _update(db: sqlite3.Connection) -> Document:
+            cursor = db.cursor()
+            cursor.execute("BEGIN TRANSACTION")
+
+            try:
+                cursor.execute("""
+                            UPDATE documents SET content = ?, uri = ?, metadata = ?, updated_at = ?
+                            WHERE id = ?
+                            """, (item.content, item.uri, json.dumps(item.metadata), item.updated_at, item.id))
+
+                if incremental:
+                    self.chunk_repository._apply_sync(db, sync)
+                else:
+                    self.chunk_repository._delete_where(db, "document_id = ?", (item.id,))
+                    chunks = [
+                        Chunk(document_id=item.id, content=chunk_text, metadata={"order": order})
+                        for order, chunk_text in enumerate(chunk_texts)
+                    ]
+                    self.chunk_repository._insert_many(db, chunks, embeddings)
+
+                cursor.execute("COMMIT")
+                return item
+            except Exception as e:
+                cursor.execute("ROLLBACK")
+                raise e
+
+        return await self.store.write(_update)
+
+    async def update_row(self, item: Document) -> Document:
+        """update the document row alone, its chunks are left as they are"""
+        if self.store._connection is None:
+            raise ValueError("Store connection is not open")
+        if item.id is None:
+            raise ValueError("Document id is required to update a document")
+
+        def _update_row(db: sqlite3.Connection) -> Document:
+            db.execute("""
+                    UPDATE documents SET content = ?, uri = ?, metadata = ?, updated_at = ?
+                    WHERE id = ?
+                    """, (item.content, item.uri, json.dumps(item.metadata), item.updated_at, item.id))
+            db.commit()
             return item
-        except Exception as e:
-            cursor.execute("ROLLBACK")
-            raise e
-        
+
+        return await self.store.write(_update_row)
+
     async def delete(self, id: int) -> bool:
         """delete a document and its chunks and embeddings"""
         if self.store._connection is None:
             raise ValueError("Store connection is not open")
-        cursor = self.store._connection.cursor()
-        cursor.execute("DELETE FROM documents WHERE id = ?", (id,))
-        deleted = cursor.rowcount > 0
-        self.store._connection.commit()
-        return deleted
-    
+
+        def _delete(db: sqlite3.Connection) -> bool:
+            cursor = db.cursor()
+            # remove the chunks explicitly, the foreign key cascade would leave their embeddings and fts rows behind
+            self.chunk_repository._delete_where(db, "document_id = ?", (id,))
+            cursor.execute("DELETE FROM documents WHERE id = ?", (id,))
+            deleted = cursor.rowcount > 0
+            db.commit()
+            return deleted
+
+        return await self.store.write(_delete)
+
     async def list_all(self, limit: int | None = None, offset: int | None = None) -> list[Document]:
         """list all documents"""
         if self.store._connection is None:
             raise ValueError("Store connection is not open")
-        cursor = self.store._connection.cursor()
-        query = "SELECT id, content, uri, metadata, created_at, updated_at FROM documents ORDER BY created_at DESC"
-        params = {}
-        if limit is not None:
-            query += " LIMIT ?"
-            params["limit"] = limit
-        if offset is not None:
-            query += " OFFSET ?"
-            params["offset"] = offset
-        cursor.execute(query, params)
-        result = cursor.fetchall()
-        return [
-            Document(
-                    id=document_id,
-                    content=content,
-                    uri=uri,
-                    metadata=json.loads(metadata) if metadata else {},
-                    created_at=created_at,
-                    updated_at=updated_at
-                )
-                for document_id, content, uri, metadata, created_at, updated_at in result
-        ]
-        
\ No newline at end of file
+
+        def _list_all(db: sqlite3.Connection) -> list[Document]:
+            cursor = db.cursor()
+            query = "SELECT id, content, uri, metadata, created_at, updated_at FROM documents ORDER BY created_at DESC"
+            # sqlite only accepts OFFSET after a LIMIT, -1 meaning no limit
+            params = []
+            if limit is not None or offset is not None:
+                query += " LIMIT ?"
+                params.append(limit if limit is not None else -1)
+            if offset is not None:
+                query += " OFFSET ?"
+                params.append(offset)
+            cursor.execute(query, params)
+            result = cursor.fetchall()
+            return [
+                Document(
+                        id=document_id,
+                        content=content,
+                        uri=uri,
+                        metadata=json.loads(metadata) if metadata else {},
+                        created_at=created_at,
+                        updated_at=updated_at
+                    )
+                    for document_id, content, uri, metadata, created_at, updated_at in result
+            ]
+
+        return await self.store.read(_list_all)
@@ -0,0 +1,172 @@
+import hashlib
+import sqlite3
+import time
+
+from ..embedding.base import BaseEmbedder
+from ..repository.store import Store
+
+
+class EmbeddingCache:
+    """
+    Persistent cache of embeddings stored beside the chunk embeddings.
+    Entries are keyed by a hash of (model name, vector dimension, text) and the least
+    recently used ones are evicted once the cache grows over max_entries.
+    Other users of the table hash their keys in their own namespace, so their entries never answer a chunk lookup.
+    """
+    def __init__(self, store: Store, max_entries: int = 100_000):
+        self.store = store
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(model_name: str, vector_dim: int, text: str, namespace: str = "") -> str:
+        """hash the model name, the dimension and the text into a cache key, chunks use the empty namespace"""
+        return hashlib.sha256(f"{namespace}{model_name}\0{vector_dim}\0{text}".encode("utf-8")).hexdigest()
+
+    async def embed_batch(self, embedder: BaseEmbedder, texts: list[str]) -> list[list[float]]:
+        """embed the texts, only calling the embedder for the ones missing from the cache"""
+        embeddings, computed = await self.fetch(embedder, texts)
+        await self.record(embedder, texts, computed)
+        return embeddings
+
+    async def fetch(self, embedder: BaseEmbedder, texts: list[str]) -> tuple[list[list[float]], dict[str, list[float]]]:
+        """embed the texts without writing to the cache, nor counting the lookups.
+        Return the embeddings and the newly computed entries, to be stored later with record.
+        """
+        keys = [self.make_key(embedder.get_model_name(), embedder.get_vector_dim(), text) for text in texts]
+        found = await self.lookup(keys)
+        embeddings = [Store.deserialize_embeddings(found[key]) if key in found else None for key in keys]
+
+        missing = {}
+        for key, text, embedding in zip(keys, texts, embeddings):
+            if embedding is None:
+                missing.setdefault(key, text)
+        if not missing:
+            return embeddings, {}
+
+        computed = dict(zip(missing.keys(), await embedder.embed_batch(list(missing.values()))))
+        return [computed[key] if embedding is None else embedding for key, embedding in zip(keys, embeddings)], computed
+
+    async def get_many(self, keys: list[str]) -> list[list[float] | None]:
+        """get the cached embeddings of the keys, None for the ones not in the cache"""
+        if not keys:
+            return []
+
+        found = await self.lookup(keys)
+        if found:
+            now = time.time()
+            await self.store.write(
+                self._write,
+                "UPDATE embedding_cache SET last_used_at = ? WHERE key = ?",
+                [(now, key) for key in found]
+            )
+
+        self.hits += sum(1 for key in keys if key in found)
+        self.misses += sum(1 for key in keys if key not in found)
+        return [Store.deserialize_embeddings(found[key]) if key in found else None for key in keys]
+
+    async def lookup(self, keys: list[str]) -> dict[str, bytes]:
+        """read the serialized embeddings of the keys found in the cache, without touching them or the counters"""
+        if self.store._connection is None:
+            raise ValueError("Store connection is not open")
+
+        unique_keys = list(dict.fromkeys(keys))
+
+        def _lookup(db: sqlite3.Connection) -> dict[str, bytes]:
+            cursor = db.cursor()
+            found = {}
+            # stay under the sqlite limit of bound parameters
+            for start in range(0, len(unique_keys), 500):
+                batch = unique_keys[start:start + 500]
+                cursor.execute(
+                    f"SELECT key, embedding FROM embedding_cache WHERE key IN ({', '.join('?' * len(batch))})",
+                    batch
+                )
+                found.update(cursor.fetchall())
+            return found
+
+        return await self.store.read(_lookup)
+
+    async def record(self, embedder: BaseEmbedder, texts: list[str], computed: dict[str, list[float]]) -> None:
+        """store the entries computed by fetch for the texts and mark the cached ones as used in a single write,
+        then count the hits and misses of the fetch and evict the oldest entries over the size limit
+        """
+        if self.store._connection is None:
+            raise ValueError("Store connection is not open")
+
+        keys = [self.make_key(embedder.get_model_name(), embedder.get_vector_dim(), text) for text in texts]
+        used = [key for key in dict.fromkeys(keys) if key not in computed]
+        now = time.time()
+
+        def _record(db: sqlite3.Connection) -> None:
+            self._write(db, "UPDATE embedding_cache SET last_used_at = ? WHERE key = ?", [(now, key) for key in used])
+            self._write(
+                db,
+                "INSERT OR REPLACE INTO embedding_cache (key, embedding, last_used_at) VALUES (?, ?, ?)",
+                [(key, Store.serialize_embeddings(embedding), now) for key, embedding in computed.items()]
+            )
+
+        if used or computed:
+            await self.store.write(_record)
+        self.hits += sum(1 for key in keys if key not in computed)
+        self.misses += sum(1 for key in keys if key in computed)
+        if computed:
+            await self.evict()
+
+    async def put_many(self, embeddings: dict[str, list[float]]) -> None:
+        """add the embeddings to the cache and evict the oldest entries over the size limit"""
+        if self.store._connection is None:
+            raise ValueError("Store connection is not open")
+        if not embeddings:
+            return
+
+        now = time.time()
+        await self.store.write(
+            self._write,
+            "INSERT OR REPLACE INTO embedding_cache (key, embedding, last_used_at) VALUES (?, ?, ?)",
+            [(key, Store.serialize_embeddings(embedding), now) for key, embedding in embeddings.items()]
+        )
+        await self.evict()
+
+    async def evict(self) -> int:
+        """evict the least recently used entries over max_entries, return the number of evicted entries"""
+        if self.store._connection is None:
+            raise ValueError("Store connection is not open")
+
+        def _evict(db: sqlite3.Connection) -> int:
+            cursor = db.cursor()
+            cursor.execute("SELECT COUNT(*) FROM embedding_cache")
+            overflow = cursor.fetchone()[0] - self.max_entries
+            if overflow <= 0:
+                return 0
+
+            self._write(
+                db,
+                """
+                DELETE FROM embedding_cache WHERE key IN (
+                    SELECT key FROM embedding_cache ORDER BY last_used_at LIMIT ?
+                )""",
+                [(overflow,)]
+            )
+            return overflow
+
+        return await self.store.write(_evict)
+
+    def stats(self) -> dict:
+        """hit and miss counters of the cache"""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    @staticmethod
+    def _write(db: sqlite3.Connection, query: str, params: list[tuple]) -> None:
+        # commit on our own only when no caller transaction is open, otherwise
+        # the cache writes become part of the caller's transaction
+        in_transaction = db.in_transaction
+        db.executemany(query, params)
+        if not in_transaction:
+            db.commit()
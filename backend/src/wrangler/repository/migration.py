@@ -0,0 +1,120 @@
+"""Re-index a store to a new embedding dimension.
+
+The application must not use the store during the migration. Afterwards, start it with EMBEDDING_DIMENSIONS
+set to the new dimension.
+
+Usage:
+    uv run python -m wrangler.repository.migration src/store/rag.sqlite --dimensions 512
+    uv run python -m wrangler.repository.migration src/store/rag.sqlite --dimensions 512 --truncate
+"""
+import argparse
+import asyncio
+import logging
+import sqlite3
+from pathlib import Path
+
+import numpy as np
+import sqlite_vec
+
+from ..embedding.base import BaseEmbedder
+from ..embedding.openai import OpenAIEmbedder
+from ..repository.profile import ConnectionProfile
+from ..repository.store import Store
+
+
+async def migrate_vector_dim(db_path: Path, vector_dim: int, embedder: BaseEmbedder | None = None,
+                             batch_size: int = 512) -> int:
+    """
+    Rebuild the vectors of every chunk with vector_dim dimensions and return the number of chunks migrated.
+    The chunks are embedded again with the embedder, or without one their stored vectors are shortened and
+    normalized again, which is how text-embedding-3 models reduce their dimension.
+    The new vectors are written to a side table first and swapped in with a single transaction.
+    """
+    if embedder is not None and embedder.get_vector_dim() != vector_dim:
+        raise ValueError(f"The embedder produces {embedder.get_vector_dim()}-dimensional vectors, not {vector_dim}")
+
+    db = ConnectionProfile.from_env().connect(db_path)
+    db.enable_load_extension(True)
+    sqlite_vec.load(db)
+    db.enable_load_extension(False)
+    try:
+        try:
+            storage = Store.get_metadata(db, "vector_storage")
+            current_dim = int(Store.get_metadata(db, "embedding_dim") or 0)
+        except sqlite3.OperationalError:
+            storage, current_dim = None, 0
+        if storage is None or not current_dim:
+            raise ValueError(f"{db_path} has no store metadata, open it once with the application before migrating it")
+        if embedder is None and vector_dim > current_dim:
+            raise ValueError(f"{current_dim}-dimensional vectors cannot be truncated to {vector_dim} dimensions")
+
+        db.execute("DROP TABLE IF EXISTS chunk_vectors_migration")
+        db.execute("CREATE TABLE chunk_vectors_migration (chunk_id INTEGER PRIMARY KEY, embedding BLOB NOT NULL)")
+        if embedder is not None:
+            cursor = db.execute("SELECT id, content FROM chunks ORDER BY id")
+            while rows := cursor.fetchmany(batch_size):
+                embeddings = await embedder.embed_batch([content for _, content in rows])
+                db.executemany(
+                    "INSERT INTO chunk_vectors_migration (chunk_id, embedding) VALUES (?, ?)",
+                    [(chunk_id, Store.serialize_embeddings(embedding, vector_dim)) for (chunk_id, _), embedding in zip(rows, embeddings)],
+                )
+        else:
+            source = "chunk_embeddings" if storage == "float32" else "chunk_vectors"
+            cursor = db.execute(f"SELECT chunk_id, embedding FROM {source} ORDER BY chunk_id")
+            while rows := cursor.fetchmany(batch_size):
+                vectors = np.frombuffer(b"".join(embedding for _, embedding in rows), dtype=np.float32)
+                vectors = vectors.reshape(len(rows), current_dim)[:, :vector_dim]
+                vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+                db.executemany(
+                    "INSERT INTO chunk_vectors_migration (chunk_id, embedding) VALUES (?, ?)",
+                    [(chunk_id, vector.tobytes()) for (chunk_id, _), vector in zip(rows, vectors)],
+                )
+        db.commit()
+
+        # swap the vectors in at once, a failure leaves the store as it was
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.execute("DROP TABLE chunk_embeddings")
+            Store.create_vector_table(db, storage, vector_dim)
+            db.execute(f"""
+                INSERT INTO chunk_embeddings (chunk_id, embedding)
+                SELECT chunk_id, {Store.quantizers[storage].format("embedding")} FROM chunk_vectors_migration
+            """)
+            if storage != "float32":
+                db.execute("DELETE FROM chunk_vectors")
+                db.execute("INSERT INTO chunk_vectors (chunk_id, embedding) SELECT chunk_id, embedding FROM chunk_vectors_migration")
+            Store.set_metadata(db, "embedding_dim", str(vector_dim))
+            # the vector indexes of the processes still open reload the migrated vectors
+            Store.bump_vector_version(db)
+            db.execute("DROP TABLE chunk_vectors_migration")
+            db.commit()
+        except BaseException:
+            db.rollback()
+            raise
+
+        count = db.execute("SELECT COUNT(*) FROM chunk_embeddings").fetchone()[0]
+        # give the space of the larger vectors back to the file system
+        db.execute("VACUUM")
+    finally:
+        db.close()
+    logging.info(f"Migrated {count} chunks of {db_path} from {current_dim} to {vector_dim} dimensions")
+    return count
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("db_path", type=Path)
+    parser.add_argument("--dimensions", type=int, required=True)
+    parser.add_argument("--model", default=OpenAIEmbedder._model)
+    parser.add_argument("--truncate", action="store_true",
+                        help="shorten the stored vectors instead of embedding the chunks again, text-embedding-3 models only")
+    parser.add_argument("--batch-size", type=int, default=512)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    embedder = None if args.truncate else OpenAIEmbedder(args.model, args.dimensions)
+    asyncio.run(migrate_vector_dim(args.db_path, args.dimensions, embedder, args.batch_size))
+
+
+if __name__ == "__main__":
+    main()
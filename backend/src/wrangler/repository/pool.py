@@ -0,0 +1,178 @@
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, ClassVar, TypeVar
+
+T = TypeVar("T")
+
+
+class PooledConnection:
+    """
+    A sqlite connection pinned to its own thread: it is opened, used and closed only on that thread.
+    """
+    def __init__(self, name: str, connect: Callable[[], sqlite3.Connection],
+                 disconnect: Callable[[sqlite3.Connection], None], health_check_interval: float):
+        self.name = name
+        self._connect = connect
+        self._disconnect = disconnect
+        self._health_check_interval = health_check_interval
+        self._thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+        self._thread_id: int | None = None
+        self._connection: sqlite3.Connection | None = None
+        self._last_used = 0.0
+        self.pending = 0
+
+    def open(self) -> sqlite3.Connection:
+        """open the connection on its thread and return it"""
+        return self._thread.submit(self._checkout).result()
+
+    async def run(self, fn: Callable[..., T], args: tuple) -> T:
+        """run fn(connection, *args) on the thread of the connection"""
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._thread, self._run, fn, args)
+        finally:
+            self.pending -= 1
+
+    def call(self, fn: Callable[..., T], args: tuple) -> T:
+        """run fn(connection, *args) on the thread of the connection and wait for the result"""
+        return self._thread.submit(self._run, fn, args).result()
+
+    def close(self) -> None:
+        """wait for the pending calls and close the connection on its thread"""
+        self._thread.submit(self._close).result()
+        self._thread.shutdown(wait=True)
+
+    def _run(self, fn: Callable[..., T], args: tuple) -> T:
+        return fn(self._checkout(), *args)
+
+    def _checkout(self) -> sqlite3.Connection:
+        if self._thread_id is None:
+            self._thread_id = threading.get_ident()
+        elif self._thread_id != threading.get_ident():
+            raise RuntimeError(f"Connection {self.name} used outside of its thread")
+
+        now = time.monotonic()
+        if self._connection is not None and now - self._last_used > self._health_check_interval:
+            try:
+                self._connection.execute("SELECT 1").fetchone()
+            except sqlite3.Error:
+                logging.warning(f"Connection {self.name} failed its health check, reconnecting")
+                self._close()
+        if self._connection is None:
+            self._connection = self._connect()
+        self._last_used = now
+        return self._connection
+
+    def _close(self) -> None:
+        if self._connection is not None:
+            try:
+                self._disconnect(self._connection)
+            except sqlite3.Error:
+                pass
+            self._connection = None
+
+
+class ConnectionPool:
+    """
+    Pool of N read-only connections and a single writer connection to a sqlite database.
+    Reads go to the least busy reader, writes are serialized on the writer, none of them block the event loop.
+    Pools are shared by every Store (or Analytic) of the process opening the same database, see acquire.
+    """
+    _pools: ClassVar[dict[str, "ConnectionPool"]] = {}
+    _pools_lock: ClassVar[threading.Lock] = threading.Lock()
+
+    def __init__(self, name: str, connect_writer: Callable[[], sqlite3.Connection],
+                 connect_reader: Callable[[], sqlite3.Connection], disconnect: Callable[[sqlite3.Connection], None],
+                 readers: int = 4, health_check_interval: float = 30.0, profile: Any = None):
+        self.name = name
+        self.profile = profile
+        self._writer = PooledConnection(f"{name}-writer", connect_writer, disconnect, health_check_interval)
+        # the writer is opened first, it creates the schema the readers rely on
+        self.writer_connection = self._writer.open()
+        self._readers = [
+            PooledConnection(f"{name}-reader-{index}", connect_reader, disconnect, health_check_interval)
+            for index in range(readers)
+        ]
+        self._shared: dict[str, Any] = {}
+        self._shared_lock = threading.Lock()
+        self._references = 0
+        self._closed = False
+
+    @classmethod
+    def acquire(cls, db_path: Path, connect_writer: Callable[[], sqlite3.Connection],
+                connect_reader: Callable[[], sqlite3.Connection], disconnect: Callable[[sqlite3.Connection], None],
+                readers: int = 4, health_check_interval: float = 30.0, profile: Any = None) -> "ConnectionPool":
+        """get the pool of the database shared by the process, creating it on first use.
+        The connections of the pool are opened with the profile of its first user, the others must use the same one.
+        """
+        key = str(Path(db_path).resolve())
+        with cls._pools_lock:
+            pool = cls._pools.get(key)
+            if pool is None or pool._closed:
+                pool = cls(
+                    Path(db_path).name, connect_writer, connect_reader, disconnect, readers, health_check_interval, profile
+                )
+                cls._pools[key] = pool
+            elif pool.profile != profile:
+                raise ValueError(
+                    f"{db_path} is already open with the connection profile {pool.profile}, not {profile}"
+                )
+            pool._references += 1
+            return pool
+
+    def release(self) -> None:
+        """release a reference to the pool, the last one closes it"""
+        with self._pools_lock:
+            self._references -= 1
+            if self._references > 0 or self._closed:
+                return
+            for key, pool in list(self._pools.items()):
+                if pool is self:
+                    del self._pools[key]
+        self.close()
+
+    def shared(self, name: str, factory: Callable[[], T]) -> T:
+        """get an object shared by the users of the pool, created by factory on first use"""
+        with self._shared_lock:
+            if name not in self._shared:
+                self._shared[name] = factory()
+            return self._shared[name]
+
+    async def read(self, fn: Callable[..., T], *args) -> T:
+        """run fn(connection, *args) on the least busy reader"""
+        if self._closed:
+            raise ValueError("Store connection is not open")
+        reader = min(self._readers, key=lambda reader: reader.pending)
+        return await reader.run(fn, args)
+
+    async def write(self, fn: Callable[..., T], *args) -> T:
+        """run fn(connection, *args) on the writer"""
+        if self._closed:
+            raise ValueError("Store connection is not open")
+        return await self._writer.run(fn, args)
+
+    def read_blocking(self, fn: Callable[..., T], *args) -> T:
+        """run fn(connection, *args) on a reader and wait for the result, for callers without an event loop"""
+        if self._closed:
+            raise ValueError("Store connection is not open")
+        return min(self._readers, key=lambda reader: reader.pending).call(fn, args)
+
+    def write_blocking(self, fn: Callable[..., T], *args) -> T:
+        """run fn(connection, *args) on the writer and wait for the result, for callers without an event loop"""
+        if self._closed:
+            raise ValueError("Store connection is not open")
+        return self._writer.call(fn, args)
+
+    def close(self) -> None:
+        """wait for the pending calls, close the shared objects having a close method and every connection"""
+        self._closed = True
+        for shared in self._shared.values():
+            if callable(getattr(shared, "close", None)):
+                shared.close()
+        for connection in [*self._readers, self._writer]:
+            connection.close()
@@ -0,0 +1,113 @@
+import os
+import sqlite3
+from pathlib import Path
+from typing import Any, Literal
+
+from pydantic import BaseModel, Field
+
+
+class ConnectionProfile(BaseModel):
+    """
+    Performance profile applied to every sqlite connection of a Store or an Analytic database.
+    Each field can be overridden with a SQLITE_<FIELD> environment variable.
+    """
+
+    journal_mode: Literal["delete", "truncate", "persist", "memory", "wal", "off"] = Field(
+        default="wal",
+        metadata={"description": "Journal mode, wal lets readers run while a write is in progress."},
+    )
+
+    synchronous: Literal["off", "normal", "full", "extra"] = Field(
+        default="normal",
+        metadata={"description": "fsync policy, normal is durable across application crashes in wal mode."},
+    )
+
+    mmap_size: int = Field(
+        default=256 * 1024 * 1024,
+        metadata={"description": "Bytes of the database file memory-mapped by each connection."},
+    )
+
+    cache_size: int = Field(
+        default=-64 * 1024,
+        metadata={"description": "Page cache size, in pages when positive and in KiB when negative."},
+    )
+
+    temp_store: Literal["default", "file", "memory"] = Field(
+        default="memory",
+        metadata={"description": "Where temporary tables and indices (sorts, group by) are kept."},
+    )
+
+    foreign_keys: bool = Field(
+        default=True,
+        metadata={"description": "Enforce foreign key constraints."},
+    )
+
+    busy_timeout: float = Field(
+        default=5.0,
+        metadata={"description": "Seconds to wait for a lock held by another connection."},
+    )
+
+    cached_statements: int = Field(
+        default=256,
+        metadata={"description": "Number of prepared statements cached per connection."},
+    )
+
+    optimize_on_close: bool = Field(
+        default=True,
+        metadata={"description": "Run PRAGMA optimize before closing a connection."},
+    )
+
+    @classmethod
+    def from_env(cls) -> "ConnectionProfile":
+        """Create a ConnectionProfile from the environment."""
+        raw_values: dict[str, Any] = {
+            name: os.environ.get(f"SQLITE_{name.upper()}") for name in cls.model_fields.keys()
+        }
+
+        # Filter out None values
+        values = {k: v for k, v in raw_values.items() if v is not None}
+
+        return cls(**values)
+
+    @classmethod
+    def sqlite_defaults(cls) -> "ConnectionProfile":
+        """Profile leaving sqlite with its default settings, used as a baseline"""
+        return cls(
+            journal_mode="delete",
+            synchronous="full",
+            mmap_size=0,
+            cache_size=-2000,
+            temp_store="default",
+            foreign_keys=False,
+            cached_statements=128,
+            optimize_on_close=False,
+        )
+
+    def connect(self, db_path: Path | str, read_only: bool = False, **kwargs) -> sqlite3.Connection:
+        """open a connection to the database and apply the profile"""
+        if read_only:
+            db_path = f"{Path(db_path).resolve().as_uri()}?mode=ro"
+            kwargs["uri"] = True
+        db = sqlite3.connect(db_path, timeout=self.busy_timeout, cached_statements=self.cached_statements, **kwargs)
+        self.apply(db, read_only)
+        return db
+
+    def apply(self, db: sqlite3.Connection, read_only: bool = False) -> None:
+        """apply the pragmas of the profile to a connection"""
+        # the journal mode is persisted in the database file, only a writer can change it
+        if not read_only:
+            db.execute(f"PRAGMA journal_mode = {self.journal_mode}")
+        db.execute(f"PRAGMA synchronous = {self.synchronous}")
+        db.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+        db.execute(f"PRAGMA cache_size = {int(self.cache_size)}")
+        db.execute(f"PRAGMA temp_store = {self.temp_store}")
+        db.execute(f"PRAGMA foreign_keys = {'ON' if self.foreign_keys else 'OFF'}")
+
+    def close(self, db: sqlite3.Connection) -> None:
+        """close a connection, letting sqlite refresh its planner statistics first"""
+        if self.optimize_on_close:
+            try:
+                db.execute("PRAGMA optimize")
+            except sqlite3.Error:
+                pass
+        db.close()
@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import unicodedata
+from typing import ClassVar
+
+from ..cache import TTLCache
+from ..embedding.base import BaseEmbedder
+from ..repository.embedding_cache import EmbeddingCache
+from ..repository.store import Store
+
+
+class QueryEmbeddingCache:
+    """
+    Cache of search query embeddings.
+    Queries are keyed by their normalized text (unicode, case and whitespace) with the model and dimension of the
+    embedder, the embedder is given the query as it was written. The keys are in the query namespace of the embedding
+    cache: the normalized text of a query may be the text of a chunk, whose embedding differs.
+    The first tier is an in-memory LRU with a ttl, the optional second tier is the persistent embedding cache,
+    so popular queries survive restarts. Lookups never wait on the writer: second tier writes run in the background.
+    """
+    namespace: ClassVar[str] = "query\0"
+
+    def __init__(self, embedding_cache: EmbeddingCache | None = None, max_entries: int = 10_000, ttl: float | None = 3600.0):
+        self.embedding_cache = embedding_cache
+        self.memory: TTLCache[str, list[float]] = TTLCache(max_entries, ttl)
+        self.persistent_hits = 0
+        self.misses = 0
+        self._pending: dict[str, asyncio.Future] = {}
+        self._background: set[asyncio.Task] = set()
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        """normalize the query text, so trivially different queries share an embedding"""
+        return " ".join(unicodedata.normalize("NFKC", query).casefold().split())
+
+    async def embed(self, embedder: BaseEmbedder, query: str) -> list[float]:
+        """embed the query, only calling the embedder when it is in neither tier"""
+        key = EmbeddingCache.make_key(
+            embedder.get_model_name(), embedder.get_vector_dim(), self.normalize(query), self.namespace
+        )
+
+        while True:
+            embedding = self.memory.get(key)
+            if embedding is not None:
+                return embedding
+
+            # concurrent lookups of the same query share a single embedding call
+            pending = self._pending.get(key)
+            if pending is None:
+                break
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                # the caller embedding the query was cancelled, not this one: look it up again
+                if not pending.cancelled() or asyncio.current_task().cancelling():
+                    raise
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        try:
+            embedding = await self._embed(embedder, key, query)
+            future.set_result(embedding)
+            return embedding
+        except asyncio.CancelledError:
+            # the cancellation of this caller is not the one of the waiters, they retry on their own
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # the error is raised to this caller, waiters that did not come get nothing to retrieve
+            future.exception()
+            raise
+        finally:
+            del self._pending[key]
+
+    async def _embed(self, embedder: BaseEmbedder, key: str, query: str) -> list[float]:
+        embedding = None
+        if self.embedding_cache is not None:
+            found = await self.embedding_cache.lookup([key])
+            if key in found:
+                self.persistent_hits += 1
+                embedding = Store.deserialize_embeddings(found[key])
+
+        if embedding is None:
+            self.misses += 1
+            embedding = await embedder.embed(query)
+
+        self.memory.put(key, embedding)
+        if self.embedding_cache is not None:
+            # store the new entry, or refresh the last use of the found one
+            self._in_background(self.embedding_cache.put_many({key: embedding}))
+        return embedding
+
+    def _in_background(self, coroutine) -> None:
+        task = asyncio.create_task(coroutine)
+        self._background.add(task)
+        task.add_done_callback(self._background_done)
+
+    def _background_done(self, task: asyncio.Task) -> None:
+        self._background.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logging.warning(f"Failed to persist a query embedding: {task.exception()}")
+
+    def stats(self) -> dict:
+        """hit counters of both tiers, a lookup is a hit when it did not call the embedder"""
+        lookups = self.memory.hits + self.memory.misses
+        return {
+            "entries": len(self.memory),
+            "memory_hits": self.memory.hits,
+            "persistent_hits": self.persistent_hits,
+            "misses": self.misses,
+            "hit_rate": (lookups - self.misses) / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,208 @@
+import re
+import sqlite3
+from functools import lru_cache
+from typing import ClassVar
+
+
+class ProductRollup:
+    """
+    Turnover of the products aggregated by country, segment and launch year, kept in the products_rollup table.
+    The table is filled from products when it is created, then maintained by triggers on every insert, update
+    and delete of a product, so it is always in step with products, including within a transaction.
+
+    rewrite turns the eligible aggregate queries over products (SUM, TOTAL, AVG and COUNT of the products grouped
+    and filtered by country, segment and launch year) into the same query over the rollup, which reads a few hundred
+    rows instead of every product. The sums are added in a different order, so they may differ in the last digits.
+    """
+    table: ClassVar[str] = "products_rollup"
+    source: ClassVar[str] = "products"
+    # columns of products that are never NULL, counting them counts the rows
+    not_null_columns: ClassVar[set[str]] = {"id", "name", "description", "turnover", "launch_date", "country", "segment"}
+    # columns of products that are columns of the rollup as well, the launch year is only reached through launch_date
+    dimensions: ClassVar[set[str]] = {"country", "segment"}
+    # keywords and functions that can be kept in a query over the rollup
+    allowed_words: ClassVar[set[str]] = {
+        "select", "from", "where", "group", "by", "having", "order", "asc", "desc", "limit", "offset", "as",
+        "and", "or", "not", "in", "is", "null", "like", "glob", "between", "case", "when", "then", "else", "end",
+        "collate", "nocase", "cast", "integer", "real", "text", "numeric",
+        "coalesce", "round", "min", "max", "lower", "upper", "ifnull", "nullif", "abs", "substr", "length",
+    }
+    aggregates: ClassVar[set[str]] = {"sum", "total", "avg", "count"}
+    _tokens: ClassVar[re.Pattern] = re.compile(
+        r"(?P<space>\s+)|(?P<string>'(?:[^']|'')*')|(?P<number>\d+(?:\.\d*)?(?:[eE][+-]?\d+)?)"
+        r"|(?P<word>[A-Za-z_][A-Za-z0-9_]*)|(?P<operator><=|>=|<>|!=|==|\|\||[-+*/%(),=<>])"
+    )
+    _year_start: ClassVar[re.Pattern] = re.compile(r"'(\d{4})-01-01'")
+    _year_end: ClassVar[re.Pattern] = re.compile(r"'(\d{4})-12-31'")
+
+    @classmethod
+    def create(cls, db: sqlite3.Connection) -> None:
+        """
+        Create the rollup table and its triggers, the table is filled from products when it is created
+        """
+        columns = {column[1]: column[2] for column in db.execute(f"PRAGMA table_info({cls.table})")}
+        if columns.get("launch_year"):
+            # rollups of the first layout had a TEXT launch_year, which compares unlike STRFTIME to numbers
+            db.execute(f"DROP TABLE {cls.table}")
+            columns = {}
+        # launch_year is declared without a type, so that it has no affinity, like the STRFTIME expression it replaces:
+        # launch_year = 2020 is false for '2020' on the rollup as STRFTIME('%Y', launch_date) = 2020 is on products
+        db.execute(f"""CREATE TABLE IF NOT EXISTS {cls.table} (
+                country TEXT NOT NULL,
+                segment TEXT NOT NULL,
+                launch_year NOT NULL,
+                row_count INTEGER NOT NULL,
+                turnover_sum REAL NOT NULL,
+                PRIMARY KEY (country, segment, launch_year)
+            ) WITHOUT ROWID
+        """)
+        if not columns:
+            cls.rebuild(db)
+
+        add = f"""
+            INSERT INTO {cls.table} (country, segment, launch_year, row_count, turnover_sum)
+            VALUES (NEW.country, NEW.segment, STRFTIME('%Y', NEW.launch_date), 1, NEW.turnover)
+            ON CONFLICT (country, segment, launch_year) DO UPDATE SET
+                row_count = row_count + 1, turnover_sum = turnover_sum + excluded.turnover_sum;"""
+        remove = f"""
+            UPDATE {cls.table} SET row_count = row_count - 1, turnover_sum = turnover_sum - OLD.turnover
+            WHERE country = OLD.country AND segment = OLD.segment AND launch_year = STRFTIME('%Y', OLD.launch_date);
+            DELETE FROM {cls.table}
+            WHERE country = OLD.country AND segment = OLD.segment AND launch_year = STRFTIME('%Y', OLD.launch_date)
+                AND row_count = 0;"""
+        db.execute(f"CREATE TRIGGER IF NOT EXISTS {cls.table}_insert AFTER INSERT ON {cls.source} BEGIN {add} END")
+        db.execute(f"CREATE TRIGGER IF NOT EXISTS {cls.table}_delete AFTER DELETE ON {cls.source} BEGIN {remove} END")
+        db.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {cls.table}_update "
+            f"AFTER UPDATE OF country, segment, launch_date, turnover ON {cls.source} BEGIN {remove} {add} END"
+        )
+
+    @classmethod
+    def rebuild(cls, db: sqlite3.Connection) -> None:
+        """
+        Recompute the rollup from products, in the transaction of the caller
+        """
+        db.execute(f"DELETE FROM {cls.table}")
+        db.execute(f"""
+            INSERT INTO {cls.table} (country, segment, launch_year, row_count, turnover_sum)
+            SELECT country, segment, STRFTIME('%Y', launch_date), COUNT(*), SUM(turnover)
+            FROM {cls.source}
+            GROUP BY country, segment, STRFTIME('%Y', launch_date)
+        """)
+
+    @classmethod
+    @lru_cache(maxsize=1024)
+    def rewrite(cls, query: str) -> str | None:
+        """
+        The query over the rollup answering the same as the query over products, None when it is not eligible.
+        Only single table SELECT queries whose every column reference is a dimension (country, segment or the year
+        of launch_date) or inside an aggregate of turnover or of the rows are eligible.
+        """
+        query = query.strip().rstrip(";").strip()
+        tokens = None if "--" in query or "/*" in query else cls._tokenize(query)
+        if tokens is None:
+            return None
+        words = [value.lower() if kind == "word" else None for kind, value in tokens]
+        if words.count("select") != 1 or words.count("from") != 1 or "distinct" in words:
+            return None
+        # aliases named like a column of products could be resolved to the column, they are not trusted
+        significant = [word for (kind, _), word in zip(tokens, words) if kind != "space"]
+        aliases = {significant[index + 1] for index, word in enumerate(significant[:-1]) if word == "as"}
+        aliases -= cls.not_null_columns | {"source"}
+
+        rewritten, clause, aggregated, index = [], None, False, 0
+        while index < len(tokens):
+            kind, value = tokens[index]
+            word = words[index]
+            if word in {"select", "from", "where", "group", "having", "order", "limit"}:
+                clause = word
+            replacement = cls._match(tokens, words, index)
+            if replacement is not None:
+                text, length, aggregate = replacement
+                aggregated |= aggregate
+                rewritten.append(text)
+                index += length
+                continue
+            if word is not None:
+                if clause == "from":
+                    if word not in {"from", cls.source}:
+                        return None
+                    value = cls.table if word == cls.source else value
+                elif word in aliases and clause != "where" and not cls._called(tokens, index):
+                    pass
+                elif word in cls.aggregates or not (word in cls.allowed_words or word in cls.dimensions):
+                    # a column of products other than the dimensions, an unknown function or an aggregate of them
+                    return None
+            rewritten.append(value)
+            index += 1
+        return "".join(rewritten) if aggregated else None
+
+    @staticmethod
+    def _called(tokens: list[tuple[str, str]], index: int) -> bool:
+        """whether the word at index is followed by an opening parenthesis, a function call"""
+        following = next((value for kind, value in tokens[index + 1:] if kind != "space"), None)
+        return following == "("
+
+    @classmethod
+    def _tokenize(cls, query: str) -> list[tuple[str, str]] | None:
+        tokens, position = [], 0
+        while position < len(query):
+            match = cls._tokens.match(query, position)
+            if match is None:
+                # comments, parameters, quoted identifiers, qualified names and several statements are not rewritten
+                return None
+            tokens.append((match.lastgroup, match.group()))
+            position = match.end()
+        return tokens
+
+    @classmethod
+    def _match(cls, tokens: list[tuple[str, str]], words: list[str | None], index: int) -> tuple[str, int, bool] | None:
+        """the rollup text of the expression starting at index, its number of tokens and whether it is an aggregate"""
+        if tokens[index][0] == "space":
+            return None
+        # significant tokens from index, whitespace is skipped and counted
+        significant, positions = [], []
+        for position in range(index, min(len(tokens), index + 16)):
+            kind, value = tokens[position]
+            if kind != "space":
+                significant.append(words[position] if kind == "word" else value)
+                positions.append(position)
+        if not significant:
+            return None
+
+        def spanned(count: int) -> int:
+            return positions[count - 1] - index + 1
+
+        head = significant[0]
+        if head in cls.aggregates and significant[1:2] == ["("]:
+            argument = significant[2:4]
+            if argument == ["turnover", ")"]:
+                measure = {
+                    "sum": "SUM(turnover_sum)",
+                    "total": "TOTAL(turnover_sum)",
+                    "avg": "(SUM(turnover_sum) / SUM(row_count))",
+                    "count": "COALESCE(SUM(row_count), 0)",
+                }[head]
+                return measure, spanned(4), True
+            if head == "count" and len(argument) == 2 and argument[1] == ")" and (
+                argument[0] in {"*", "1"} or argument[0] in cls.not_null_columns
+            ):
+                return "COALESCE(SUM(row_count), 0)", spanned(4), True
+            return None
+        if head == "strftime" and significant[1:6] == ["(", "'%Y'", ",", "launch_date", ")"]:
+            return "launch_year", spanned(6), False
+        if head == "substr" and significant[1:8] == ["(", "launch_date", ",", "1", ",", "4", ")"]:
+            return "launch_year", spanned(8), False
+        if head == "launch_date" and len(significant) >= 3:
+            # bounds falling on a year boundary select whole years
+            operator, bound = significant[1], significant[2]
+            start, end = cls._year_start.fullmatch(bound), cls._year_end.fullmatch(bound)
+            if operator in {">=", "<"} and start:
+                return f"launch_year {operator} '{start.group(1)}'", spanned(3), False
+            if operator in {">", "<="} and end:
+                return f"launch_year {operator} '{end.group(1)}'", spanned(3), False
+            if operator == "between" and len(significant) >= 5 and significant[3] == "and":
+                low, high = cls._year_start.fullmatch(bound), cls._year_end.fullmatch(significant[4])
+                if low and high:
+                    return f"launch_year BETWEEN '{low.group(1)}' AND '{high.group(1)}'", spanned(5), False
+        return None
@@ -1,26 +1,172 @@
+from functools import partial
+import logging
 from pathlib import Path
+import re
 import struct
+from typing import Callable, ClassVar, TypeVar
 import sqlite_vec
 import sqlite3
 
 from ..embedding import get_embedder
+from ..index import VectorIndex, create_vector_index
+from ..repository.pool import ConnectionPool
+from ..repository.profile import ConnectionProfile
+from ..settings import get_settings
+
+T = TypeVar("T")
 
 
 class Store: 
     """
     Store class to manage the database connection and create the database tables
     """
-    def __init__(self, db_path: Path):
+    # vec0 column type and sql expression converting a float32 vector, per vector storage
+    vector_types: ClassVar[dict[str, str]] = {"float32": "FLOAT", "int8": "INT8", "binary": "BIT"}
+    quantizers: ClassVar[dict[str, str]] = {
+        "float32": "{}",
+        "int8": "vec_quantize_int8({}, 'unit')",
+        "binary": "vec_quantize_binary({})",
+    }
+
+    def __init__(self, db_path: Path, profile: ConnectionProfile | None = None, engine: str | None = None,
+                 storage: str | None = None, vector_dim: int | None = None):
         self.db_path = db_path
-        self._connection = self.create_db()
+        self.vector_dim = vector_dim or get_embedder().get_vector_dim()
+        self.profile = profile or ConnectionProfile.from_env()
+        settings = get_settings()
+        self.engine = engine or settings.vector_engine
+        self.storage = storage or settings.vector_storage
+        if self.storage not in self.vector_types:
+            raise ValueError(f"Unknown vector storage {self.storage}")
+        # every Store of the process opening this database shares the same pool
+        self._pool = ConnectionPool.acquire(
+            db_path,
+            self.create_db,
+            partial(self.connect, read_only=True),
+            self.profile.close,
+            settings.sqlite_readers,
+            settings.sqlite_health_check_interval,
+            self.profile,
+        )
+        self._connection = self._pool.writer_connection
+        # the storage and the dimension are chosen when the database is created, vectors cannot be mixed
+        recorded_storage = self._pool.read_blocking(self.get_metadata, "vector_storage")
+        if recorded_storage != self.storage:
+            self.close()
+            raise ValueError(f"{db_path} stores {recorded_storage} vectors, it cannot be opened with the {self.storage} storage")
+        recorded_dim = int(self._pool.read_blocking(self.get_metadata, "embedding_dim"))
+        if recorded_dim != self.vector_dim:
+            self.close()
+            raise ValueError(
+                f"{db_path} stores {recorded_dim}-dimensional vectors, it cannot be opened with {self.vector_dim} dimensions, "
+                f"migrate it with python -m wrangler.repository.migration"
+            )
+        # an index is loaded once per pool and engine, the writes of every Store keep all of them in sync
+        self._vector_indexes: dict[str, VectorIndex] = self._pool.shared("vector_indexes", dict)
+        self.vector_index: VectorIndex | None = self._pool.shared(f"vector_index:{self.engine}", self._load_vector_index)
 
-    def create_db(self) -> sqlite3.Connection:
+    def _load_vector_index(self) -> VectorIndex | None:
+        index = create_vector_index(self.engine, self.vector_dim, Path(f"{self.db_path}.{self.engine}"))
+        if index is not None:
+            # on the writer, so no write can slip between the load and the first staged change
+            self._pool.write_blocking(self._load_index, index)
+            self._vector_indexes[self.engine] = index
+        return index
+
+    def _load_index(self, db: sqlite3.Connection, index: VectorIndex) -> None:
+        # the vectors and their version are read from the same snapshot
+        in_transaction = db.in_transaction
+        if not in_transaction:
+            db.execute("BEGIN")
+        try:
+            index.load(db, self.vector_source, version=int(self.get_metadata(db, "vector_version")))
+        finally:
+            if not in_transaction:
+                db.commit()
+
+    async def sync_vector_index(self) -> VectorIndex | None:
         """
-        Create the database tables
+        The vector index of the engine, reloaded first when the chunk vectors were changed since it was loaded
+        by a write it did not see, such as the ones of another process sharing the database
         """
-        db = sqlite3.connect(self.db_path)
+        index = self.vector_index
+        if index is None:
+            return None
+        version = int(await self._pool.read(self.get_metadata, "vector_version"))
+        if index.version != version:
+            await self._pool.write(self._reload_vector_indexes)
+        return index
+
+    def _reload_vector_indexes(self, db: sqlite3.Connection) -> None:
+        version = int(self.get_metadata(db, "vector_version"))
+        for index in self.vector_indexes:
+            if index.version != version:
+                logging.info(f"Reloading the {type(index).__name__} of {self.db_path}, its vectors changed")
+                self._load_index(db, index)
+
+    @staticmethod
+    def bump_vector_version(db: sqlite3.Connection) -> int:
+        """
+        Count a change of the chunk vectors in the current transaction, without committing, returns the new version
+        """
+        return db.execute("""
+            INSERT INTO store_metadata (key, value) VALUES ('vector_version', '1')
+            ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + 1
+            RETURNING CAST(value AS INTEGER)
+        """).fetchone()[0]
+
+    def vectors_changed(self, db: sqlite3.Connection) -> None:
+        """
+        Record a change of the chunk vectors made in the current transaction. Every write of chunk vectors calls it,
+        the vector indexes of the other processes reload when they see the new version, the ones of this process
+        apply the staged changes and move to the new version once the transaction is committed.
+        """
+        version = self.bump_vector_version(db)
+        for index in self.vector_indexes:
+            index.stage_version(version - 1, version)
+
+    @property
+    def vector_indexes(self) -> list[VectorIndex]:
+        """
+        Every vector index of the database, the ones of the other engines included
+        """
+        return list(self._vector_indexes.values())
+
+    @property
+    def quantized(self) -> bool:
+        """
+        Whether the vec0 table holds quantized vectors, the full precision ones being kept in chunk_vectors
+        """
+        return self.storage != "float32"
+
+    @property
+    def vector_source(self) -> str:
+        """
+        Table holding the full precision vector of every chunk
+        """
+        return "chunk_vectors" if self.quantized else "chunk_embeddings"
+
+    def quantize_sql(self, placeholder: str) -> str:
+        """
+        Sql expression converting the float32 vector bound to placeholder to the vector storage of the store
+        """
+        return self.quantizers[self.storage].format(placeholder)
+
+    def connect(self, read_only: bool = False) -> sqlite3.Connection:
+        """
+        Open a connection to the database with the sqlite-vec extension loaded
+        """
+        db = self.profile.connect(self.db_path, read_only)
         db.enable_load_extension(True)
         sqlite_vec.load(db)
+        db.enable_load_extension(False)
+        return db
+
+    def create_db(self) -> sqlite3.Connection:
+        """
+        Create the database tables
+        """
+        db = self.connect()
 
         # if not exists we create the table documents
         db.execute("""CREATE TABLE IF NOT EXISTS documents (
@@ -43,11 +189,45 @@ class Store:
             )
         """)
 
-        embedder = get_embedder()
-        db.execute(f"""CREATE VIRTUAL TABLE IF NOT EXISTS chunk_embeddings USING vec0(
-                chunk_id INTEGER PRIMARY KEY,
-                embedding FLOAT[{embedder._vector_dim}]
+        # settings of the store fixed at creation
+        db.execute("""CREATE TABLE IF NOT EXISTS store_metadata (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            )
+        """)
+
+        storage = self.get_metadata(db, "vector_storage")
+        if storage is None:
+            # stores created before the metadata table only had float32 vectors
+            legacy = db.execute("SELECT 1 FROM sqlite_master WHERE name = 'chunk_embeddings'").fetchone()
+            storage = "float32" if legacy else self.storage
+            self.set_metadata(db, "vector_storage", storage)
+
+        vector_dim = self.get_metadata(db, "embedding_dim")
+        if vector_dim is None:
+            # stores created before the metadata table have the dimension in the definition of their vec0 table
+            legacy = db.execute("SELECT sql FROM sqlite_master WHERE name = 'chunk_embeddings'").fetchone()
+            vector_dim = re.search(r"\[(\d+)\]", legacy[0]).group(1) if legacy else str(self.vector_dim)
+            self.set_metadata(db, "embedding_dim", vector_dim)
+
+        self.create_vector_table(db, storage, int(vector_dim))
+        # counter of the changes of the chunk vectors, see vectors_changed
+        db.execute("INSERT OR IGNORE INTO store_metadata (key, value) VALUES ('vector_version', '0')")
+
+        if storage != "float32":
+            # full precision vectors, to re-score the candidates of the quantized search
+            db.execute("""CREATE TABLE IF NOT EXISTS chunk_vectors (
+                    chunk_id INTEGER PRIMARY KEY,
+                    embedding BLOB NOT NULL
                 )
+            """)
+
+        # embeddings already computed, keyed by a hash of the model, the dimension and the text
+        db.execute("""CREATE TABLE IF NOT EXISTS embedding_cache (
+                key TEXT PRIMARY KEY,
+                embedding BLOB NOT NULL,
+                last_used_at REAL NOT NULL
+            )
         """)
 
         # for full text search
@@ -60,24 +240,90 @@ class Store:
         
         # index for better performance 
         db.execute("""CREATE INDEX IF NOT EXISTS idx_chunks_document_id ON chunks(document_id)""")
+        db.execute("""CREATE INDEX IF NOT EXISTS idx_embedding_cache_last_used_at ON embedding_cache(last_used_at)""")
 
         db.commit()
 
         return db
     
+    @classmethod
+    def create_vector_table(cls, db: sqlite3.Connection, storage: str, vector_dim: int) -> None:
+        """
+        Create the vec0 table of the chunk embeddings for a vector storage and dimension
+        """
+        db.execute(f"""CREATE VIRTUAL TABLE IF NOT EXISTS chunk_embeddings USING vec0(
+                chunk_id INTEGER PRIMARY KEY,
+                embedding {cls.vector_types[storage]}[{vector_dim}]
+                )
+        """)
+
     @staticmethod
-    def serialize_embeddings(embeddings: list[float]) -> bytes:
+    def get_metadata(db: sqlite3.Connection, key: str) -> str | None:
+        """
+        Read a value of the store metadata
         """
-        Serialize the embeddings to a binary format
+        row = db.execute("SELECT value FROM store_metadata WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    @staticmethod
+    def set_metadata(db: sqlite3.Connection, key: str, value: str) -> None:
         """
+        Write a value of the store metadata, without committing
+        """
+        db.execute("INSERT OR REPLACE INTO store_metadata (key, value) VALUES (?, ?)", (key, value))
+
+    @staticmethod
+    def serialize_embeddings(embeddings: list[float], vector_dim: int | None = None) -> bytes:
+        """
+        Serialize the embeddings to a binary format, checking their dimension when one is given
+        """
+        if vector_dim is not None and len(embeddings) != vector_dim:
+            raise ValueError(f"Expected a {vector_dim}-dimensional embedding, got {len(embeddings)} dimensions")
         return struct.pack(f"{len(embeddings)}f", *embeddings)
+
+    @staticmethod
+    def deserialize_embeddings(data: bytes) -> list[float]:
+        """
+        Deserialize the embeddings from their binary format
+        """
+        return list(struct.unpack(f"{len(data) // 4}f", data))
     
+    async def read(self, fn: Callable[..., T], *args) -> T:
+        """
+        Run fn(connection, *args) on a read-only connection of the pool
+        """
+        return await self._pool.read(fn, *args)
+
+    async def write(self, fn: Callable[..., T], *args) -> T:
+        """
+        Run fn(connection, *args) on the writer connection of the pool
+        """
+        if not self._vector_indexes:
+            return await self._pool.write(fn, *args)
+        return await self._pool.write(self._write_indexed, fn, args)
+
+    def _write_indexed(self, db: sqlite3.Connection, fn: Callable[..., T], args: tuple) -> T:
+        """
+        Run a write job and apply the vector index changes it staged once the connection has committed them
+        """
+        try:
+            result = fn(db, *args)
+        except BaseException:
+            if not db.in_transaction:
+                for index in self.vector_indexes:
+                    index.rollback()
+            raise
+        if not db.in_transaction:
+            for index in self.vector_indexes:
+                index.commit()
+        return result
+
     def close(self) -> None:
         """
-        Close the database connection
+        Release the connection pool, closed once no other Store uses it
         """
         if self._connection is not None:
-            self._connection.close()
+            self._pool.release()
             self._connection = None
 
 
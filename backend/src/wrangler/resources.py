@@ -0,0 +1,53 @@
+import asyncio
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+
+from langchain_core.runnables import RunnableConfig
+
+from wrangler.pipeline import create_parse_pool
+from wrangler.ragUtil import RAGUtils
+from wrangler.repository.analytic import Analytic
+
+# The stores of the application are opened once per process and shared by every request and graph run.
+# They are created on first use (or at application startup) and closed on application shutdown.
+_lock = threading.Lock()
+_resources: "Resources | None" = None
+
+
+@dataclass
+class Resources:
+    """long lived handles shared by the API routes and the graph nodes"""
+    rag: RAGUtils
+    # the parse stage of every ingestion, so its worker processes are only spawned once
+    parse_pool: ProcessPoolExecutor = field(default_factory=create_parse_pool)
+
+    @property
+    def analytic(self) -> Analytic:
+        return self.rag.analytic
+
+    async def close(self) -> None:
+        await asyncio.to_thread(self.parse_pool.shutdown, cancel_futures=True)
+        await self.rag.close()
+
+
+def get_resources(config: RunnableConfig | None = None) -> Resources:
+    """get the resources injected in the graph config, or the ones of the process, opening them on first use"""
+    configurable = config.get("configurable", {}) if config else {}
+    if configurable.get("resources") is not None:
+        return configurable["resources"]
+
+    global _resources
+    with _lock:
+        if _resources is None:
+            _resources = Resources(rag=RAGUtils())
+        return _resources
+
+
+async def close_resources() -> None:
+    """close the resources of the process, meant to be called on application shutdown"""
+    global _resources
+    with _lock:
+        resources, _resources = _resources, None
+    if resources is not None:
+        await resources.close()
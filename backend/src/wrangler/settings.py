@@ -0,0 +1,171 @@
+import os
+from functools import lru_cache
+from typing import Any, Literal
+
+from pydantic import BaseModel, Field
+
+
+class Settings(BaseModel):
+    """Runtime settings of the wrangler package, overridable through environment variables."""
+
+    openai_max_connections: int = Field(
+        default=100,
+        metadata={"description": "Maximum number of concurrent HTTP connections to the OpenAI API."},
+    )
+
+    openai_max_keepalive_connections: int = Field(
+        default=20,
+        metadata={"description": "Maximum number of idle connections kept open for reuse."},
+    )
+
+    openai_keepalive_expiry: float = Field(
+        default=30.0,
+        metadata={"description": "Seconds an idle connection is kept alive before being closed."},
+    )
+
+    openai_timeout: float = Field(
+        default=60.0,
+        metadata={"description": "Timeout in seconds of a single request to the OpenAI API."},
+    )
+
+    embedding_cache_max_entries: int = Field(
+        default=100_000,
+        metadata={"description": "Maximum number of embeddings kept in the persistent embedding cache."},
+    )
+
+    embedding_provider: Literal["openai", "local"] = Field(
+        default="openai",
+        metadata={"description": "Embedding backend: the OpenAI API, or deterministic hashed n-gram vectors computed locally for offline runs and benchmarks."},
+    )
+
+    embedding_dimensions: int = Field(
+        default=1536,
+        metadata={"description": "Dimension of the embeddings requested from the model, text-embedding-3 models accept smaller values."},
+    )
+
+    embedding_batch_wait_ms: float = Field(
+        default=5.0,
+        metadata={"description": "Milliseconds concurrent embed calls are collected into one request, 0 disables micro-batching."},
+    )
+
+    embedding_batch_max_items: int = Field(
+        default=64,
+        metadata={"description": "Number of collected embed calls sending a batched request right away."},
+    )
+
+    query_embedding_cache_max_entries: int = Field(
+        default=10_000,
+        metadata={"description": "Maximum number of search query embeddings kept in memory."},
+    )
+
+    query_embedding_cache_ttl: float = Field(
+        default=3600.0,
+        metadata={"description": "Seconds a search query embedding is kept in memory."},
+    )
+
+    query_embedding_cache_persist: bool = Field(
+        default=True,
+        metadata={"description": "Also keep search query embeddings in the persistent embedding cache."},
+    )
+
+    ingest_parse_workers: int = Field(
+        default=4,
+        metadata={"description": "Number of processes parsing files during ingestion."},
+    )
+
+    ingest_embed_workers: int = Field(
+        default=4,
+        metadata={"description": "Number of files whose chunks are embedded concurrently during ingestion."},
+    )
+
+    ingest_queue_size: int = Field(
+        default=16,
+        metadata={"description": "Capacity of the queues between ingestion stages."},
+    )
+
+    ingest_stream_threshold_bytes: int = Field(
+        default=64 * 1024 * 1024,
+        metadata={"description": "Csv, markdown and text files from this size on are ingested as a stream instead of being loaded at once."},
+    )
+
+    ingest_stream_window: int = Field(
+        default=1024 * 1024,
+        metadata={"description": "Characters of a streamed file tokenized at once, bounding the memory used by its ingestion."},
+    )
+
+    ingest_stream_batch_size: int = Field(
+        default=256,
+        metadata={"description": "Chunks of a streamed file embedded and written together."},
+    )
+
+    analytic_cache_max_entries: int = Field(
+        default=1_000,
+        metadata={"description": "Maximum number of generated SQL queries, and of their results, kept in memory."},
+    )
+
+    analytic_cache_ttl: float = Field(
+        default=3600.0,
+        metadata={"description": "Seconds a generated SQL query or its result is kept in memory."},
+    )
+
+    analytic_cache_max_rows: int = Field(
+        default=10_000,
+        metadata={"description": "Results with more rows than this are not kept in the analytic result cache."},
+    )
+
+    vector_engine: Literal["vec0", "exact", "ivf"] = Field(
+        default="vec0",
+        metadata={"description": "Vector search engine: the vec0 table itself, an exact in-memory NumPy index over it, or an approximate ivf index."},
+    )
+
+    vector_storage: Literal["float32", "int8", "binary"] = Field(
+        default="float32",
+        metadata={"description": "Vectors stored in the vec0 table of a new store, quantized ones are re-scored with full precision copies."},
+    )
+
+    vector_rescore_factor: int = Field(
+        default=8,
+        metadata={"description": "Candidates fetched from a quantized vec0 table per requested result, before re-scoring."},
+    )
+
+    vector_index_mmap: bool = Field(
+        default=False,
+        metadata={"description": "Keep the in-memory vector index in a memory-mapped file beside the database."},
+    )
+
+    vector_index_nlist: int = Field(
+        default=0,
+        metadata={"description": "Number of ivf lists, 0 picks the square root of the number of vectors."},
+    )
+
+    vector_index_nprobe: int = Field(
+        default=8,
+        metadata={"description": "Number of ivf lists scanned per query, higher is slower with a better recall."},
+    )
+
+    sqlite_readers: int = Field(
+        default=4,
+        metadata={"description": "Number of read-only connections, each on its own thread, per sqlite database."},
+    )
+
+    sqlite_health_check_interval: float = Field(
+        default=30.0,
+        metadata={"description": "Seconds a pooled sqlite connection can stay idle before it is checked again."},
+    )
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        """Create a Settings instance from the environment."""
+        raw_values: dict[str, Any] = {
+            name: os.environ.get(name.upper()) for name in cls.model_fields.keys()
+        }
+
+        # Filter out None values
+        values = {k: v for k, v in raw_values.items() if v is not None}
+
+        return cls(**values)
+
+
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    return Settings.from_env()
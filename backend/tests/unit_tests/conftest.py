@@ -0,0 +1,30 @@
+import pytest
+
+from wrangler.embedding.local import LocalEmbedder
+from wrangler.repository.chunk import ChunkRepository
+from wrangler.repository.document import DocumentRepository
+from wrangler.repository.store import Store
+
+VECTOR_DIM = 64
+
+
+@pytest.fixture
+def embedder() -> LocalEmbedder:
+    return LocalEmbedder(VECTOR_DIM)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = Store(tmp_path / "rag.sqlite", engine="vec0", storage="float32", vector_dim=VECTOR_DIM)
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def chunk_repository(store, embedder) -> ChunkRepository:
+    return ChunkRepository(store, embedder)
+
+
+@pytest.fixture
+def document_repository(store, chunk_repository) -> DocumentRepository:
+    return DocumentRepository(store, chunk_repository)
@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+
+from wrangler.embedding.base import BaseEmbedder
+from wrangler.embedding.batching import MicroBatchEmbedder
+
+
+class FailingEmbedder(BaseEmbedder):
+    """embeds a text as its length, fails every batch holding a text over max_length"""
+    def __init__(self, max_length: int = 10):
+        super().__init__("failing", 1)
+        self.max_length = max_length
+        self.batches: list[list[str]] = []
+
+    async def embed(self, text: str) -> list[float]:
+        return (await self.embed_batch([text]))[0]
+
+    async def embed_batch(self, texts: list[str]) -> list[list[float]]:
+        self.batches.append(texts)
+        if any(len(text) > self.max_length for text in texts):
+            raise ValueError("text too long")
+        return [[float(len(text))] for text in texts]
+
+
+def test_a_failing_text_only_fails_its_callers():
+    embedder = FailingEmbedder()
+    batching = MicroBatchEmbedder(embedder, max_wait=0.01, max_items=64)
+    texts = ["a", "bb", "x" * 50, "ccc", "dddd", "bb", "x" * 50]
+
+    async def run():
+        return await asyncio.gather(*(batching.embed(text) for text in texts), return_exceptions=True)
+
+    results = asyncio.run(run())
+    for text, result in zip(texts, results):
+        if len(text) > embedder.max_length:
+            assert isinstance(result, ValueError)
+        else:
+            assert result == [float(len(text))]
+    # a single batch first, the duplicates are sent once
+    assert embedder.batches[0] == ["a", "bb", "x" * 50, "ccc", "dddd"]
+    assert batching.requests == len(embedder.batches)
+
+
+def test_a_successful_batch_is_sent_once():
+    embedder = FailingEmbedder()
+    batching = MicroBatchEmbedder(embedder, max_wait=0.01, max_items=64)
+
+    async def run():
+        return await asyncio.gather(*(batching.embed(text) for text in ["a", "bb", "a"]))
+
+    assert asyncio.run(run()) == [[1.0], [2.0], [1.0]]
+    assert embedder.batches == [["a", "bb"]]
+    assert batching.stats()["items"] == 3
+
+
+def test_a_failing_single_text_raises():
+    batching = MicroBatchEmbedder(FailingEmbedder(), max_wait=0.001)
+    with pytest.raises(ValueError):
+        asyncio.run(batching.embed("y" * 20))
@@ -0,0 +1,122 @@
+import asyncio
+import json
+import sqlite3
+
+import numpy as np
+import pytest
+
+from wrangler.model.document import Document
+from wrangler.repository.store import Store
+
+TEXTS = [
+    "alpha roulette wheel",
+    "bravo poker deck",
+    "charlie slot reel",
+    "delta bonus round",
+    "echo jackpot prize",
+]
+
+# charlie and alpha move, bravo is edited, delta is removed, echo is unchanged then repeated, foxtrot is added
+SYNCED_TEXTS = [
+    "charlie slot reel",
+    "alpha roulette wheel",
+    "bravo poker deck edited",
+    "foxtrot free spins",
+    "echo jackpot prize",
+    "echo jackpot prize",
+]
+
+
+def stored_chunks(db: sqlite3.Connection) -> dict[int, tuple[str, int]]:
+    return {
+        id: (content, json.loads(metadata)["order"])
+        for id, content, metadata in db.execute("SELECT id, content, metadata FROM chunks")
+    }
+
+
+def stored_embeddings(db: sqlite3.Connection) -> dict[int, list[float]]:
+    return {
+        chunk_id: Store.deserialize_embeddings(embedding)
+        for chunk_id, embedding in db.execute("SELECT chunk_id, embedding FROM chunk_embeddings")
+    }
+
+
+def fts_ids(db: sqlite3.Connection, word: str) -> set[int]:
+    return {id for id, in db.execute("SELECT rowid FROM chunks_fts WHERE chunks_fts MATCH ?", (word,))}
+
+
+def assert_tables_agree(store: Store, embedder) -> dict[int, tuple[str, int]]:
+    def check(db: sqlite3.Connection) -> None:
+        # the fts index of an external content table must match the chunks it was given
+        db.execute("INSERT INTO chunks_fts (chunks_fts, rank) VALUES ('integrity-check', 1)")
+        db.commit()
+
+    store._pool.write_blocking(check)
+    chunks = store._pool.read_blocking(stored_chunks)
+    embeddings = store._pool.read_blocking(stored_embeddings)
+    assert embeddings.keys() == chunks.keys()
+    for id, (content, _) in chunks.items():
+        expected = asyncio.run(embedder.embed(content))
+        np.testing.assert_allclose(embeddings[id], expected, rtol=1e-6, atol=1e-7)
+    for id, (content, _) in chunks.items():
+        for word in content.split():
+            assert id in store._pool.read_blocking(fts_ids, word)
+    return chunks
+
+
+@pytest.fixture
+def document(document_repository) -> Document:
+    document = Document(content="\n".join(TEXTS), uri="games.md")
+    return asyncio.run(document_repository.create(document, chunk_texts=TEXTS))
+
+
+@pytest.mark.parametrize("incremental", [True, False], ids=["incremental", "recreated"])
+def test_sync_keeps_the_chunk_tables_in_agreement(store, embedder, document_repository, document, incremental):
+    before = assert_tables_agree(store, embedder)
+    ids = {content: id for id, (content, _) in before.items()}
+
+    document.content = "\n".join(SYNCED_TEXTS)
+    asyncio.run(document_repository.update(document, incremental=incremental, chunk_texts=SYNCED_TEXTS))
+
+    after = assert_tables_agree(store, embedder)
+    assert [content for content, _ in sorted(after.values(), key=lambda chunk: chunk[1])] == SYNCED_TEXTS
+    assert sorted(order for _, order in after.values()) == list(range(len(SYNCED_TEXTS)))
+    if incremental:
+        # the unchanged and the moved chunks keep their rows, only the changed content is rewritten
+        for content in ["alpha roulette wheel", "charlie slot reel", "echo jackpot prize"]:
+            assert after[ids[content]][0] == content
+        assert ids["echo jackpot prize"] in after and after[ids["echo jackpot prize"]][1] == 4
+        assert ids["bravo poker deck"] not in after
+        assert ids["delta bonus round"] not in after
+        assert len(after.keys() - before.keys()) == 3
+    else:
+        assert not after.keys() & before.keys()
+
+    # the removed words are gone from the fts index
+    assert not store._pool.read_blocking(fts_ids, "delta")
+    assert store._pool.read_blocking(fts_ids, "bravo") == store._pool.read_blocking(fts_ids, "edited")
+
+
+def test_unchanged_sync_writes_nothing(store, embedder, document_repository, document):
+    before = assert_tables_agree(store, embedder)
+    asyncio.run(document_repository.update(document, chunk_texts=TEXTS))
+    assert assert_tables_agree(store, embedder) == before
+
+
+def test_deleting_the_document_removes_its_chunks(store, embedder, document_repository, document):
+    assert asyncio.run(document_repository.delete(document.id))
+    assert assert_tables_agree(store, embedder) == {}
+    assert not store._pool.read_blocking(fts_ids, "roulette")
+
+
+def test_new_chunks_get_fresh_ids(store, embedder, document_repository, document):
+    before = store._pool.read_blocking(stored_chunks)
+    document.content = "\n".join(TEXTS[:-1])
+    asyncio.run(document_repository.update(document, chunk_texts=TEXTS[:-1]))
+    document.content = "\n".join(SYNCED_TEXTS)
+    asyncio.run(document_repository.update(document, chunk_texts=SYNCED_TEXTS))
+
+    after = assert_tables_agree(store, embedder)
+    new_ids = sorted(after.keys() - before.keys())
+    # the ids of a batch are consecutive and a deleted id is never given again
+    assert new_ids == list(range(max(before) + 1, max(before) + 1 + len(new_ids)))
@@ -0,0 +1,35 @@
+import asyncio
+
+from wrangler.repository.query_embedding_cache import QueryEmbeddingCache
+
+
+def test_query_entries_do_not_answer_chunk_lookups(chunk_repository, embedder):
+    async def run():
+        cache = QueryEmbeddingCache(chunk_repository.embedding_cache)
+        # normalizes to the text of the chunk, but is embedded as written
+        query_embedding = await cache.embed(embedder, "Roulette   Payout  Table")
+        await asyncio.gather(*cache._background)
+
+        chunk_embeddings, computed = await chunk_repository.embedding_cache.fetch(embedder, ["roulette payout table"])
+        return query_embedding, chunk_embeddings[0], computed
+
+    query_embedding, chunk_embedding, computed = asyncio.run(run())
+    expected = asyncio.run(embedder.embed("roulette payout table"))
+    assert computed, "the chunk was answered by the query entry"
+    assert chunk_embedding == expected
+    assert query_embedding != expected
+
+
+def test_query_entries_are_shared_by_normalized_queries(chunk_repository, embedder):
+    async def run():
+        cache = QueryEmbeddingCache(chunk_repository.embedding_cache)
+        first = await cache.embed(embedder, "Roulette payout")
+        await asyncio.gather(*cache._background)
+        # a new process only has the persistent tier
+        restarted = QueryEmbeddingCache(chunk_repository.embedding_cache)
+        second = await restarted.embed(embedder, "  roulette   PAYOUT ")
+        return first, second, restarted.persistent_hits
+
+    first, second, persistent_hits = asyncio.run(run())
+    assert first == second
+    assert persistent_hits == 1
@@ -0,0 +1,151 @@
+import csv
+import math
+import random
+import sqlite3
+from datetime import date, timedelta
+
+import pytest
+
+from wrangler.repository.analytic import Analytic
+from wrangler.repository.rollup import ProductRollup
+
+COUNTRIES = ["Belgium", "France", "Malta", "UK"]
+SEGMENTS = ["Low", "Medium", "High"]
+
+REWRITTEN = {
+    "sum_by_segment": "SELECT segment, SUM(turnover) FROM products WHERE country = 'Belgium' GROUP BY segment ORDER BY segment",
+    "count_by_country": "SELECT country, COUNT(*) AS products FROM products GROUP BY country ORDER BY products DESC, country",
+    "average_by_year": (
+        "SELECT STRFTIME('%Y', launch_date) AS year, AVG(turnover) AS average FROM products "
+        "WHERE launch_date >= '2018-01-01' GROUP BY year ORDER BY year"
+    ),
+    "total_in_2020": (
+        "SELECT TOTAL(turnover) FROM products WHERE launch_date >= '2020-01-01' AND launch_date < '2021-01-01' "
+        "AND segment = 'High'"
+    ),
+    "year_between": (
+        "SELECT country, COUNT(id) FROM products WHERE launch_date BETWEEN '2016-01-01' AND '2019-12-31' "
+        "GROUP BY country ORDER BY country"
+    ),
+    # the year is text, like STRFTIME it never equals a number, both select nothing
+    "year_equals_number": (
+        "SELECT country, SUM(turnover) FROM products WHERE STRFTIME('%Y', launch_date) = 2020 GROUP BY country ORDER BY country"
+    ),
+    "year_as_integer": (
+        "SELECT CAST(SUBSTR(launch_date, 1, 4) AS INTEGER) AS year, COUNT(*) FROM products "
+        "WHERE CAST(STRFTIME('%Y', launch_date) AS INTEGER) >= 2020 GROUP BY year ORDER BY year"
+    ),
+    "aliased_columns": (
+        "SELECT country AS market, segment AS tier, SUM(turnover) AS revenue, COUNT(*) AS n FROM products "
+        "GROUP BY market, tier HAVING revenue > 1 ORDER BY revenue DESC, market, tier LIMIT 5"
+    ),
+    "empty_selection": "SELECT COUNT(*), SUM(turnover) FROM products WHERE country = 'Nowhere'",
+}
+
+NOT_REWRITTEN = {
+    "not_aggregated": "SELECT country FROM products GROUP BY country",
+    "other_column": "SELECT name, SUM(turnover) FROM products GROUP BY name",
+    "day_filter": "SELECT SUM(turnover) FROM products WHERE launch_date >= '2020-03-15'",
+    "alias_named_like_a_column": "SELECT country AS name, SUM(turnover) FROM products GROUP BY name",
+    "distinct": "SELECT COUNT(DISTINCT country) FROM products",
+    "aggregate_of_a_column": "SELECT MAX(turnover) FROM products",
+    "two_statements": "SELECT SUM(turnover) FROM products; DELETE FROM products",
+    "comment": "SELECT SUM(turnover) FROM products -- all",
+    "join": "SELECT SUM(p.turnover) FROM products p JOIN products q ON p.id = q.id",
+}
+
+
+def write_products(path, products: int = 400, seed: int = 0) -> None:
+    rng = random.Random(seed)
+    with path.open("w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["id", "name", "description", "turnover", "launch_date", "country", "segment"])
+        for index in range(products):
+            launch = date(2014, 1, 1) + timedelta(days=rng.randrange(3650))
+            writer.writerow([
+                index, f"Game {index}", "Synthetic product", round(rng.random(), 2), launch.strftime("%d/%m/%Y"),
+                rng.choice(COUNTRIES), rng.choice(SEGMENTS),
+            ])
+
+
+def same_rows(left: list, right: list) -> bool:
+    # the rollup adds the turnovers in another order
+    return len(left) == len(right) and all(
+        len(x) == len(y) and all(
+            a == b or (isinstance(a, float) and isinstance(b, float) and math.isclose(a, b, rel_tol=1e-9))
+            for a, b in zip(x, y)
+        )
+        for x, y in zip(left, right)
+    )
+
+
+def rollup_rows(db: sqlite3.Connection) -> list:
+    return db.execute(
+        f"SELECT country, segment, launch_year, row_count, ROUND(turnover_sum, 6) FROM {ProductRollup.table} "
+        "ORDER BY 1, 2, 3"
+    ).fetchall()
+
+
+def products_aggregate(db: sqlite3.Connection) -> list:
+    return db.execute(
+        "SELECT country, segment, STRFTIME('%Y', launch_date), COUNT(*), ROUND(SUM(turnover), 6) FROM products "
+        "GROUP BY 1, 2, 3 ORDER BY 1, 2, 3"
+    ).fetchall()
+
+
+@pytest.fixture
+def analytic(tmp_path):
+    write_products(tmp_path / "products.csv")
+    analytic = Analytic(tmp_path / "analytic.sqlite")
+    analytic.load_csv(tmp_path / "products.csv")
+    yield analytic
+    analytic.close()
+
+
+@pytest.mark.parametrize("name", REWRITTEN.keys())
+def test_rewritten_queries_match_the_scan(analytic, name):
+    query = REWRITTEN[name]
+    assert ProductRollup.rewrite(query) is not None
+    scan = analytic.execute_query(query, rollups=False)
+    assert scan or name == "year_equals_number", "the query should select products"
+    assert same_rows(analytic.execute_query(query), scan)
+
+
+@pytest.mark.parametrize("query", NOT_REWRITTEN.values(), ids=NOT_REWRITTEN.keys())
+def test_ineligible_queries_are_not_rewritten(query):
+    assert ProductRollup.rewrite(query) is None
+
+
+def test_triggers_keep_the_rollup_in_sync(analytic):
+    def change(db: sqlite3.Connection) -> tuple[list, list]:
+        db.execute(
+            "INSERT INTO products (id, name, description, turnover, launch_date, country, segment) "
+            "VALUES (10000, 'New', 'New product', 0.5, '2031-05-01', 'Spain', 'High')"
+        )
+        db.execute("UPDATE products SET turnover = turnover + 1 WHERE id % 7 = 0")
+        db.execute("UPDATE products SET country = 'Spain', launch_date = '2031-01-01' WHERE id % 11 = 0")
+        db.execute("UPDATE products SET segment = 'Low' WHERE id % 13 = 0")
+        db.execute("DELETE FROM products WHERE id % 5 = 0")
+        # the rollup follows within the transaction
+        inside = rollup_rows(db), products_aggregate(db)
+        db.commit()
+        return inside
+
+    inside_rollup, inside_products = analytic._pool.write_blocking(change)
+    assert inside_rollup == inside_products
+    assert analytic._pool.read_blocking(rollup_rows) == analytic._pool.read_blocking(products_aggregate)
+    # no group is left with no products
+    assert analytic.execute_query(f"SELECT COUNT(*) FROM {ProductRollup.table} WHERE row_count <= 0") == [(0,)]
+
+    query = REWRITTEN["count_by_country"]
+    assert same_rows(analytic.execute_query(query), analytic.execute_query(query, rollups=False))
+
+
+def test_rebuild_recomputes_the_rollup(analytic):
+    def rebuild(db: sqlite3.Connection) -> list:
+        db.execute(f"UPDATE {ProductRollup.table} SET row_count = 0, turnover_sum = 0")
+        ProductRollup.rebuild(db)
+        db.commit()
+        return rollup_rows(db)
+
+    assert analytic._pool.write_blocking(rebuild) == analytic._pool.read_blocking(products_aggregate)
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from wrangler.index.exact import ExactIndex
+from wrangler.index.ivf import IVFIndex
+
+VECTOR_DIM = 16
+
+
+def vectors(count: int, seed: int) -> np.ndarray:
+    return np.random.default_rng(seed).standard_normal((count, VECTOR_DIM)).astype(np.float32)
+
+
+@pytest.mark.parametrize("index_class", [ExactIndex, IVFIndex])
+def test_writes_leave_the_published_snapshot_unchanged(index_class):
+    index = index_class(VECTOR_DIM, initial_capacity=4096)
+    ids = np.arange(2000, dtype=np.int64)
+    index.add(ids, vectors(2000, seed=0))
+    if isinstance(index, IVFIndex):
+        index.train()
+
+    snapshot = index._snapshot
+    copies = [None if array is None else array.copy() for array in snapshot]
+    results = index.search_many(vectors(5, seed=1), 10)
+
+    updated = vectors(500, seed=2)
+    index.add(ids[:500], updated)
+    index.remove(ids[500:700])
+    if isinstance(index, IVFIndex):
+        index.train(seed=1)
+
+    # a search holding the previous snapshot still reads the previous vectors
+    for array, copy in zip(snapshot, copies):
+        if array is not None:
+            np.testing.assert_array_equal(array, copy)
+    index._snapshot = snapshot
+    assert index.search_many(vectors(5, seed=1), 10) == results
+
+    index._publish()
+    assert len(index) == 1800
+    for chunk_id, vector in zip(ids[:500:50].tolist(), updated[::50]):
+        assert index.search(vector, 1)[0][0] == chunk_id
+    found = {chunk_id for result in index.search_many(vectors(50, seed=3), 50) for chunk_id, _ in result}
+    assert not found & set(range(500, 700))